@@ -4,8 +4,23 @@ import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
 from datetime import datetime
+import copy
 import io
-import pyodbc
+from motor_dados import (
+    init_connection, ler_sql, planejar_queries, buscar_tabelas, extrair_em_paralelo, cache_resultados,
+    cache_analises, assinatura_filtros,
+    preparar_fato, entrelacar_dimensoes, mapear_metricas, criar_dimensoes_quanticas,
+    indexar_dimensoes, IndicePeriodos, IndiceFiltros, FILTROS_DIMENSOES,
+    periodo, MODOS_PERIODO, intervalo_periodos, intervalo_dos_filtros, ano_mes, rotulo_periodo, rotulo_intervalo,
+    somas_contabeis, metricas_contabeis, CuboOLAP,
+    SeriesHistoricas, mensal_contabil, LivroCaixa, continuo_por_periodo, data_do_periodo,
+    CHAVE_UNIVERSO, ALIASES_DIMENSOES, LIMITE_MESES_INCREMENTAIS, query_marca_dagua,
+    detectar_meses_alterados, filtrar_query_por_meses, substituir_meses, chave_periodo,
+    config_motor, fonte_dados, query_versao_fontes, sondar_versao_fontes, tabelas_alteradas, chave_snapshot,
+    salvar_snapshot, carregar_snapshot, AtualizadorUniverso, MensagensCarga, formatar_idade,
+)
+
+NOME_SNAPSHOT = "app_v6"
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # FUNÇÃO HELPER DE FORMATAÇÃO
@@ -208,40 +223,6 @@ st.markdown("""
 # MOTOR DE CONEXÃO COM BANCO DE DADOS
 # ═══════════════════════════════════════════════════════════════════════════════
 
-@st.cache_resource
-def init_connection():
-    """Cria e retorna a conexão com o banco de dados."""
-    try:
-        DB_SERVER = st.secrets["db_credentials"]["server"]
-        DB_DATABASE = st.secrets["db_credentials"]["database"]
-        DB_USERNAME = st.secrets["db_credentials"]["username"]
-        DB_PASSWORD = st.secrets["db_credentials"]["password"]
-
-        conn_str = (
-            f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-            f"SERVER={DB_SERVER};"
-            f"DATABASE={DB_DATABASE};"
-            f"UID={DB_USERNAME};"
-            f"PWD={DB_PASSWORD};"
-            f"TrustServerCertificate=yes;"
-        )
-        return pyodbc.connect(conn_str, timeout=30)
-    except Exception as e:
-        st.error(f"❌ Erro de Conexão com Banco de Dados: {e}")
-        return None
-
-@st.cache_data(ttl=600)
-def run_query(query, _conn):
-    """Executa a query e retorna um DataFrame."""
-    if not _conn:
-        st.error("Conexão com banco de dados inválida.")
-        return pd.DataFrame()
-    try:
-        return pd.read_sql(query, _conn)
-    except Exception as e:
-        st.warning(f"⚠️ Falha ao executar query: {e}")
-        return pd.DataFrame()
-
 @st.cache_data
 def to_excel(df_rec, df_pag):
     """Converte DataFrames para Excel em memória."""
@@ -253,207 +234,302 @@ def to_excel(df_rec, df_pag):
             df_pag.to_excel(writer, sheet_name='A_Pagar', index=False)
     return output.getvalue()
 # ═══════════════════════════════════════════════════════════════════════════════
-# MOTOR DE RACIOCÍNIO QUÂNTICO (CRQ) - CORRIGIDO
+# UNIVERSO DE DADOS COMPARTILHADO (SOMENTE LEITURA, UM POR PROCESSO)
 # ═══════════════════════════════════════════════════════════════════════════════
 
-class CoreQuantumReasoning:
-    def __init__(self):
+class UniversoDados:
+    """
+    Dados carregados uma vez por processo e compartilhados por todas as sessões.
+    Nenhuma sessão altera estes DataFrames; com Copy-on-Write (pandas 3) filtros e
+    colunas derivadas geram cópias próprias sem tocar no original. Progresso, avisos e erros
+    da carga vão para `mensagens` (MensagensCarga; silencioso em segundo plano).
+    """
+    def __init__(self, mensagens=None):
+        mensagens = mensagens or MensagensCarga()
         self.conn = init_connection()
         self.df_cr_full = pd.DataFrame()
         self.df_cp_full = pd.DataFrame()
-        self.df_tec_full = pd.DataFrame()
-        self.df_cli_full = pd.DataFrame()
-        self.filtros_ativos = {}
+        self.dimensoes = {}
+        self.indices_dimensoes = {}
+        self.relatorio_juncoes = []
+        self.juncoes_no_servidor = False
+        self.marca_dagua = pd.DataFrame()
+        self.versao_fontes = pd.DataFrame()
 
         if self.conn:
-            with st.spinner('🌌 Carregando Universo de Dados do Banco...'):
-                self.dados_universo = self.load_universo_dados()
+            with mensagens.etapa('🌌 Carregando Universo de Dados do Banco...'):
+                self.dados_universo = self.load_universo_dados(mensagens)
         else:
-            st.error("Falha na inicialização do CRQ: Conexão com banco de dados falhou.")
+            mensagens.erro("Falha na inicialização do CRQ: Conexão com banco de dados falhou.")
             self.dados_universo = pd.DataFrame()
+        self._indexar_universo()
 
-        self.estado_quantum = self.dados_universo.copy() if not self.dados_universo.empty else pd.DataFrame()
-        self.padroes_ocultos = {}
-        self.prescricoes_ativas = []
-        self.assinatura_historica = {}
 
-    def load_universo_dados(self):
+    def load_universo_dados(self, mensagens):
         if not self.conn:
             return pd.DataFrame()
 
-        QUERIES = {
-            "g": "SELECT * FROM Tb_GestorFin2",
-            "cr": "SELECT * FROM [Contas Receber]",
-            "cp": "SELECT * FROM [Contas Pagar]",
-            "p": "SELECT * FROM tb_Proj",
-            "tec": "SELECT * FROM tb_tec",
-            "cli": "SELECT * FROM tb_cli",
-            "tp": "SELECT * FROM tb_tipoproj",
-            "neg": "SELECT * FROM tb_neg",
-            "st": "SELECT * FROM tb_StatusProj",
-        }
+        QUERIES, self.juncoes_no_servidor = planejar_queries(self.conn)
 
-        dfs = {}
-        all_loaded = True
-        with st.spinner("Conectando e buscando dados mestre..."):
-            for name, query in QUERIES.items():
-                dfs[name] = run_query(query, self.conn)
-                if dfs[name].empty and name == 'g':
-                    all_loaded = False
+        # Snapshot local: se a versão das fontes e o esquema não mudaram, evita o ETL completo
+        usar_snapshot = config_motor("snapshot_ativo", True)
+        versao_fontes = None
+        if usar_snapshot:
+            try:
+                versao_fontes = sondar_versao_fontes(self.conn)
+                chave_atual = chave_snapshot(NOME_SNAPSHOT, QUERIES, versao_fontes)
+                snapshot = carregar_snapshot(NOME_SNAPSHOT, chave_atual)
+            except Exception:
+                snapshot = None
+            if snapshot is not None:
+                self._restaurar_snapshot(snapshot)
+                self.versao_fontes = versao_fontes
+                mensagens.sucesso("Universo de Dados restaurado do snapshot local.")
+                return snapshot['universo']
+
+        queries_base = dict(QUERIES)
+        QUERIES['marca'] = query_marca_dagua()
+        QUERIES['versao'] = query_versao_fontes()
+
+        with mensagens.etapa("Conectando e buscando dados mestre..."):
+            dfs = buscar_tabelas(QUERIES, self.conn, versao=versao_fontes, mensagens=mensagens)
+            all_loaded = not dfs['g'].empty
+
+        if not all_loaded and self.juncoes_no_servidor:
+            # As junções no servidor falharam: refaz a busca com as junções em pandas
+            mensagens.aviso("⚠️ Junções no servidor indisponíveis; usando junções locais.")
+            QUERIES, self.juncoes_no_servidor = planejar_queries(self.conn, pushdown=False)
+            queries_base = dict(QUERIES)
+            QUERIES['marca'] = query_marca_dagua()
+            QUERIES['versao'] = query_versao_fontes()
+            with mensagens.etapa("Conectando e buscando dados mestre..."):
+                dfs = buscar_tabelas(QUERIES, self.conn, versao=versao_fontes, mensagens=mensagens)
+                all_loaded = not dfs['g'].empty
 
         if not all_loaded or 'g' not in dfs or dfs['g'].empty:
-            st.error("Tabela Fato (Tb_GestorFin2) está vazia.")
+            mensagens.erro("Tabela Fato (Tb_GestorFin2) está vazia.")
             return pd.DataFrame()
         
         # Armazena cópias das tabelas brutas para uso posterior
         self.df_cr_full = dfs.get('cr', pd.DataFrame()).copy()
         self.df_cp_full = dfs.get('cp', pd.DataFrame()).copy()
-        self.df_tec_full = dfs.get('tec', pd.DataFrame()).copy()
-        self.df_cli_full = dfs.get('cli', pd.DataFrame()).copy()
+        self.dimensoes = {alias: dfs[alias] for alias in ALIASES_DIMENSOES if alias in dfs}
+        self.indices_dimensoes = indexar_dimensoes(self.dimensoes)
+        self.marca_dagua = dfs['marca']
+        self.versao_fontes = dfs['versao']
 
         try:
-            df_fato = dfs['g']
-            df_fato['ConsultGest'] = pd.to_numeric(df_fato['ConsultGest'], errors='coerce')
-            df_fato['ProjGest'] = pd.to_numeric(df_fato['ProjGest'], errors='coerce')
-            df_fato['Ano'] = pd.to_numeric(df_fato['Ano'].astype(str).str.strip(), errors='coerce')
-            df_fato['Mes'] = pd.to_numeric(df_fato['Mes'].astype(str).str.strip(), errors='coerce')
-            df_fato = df_fato.dropna(subset=['Ano', 'Mes', 'ConsultGest', 'ProjGest'])
-            df_fato['Ano'] = df_fato['Ano'].astype(int)
-            df_fato['Mes'] = df_fato['Mes'].astype(int)
-
+            df_fato = preparar_fato(dfs['g'])
         except Exception as e:
-            st.error(f"Erro na preparação dos dados: {e}")
+            mensagens.erro(f"Erro na preparação dos dados: {e}")
             return pd.DataFrame()
 
-        # Executar Joins
-        with st.spinner("Entrelaçando dimensões..."):
-            df = df_fato
-            
-            def safe_merge(df_left, df_right, **kwargs):
-                if df_right.empty:
-                    return df_left
-                return pd.merge(df_left, df_right, **kwargs)
-
-            df = safe_merge(df, dfs['tec'], left_on='ConsultGest', right_on='AutNumTec', how='left')
-            df = safe_merge(df, dfs['p'], left_on='ProjGest', right_on='AutNumProj', how='left', suffixes=('', '_proj'))
-            df = safe_merge(df, dfs['cli'], left_on='CodCliProj', right_on='AutNumCli', how='left')
-            df = safe_merge(df, dfs['tp'], left_on='TipoProj', right_on='AutNumTipo', how='left')
-            df = safe_merge(df, dfs['neg'], left_on='CodNegProj', right_on='AutNumNeg', how='left')
-            df = safe_merge(df, dfs['st'], left_on='StatusProj', right_on='AutNumStatus', how='left')
+        df = self._montar_universo(df_fato, mensagens, self.relatorio_juncoes)
 
-        # Mapeamento e Métricas
-        with st.spinner("Mapeando colunas e criando métricas..."):
-            if 'TipoProj' in df.columns and 'DescTipo' in df.columns:
-                df = df.rename(columns={'TipoProj': 'TipoProj_ID'})
-
-            mapa_colunas = {
-                'QtHrReal': 'Hrs_Real', 'QtHrOrc': 'Hrs_Prev', 'ReceitaReal': 'Receita',
-                'CustoReal': 'Custo', 'PercMgReal': 'Margem_Fracao', 'VlHrOrc': 'VH_Venda',
-                'VlHrCusto': 'VH_Custo', 'ReceitaOrc': 'Receita_Orc', 'CustoOrc': 'Custo_Orc',
-                'VlTTFat': 'Vl_Faturado_Contrato', 'NomeTec': 'Consultor', 'DescCli': 'Cliente',
-                'DescProj': 'Projeto', 'DescTipo': 'TipoProj',
-            }
+        # A chave gravada usa a versão lida junto com os dados (que podem vir do cache de queries)
+        if usar_snapshot and not dfs['versao'].empty:
+            with mensagens.etapa("Gravando snapshot local do universo..."):
+                salvar_snapshot(
+                    NOME_SNAPSHOT, chave_snapshot(NOME_SNAPSHOT, queries_base, dfs['versao']),
+                    {'universo': df, 'cr': self.df_cr_full, 'cp': self.df_cp_full,
+                     'marca': self.marca_dagua, **self.dimensoes},
+                    mensagens
+                )
 
-            cols_existentes = {k: v for k, v in mapa_colunas.items() if k in df.columns}
-            df = df.rename(columns=cols_existentes)
-            
-            colunas_numericas_app = ['Hrs_Real', 'Hrs_Prev', 'Receita', 'Custo', 'Margem_Fracao',
-                                   'VH_Venda', 'VH_Custo', 'Receita_Orc', 'Custo_Orc', 'Vl_Faturado_Contrato']
-            
-            for col in colunas_numericas_app:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-                else:
-                    df[col] = 0
-            
-            df['Margem'] = np.where(df['Receita'] > 0, (df['Receita'] - df['Custo']) / df['Receita'], 0)
-            df['Lucro'] = df['Receita'] - df['Custo']
-            df['Desvio_Hrs'] = df['Hrs_Real'] - df['Hrs_Prev']
-            df['Eficiencia'] = np.where(df['Hrs_Prev'] > 0, (df['Hrs_Real'] / df['Hrs_Prev']), 1)
-            df['ROI_Hora'] = np.where(df['Hrs_Real'] > 0, df['Lucro'] / df['Hrs_Real'], 0)
-            df['Produtividade'] = np.where(df['Hrs_Real'] > 0, df['Receita'] / df['Hrs_Real'], 0)
-            
-            df['Data'] = pd.to_datetime(df['Ano'].astype(str) + '-' + df['Mes'].astype(str) + '-01', errors='coerce')
-            df = df.dropna(subset=['Data'])
+        mensagens.sucesso("Universo de Dados Carregado e Sincronizado.")
+        return df
 
-        # Dimensões Quânticas
-        with st.spinner("Criando dimensões quânticas..."):
-            df = df.reset_index(drop=True)
-            
-            df['Sangria_Risco_Absoluto'] = np.where(
-                df['Hrs_Real'] > df['Hrs_Prev'],
-                (df['Hrs_Real'] - df['Hrs_Prev']) * df['VH_Custo'], 0
-            )
-            df['Ociosidade_Risco_Absoluto'] = np.where(
-                df['Hrs_Real'] < df['Hrs_Prev'],
-                (df['Hrs_Prev'] - df['Hrs_Real']) * (df['VH_Venda'] - df['VH_Custo']), 0
-            )
+    def _indexar_universo(self):
+        # Índices somente leitura sobre o universo: deslocamentos por período e listas por valor
+        self.indice_periodos = IndicePeriodos(self.dados_universo)
+        self.indice_filtros = IndiceFiltros(self.dados_universo)
+        self.somas_periodo = somas_contabeis(self.dados_universo)
+        self.cubo = CuboOLAP(self.dados_universo)
+        # Livros de caixa por período: totais, contrapartes e lançamentos sem refiltrar as tabelas
+        self.livro_recebido = LivroCaixa(self.df_cr_full, 'cr')
+        self.livro_pago = LivroCaixa(self.df_cp_full, 'cp')
+        # Assinatura histórica: meses contínuos do universo e dos livros de caixa completos
+        self.mensal_contabil = mensal_contabil(self.dados_universo)
+        self.series_historicas = SeriesHistoricas(
+            self.mensal_contabil, self.livro_recebido.mensal(), self.livro_pago.mensal()
+        )
 
-            conditions = [
-                (df['Hrs_Real'] > df['Hrs_Prev']) & (df['TipoProj'] == 'PROJETO FECHADO'),
-                (df['Hrs_Real'] > df['Hrs_Prev']) & (df['TipoProj'] == 'FATURADO POR HRS REALIZADAS'),
-                (df['Hrs_Real'] < df['Hrs_Prev']) & (df['Hrs_Prev'] > 0)
-            ]
-            choices = [
-                'SANGRIA',
-                'OVERRUN_FATURAVEL',
-                'OCIOSIDADE'
-            ]
-            df['Status_Horas'] = np.select(conditions, choices, default='OK')
-
-            df['Score_Performance'] = (
-                (df['Margem'] * 0.4) +
-                (np.clip(df['Eficiencia'], 0, 2) / 2 * 0.3) +
-                (np.clip(df['ROI_Hora'] / 100, 0, 1) * 0.3)
-            ) * 100
-
-            df['Status_Performance'] = pd.cut(df['Score_Performance'],
-                                 bins=[-np.inf, 40, 70, np.inf],
-                                 labels=['CRÍTICO', 'ATENÇÃO', 'EXCELENTE'],
-                                 right=False)
-
-            colunas_string_app = ['Consultor', 'Cliente', 'Projeto', 'TipoProj']
-            for col_str in colunas_string_app:
-                if col_str not in df.columns:
-                    df[col_str] = 'N/A'
-                else:
-                    df[col_str] = df[col_str].fillna('N/A').astype(str)
+    def _restaurar_snapshot(self, snapshot):
+        self.df_cr_full = snapshot['cr']
+        self.df_cp_full = snapshot['cp']
+        self.dimensoes = {alias: snapshot[alias] for alias in ALIASES_DIMENSOES if alias in snapshot}
+        self.indices_dimensoes = indexar_dimensoes(self.dimensoes)
+        self.marca_dagua = snapshot['marca']
+
+    def _montar_universo(self, df_fato, mensagens, relatorio=None):
+        # Executar Joins (já feitos no SQL Server quando há pushdown)
+        df = df_fato
+        if not self.juncoes_no_servidor:
+            with mensagens.etapa("Entrelaçando dimensões..."):
+                df = entrelacar_dimensoes(df_fato, self.indices_dimensoes, relatorio)
+
+        # Mapeamento e Métricas
+        with mensagens.etapa("Mapeando colunas e criando métricas..."):
+            df = mapear_metricas(df)
+
+        # Dimensões Quânticas
+        with mensagens.etapa("Criando dimensões quânticas..."):
+            df = criar_dimensoes_quanticas(df)
             
             # Remover duplicatas finais
-            df = df.drop_duplicates(subset=['Mes', 'Ano', 'ConsultGest', 'ProjGest', 'IdGest2'])
+            df = df.drop_duplicates(subset=CHAVE_UNIVERSO)
 
-        st.success("Universo de Dados Carregado e Sincronizado.")
         return df
 
+    def atualizar_universo_incremental(self, versao_nova, mensagens=None):
+        """
+        Relê apenas os meses da tabela fato cuja contagem/checksum mudou desde a última carga,
+        recalcula as métricas somente dessas linhas e as substitui no universo. Só é chamada
+        quando a sonda `versao_nova` acusa mudança apenas na fato (dimensões reaproveitadas).
+        Retorna o texto de status da atualização, ou None quando é preciso uma recarga completa.
+        """
+        mensagens = mensagens or MensagensCarga()
+        if self.dados_universo.empty or self.marca_dagua.empty:
+            return None
+
+        try:
+            with mensagens.etapa("Sondando meses alterados na tabela fato..."):
+                marca_nova = ler_sql(query_marca_dagua(), self.conn)
+                alterados, removidos = detectar_meses_alterados(self.marca_dagua, marca_nova)
+
+            if not alterados and not removidos:
+                self.versao_fontes = versao_nova
+                return f"Nenhum mês alterado ({datetime.now():%H:%M})"
+            if len(alterados) > LIMITE_MESES_INCREMENTAIS:
+                return None
+
+            queries, self.juncoes_no_servidor = planejar_queries(self.conn)
+            busca = {}
+            if alterados:
+                prefixo = 'g.' if self.juncoes_no_servidor else ''
+                busca['g'] = filtrar_query_por_meses(queries['g'], alterados, prefixo)
+
+            with mensagens.etapa(f"Relendo {len(alterados)} mês(es) alterado(s)..."):
+                dfs, erros = extrair_em_paralelo(busca, self.conn)
+            if erros:
+                mensagens.aviso(f"⚠️ Falha na atualização incremental: {erros}")
+                return None
+
+
+            novas_linhas = pd.DataFrame()
+            if alterados and not dfs['g'].empty:
+                novas_linhas = self._montar_universo(preparar_fato(dfs['g']), mensagens)
+
+            meses = {chave_periodo(ano, mes) for ano, mes in alterados} | set(removidos)
+            self.dados_universo = substituir_meses(self.dados_universo, novas_linhas, meses - {None})
+            self._indexar_universo()
+            self.marca_dagua = marca_nova
+            self.versao_fontes = versao_nova
+            return f"{len(meses)} mês(es) atualizado(s) ({datetime.now():%H:%M})"
+
+        except Exception as e:
+            mensagens.aviso(f"⚠️ Falha na atualização incremental: {e}")
+            return None
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# MOTOR DE RACIOCÍNIO QUÂNTICO (CRQ) - CORRIGIDO
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class CoreQuantumReasoning:
+    """Estado de uma sessão (filtros, seleção e resultados) sobre um UniversoDados compartilhado."""
+    def __init__(self, universo):
+        self.universo = universo
+        self.filtros_ativos = {}
+        self.estado_quantum = universo.dados_universo
+        self.celulas_quantum = universo.cubo.celulas
+        self.padroes_ocultos = {}
+        self.prescricoes_ativas = []
+        self.assinatura_historica = {}
+        self.analise = {}
+        self.chave_analise = None
+
+    def __getattr__(self, nome):
+        # Dados (dados_universo, df_cr_full, conn...) são lidos do universo compartilhado
+        if nome == 'universo':
+            raise AttributeError(nome)
+        return getattr(self.universo, nome)
+
+    def analisar(self, filtros, ia_ativa, versao_dados):
+        """
+        Colapso + análises pós-colapso, memorizados no cache de análises compartilhado pela
+        versão dos dados e por `assinatura_filtros` (dimensões, intervalo completo e modo):
+        voltar a um conjunto de filtros já visto (ou mexer só em widgets locais das abas) não
+        refaz nenhum cálculo.
+        """
+        chave = (versao_dados, assinatura_filtros(filtros), bool(ia_ativa))
+        analise = cache_analises().obter(chave)
+        if analise is None:
+            df = self.aplicar_colapso_quantico(filtros)
+            self.detectar_entrelacements()
+            metricas = self.calcular_metricas_consolidadas()
+            prescricoes = self.gerar_prescricoes_quantum() if ia_ativa else []
+            analise = {
+                'selecao': df, 'celulas': self.celulas_quantum, 'metricas': metricas, 'prescricoes': prescricoes,
+                'padroes_ocultos': self.padroes_ocultos, 'assinatura_historica': self.assinatura_historica,
+            }
+            if self.dados_universo.empty:
+                chave = None
+            else:
+                cache_analises().guardar(chave, analise)
+        else:
+            self.filtros_ativos = filtros
+            self.estado_quantum = analise['selecao']
+            self.celulas_quantum = analise['celulas']
+            self.padroes_ocultos = analise['padroes_ocultos']
+            self.assinatura_historica = analise['assinatura_historica']
+            self.prescricoes_ativas = analise['prescricoes']
+        self.analise = analise
+        self.chave_analise = chave
+        return analise['selecao'], analise['metricas'], analise['prescricoes']
+
+    def memorizar(self, nome, calcular):
+        """
+        Resultado derivado da análise atual (ex.: perguntas socráticas), calculado uma vez por
+        entrada. A entrada compartilhada não é alterada: o resultado volta ao cache de análises
+        em uma cópia dela.
+        """
+        if nome not in self.analise:
+            valor = calcular()
+            self.analise = {**self.analise, nome: valor}
+            if self.chave_analise is not None:
+                cache_analises().complementar(self.chave_analise, nome, valor)
+        return self.analise[nome]
+
     def aplicar_colapso_quantico(self, filtros):
         if self.dados_universo.empty:
             st.warning("Não há dados carregados para aplicar filtros.")
             self.estado_quantum = pd.DataFrame()
+            self.celulas_quantum = self.cubo.celulas
             return self.estado_quantum
 
         self.filtros_ativos = filtros
-        df = self.dados_universo.copy()
 
         try:
-            if filtros.get('consultores') and 'TODOS' not in filtros['consultores']:
-                df = df[df['Consultor'].isin(filtros['consultores'])]
-            if filtros.get('clientes') and 'TODOS' not in filtros['clientes']:
-                df = df[df['Cliente'].isin(filtros['clientes'])]
-            if filtros.get('projetos') and 'TODOS' not in filtros['projetos']:
-                df = df[df['Projeto'].isin(filtros['projetos'])]
-            if filtros.get('tipos') and 'TODOS' not in filtros['tipos']:
-                df = df[df['TipoProj'].isin(filtros['tipos'])]
-
-            if filtros.get('mes') and filtros.get('ano'):
-                try:
-                    mes_sel = int(filtros['mes'])
-                    ano_sel = int(filtros['ano'])
-                    df = df[(df['Mes'] == mes_sel) & (df['Ano'] == ano_sel)]
-                    
+            # Filtros de dimensão resolvidos no índice invertido, recortados pelas linhas do período
+            selecao = {
+                coluna: filtros[chave] for chave, coluna in FILTROS_DIMENSOES.items()
+                if filtros.get(chave) and 'TODOS' not in filtros[chave]
+            }
+            intervalo, periodos = None, None
+            try:
+                periodos = intervalo_dos_filtros(filtros)
+                if periodos is not None:
+                    intervalo = self.indice_periodos.limites(*periodos)
+                    ano_sel, mes_sel = ano_mes(periodos[0])
+
                     self.atualizar_assinatura_historica(ano_sel, mes_sel)
-                    
-                except (ValueError, TypeError) as e:
-                    st.error(f"Erro ao converter filtros de data: {e}")
+
+            except (ValueError, TypeError) as e:
+                st.error(f"Erro ao converter filtros de data: {e}")
+
+            df = self.indice_filtros.filtrar(selecao, intervalo)
+            # A mesma seleção no cubo: KPIs e rollups das abas leem as células
+            self.celulas_quantum = self.cubo.fatia(selecao, periodos)
 
             self.estado_quantum = df
             return df
@@ -461,58 +537,14 @@ class CoreQuantumReasoning:
         except Exception as e:
             st.error(f"Erro ao aplicar filtros: {e}")
             self.estado_quantum = pd.DataFrame()
+            self.celulas_quantum = self.cubo.celulas.iloc[:0]
             return self.estado_quantum
 
     def atualizar_assinatura_historica(self, ano_sel, mes_sel):
         try:
-            data_filtro = pd.to_datetime(f'{int(ano_sel)}-{int(mes_sel)}-01', errors='coerce')
-            if pd.isna(data_filtro):
-                self.assinatura_historica = {}
-                return
-
-            # Histórico Contábil
-            df_hist_contabil = self.dados_universo[self.dados_universo['Data'] < data_filtro]
-            if df_hist_contabil.empty:
-                self.assinatura_historica = {}
-                return
-            hist_contabil_agg = df_hist_contabil.groupby(pd.Grouper(key='Data', freq='MS')).agg(
-                Receita=('Receita', 'sum'),
-                Custo=('Custo', 'sum'),
-                Hrs_Real=('Hrs_Real', 'sum'),
-                Hrs_Prev=('Hrs_Prev', 'sum')
-            )
+            # Leitura em tempo constante nas séries mensais acumuladas do universo
+            self.assinatura_historica = self.series_historicas.assinatura(periodo(int(ano_sel), int(mes_sel)))
 
-            # Histórico Caixa Recebido
-            df_cr_hist = self.df_cr_full.copy()
-            df_cr_hist['DtRec'] = pd.to_datetime(df_cr_hist['DtRec'], errors='coerce')
-            df_cr_hist = df_cr_hist[df_cr_hist['DtRec'] < data_filtro]
-            hist_caixa_rec = df_cr_hist.groupby(pd.Grouper(key='DtRec', freq='MS'))['VlRec'].sum().rename('Caixa_Recebido')
-
-            # Histórico Caixa Pago
-            df_cp_hist = self.df_cp_full.copy()
-            df_cp_hist['DtPagamento'] = pd.to_datetime(df_cp_hist['DtPagamento'], errors='coerce')
-            df_cp_hist = df_cp_hist[df_cp_hist['DtPagamento'] < data_filtro]
-            hist_caixa_pag = df_cp_hist.groupby(pd.Grouper(key='DtPagamento', freq='MS'))['VlPago'].sum().rename('Caixa_Pago')
-            
-            # Unir dados históricos
-            hist_merged = pd.concat([hist_contabil_agg, hist_caixa_rec, hist_caixa_pag], axis=1).fillna(0)
-            
-            hist_merged['Lucro'] = hist_merged['Receita'] - hist_merged['Custo']
-            hist_merged['Margem'] = np.where(hist_merged['Receita'] > 0, hist_merged['Lucro'] / hist_merged['Receita'], 0)
-            hist_merged['Lucro_Caixa'] = hist_merged['Caixa_Recebido'] - hist_merged['Caixa_Pago']
-            hist_merged['ROI_Hora'] = np.where(hist_merged['Hrs_Real'] > 0, hist_merged['Lucro'] / hist_merged['Hrs_Real'], 0)
-            hist_merged['Eficiencia'] = np.where(hist_merged['Hrs_Prev'] > 0, hist_merged['Hrs_Real'] / hist_merged['Hrs_Prev'], 1)
-
-            self.assinatura_historica = {
-                'receita_avg': hist_merged['Receita'].mean(),
-                'lucro_avg': hist_merged['Lucro'].mean(),
-                'margem_avg': hist_merged['Margem'].mean(),
-                'lucro_caixa_avg': hist_merged['Lucro_Caixa'].mean(),
-                'roi_hora_avg': hist_merged['ROI_Hora'].mean(),
-                'eficiencia_avg': hist_merged['Eficiencia'].mean(),
-                'count_months': len(hist_merged)
-            }
-            
         except Exception as e:
             st.error(f"Erro ao atualizar assinatura histórica: {e}")
             self.assinatura_historica = {}
@@ -536,7 +568,7 @@ class CoreQuantumReasoning:
                     }
 
             if 'Consultor' in df.columns and 'ROI_Hora' in df.columns:
-                perf_consultor = df.groupby('Consultor')['ROI_Hora'].mean()
+                perf_consultor = df.groupby('Consultor', observed=True)['ROI_Hora'].mean()
                 perf_consultor = perf_consultor[perf_consultor.index != 'N/A'].dropna()
                 if len(perf_consultor) > 1:
                     variancia = perf_consultor.std()
@@ -550,7 +582,7 @@ class CoreQuantumReasoning:
                         }
             
             if 'TipoProj' in df.columns and 'Margem' in df.columns:
-                perf_tipo = df.groupby('TipoProj')['Margem'].mean()
+                perf_tipo = df.groupby('TipoProj', observed=True)['Margem'].mean()
                 perf_tipo = perf_tipo.replace([np.inf, -np.inf], np.nan)
                 perf_tipo = perf_tipo[perf_tipo.index != 'N/A'].dropna()
                 if len(perf_tipo) > 1 and not perf_tipo.empty:
@@ -707,48 +739,32 @@ class CoreQuantumReasoning:
             'gap_faturamento': 0, 'gap_custo': 0
         }
 
-        # Métricas Contábeis
+        try:
+            periodos = intervalo_dos_filtros(filtros)
+        except (ValueError, TypeError):
+            periodos = None
+
+        # Métricas Contábeis: sem filtro de dimensão, os totais do período saem das somas acumuladas;
+        # com filtro, das células do cubo na seleção (distintos também saem das células)
+        celulas = self.celulas_quantum
         if not df_contabil.empty:
-            metrics['receita'] = df_contabil['Receita'].sum()
-            metrics['custo'] = df_contabil['Custo'].sum()
-            metrics['lucro'] = df_contabil['Lucro'].sum()
-            metrics['margem'] = (metrics['lucro'] / metrics['receita']) if metrics['receita'] > 0 else 0
-            metrics['hrs_real'] = df_contabil['Hrs_Real'].sum()
-            metrics['hrs_prev'] = df_contabil['Hrs_Prev'].sum()
-            metrics['eficiencia'] = df_contabil['Eficiencia'].mean()
-            metrics['roi_hora'] = df_contabil['ROI_Hora'].mean()
-            metrics['consultores'] = df_contabil['Consultor'].nunique()
-            metrics['clientes'] = df_contabil['Cliente'].nunique()
-            metrics['projetos'] = df_contabil['Projeto'].nunique()
-            metrics['score'] = df_contabil['Score_Performance'].mean()
-
-        # Métricas de Caixa
+            sem_selecao = not any(
+                filtros.get(chave) and 'TODOS' not in filtros[chave] for chave in FILTROS_DIMENSOES
+            )
+            if periodos is not None and sem_selecao:
+                totais = self.somas_periodo.soma(*periodos)
+            else:
+                totais = self.cubo.totais(celulas)
+            metrics.update(metricas_contabeis(totais))
+            metrics['consultores'] = self.cubo.distintos(celulas, 'Consultor')
+            metrics['clientes'] = self.cubo.distintos(celulas, 'Cliente')
+            metrics['projetos'] = self.cubo.distintos(celulas, 'Projeto')
+
+        # Métricas de Caixa (livros completos, independentes dos filtros de dimensão)
         try:
-            mes_sel = int(filtros.get('mes', 0))
-            ano_sel = int(filtros.get('ano', 0))
-
-            if mes_sel > 0 and ano_sel > 0:
-                # Caixa Recebido
-                df_cr = self.df_cr_full.copy()
-                df_cr['DtRec'] = pd.to_datetime(df_cr['DtRec'], errors='coerce')
-                date_filter_rec = (df_cr['DtRec'].dt.month == mes_sel) & (df_cr['DtRec'].dt.year == ano_sel)
-                if 'quitado' in df_cr.columns:
-                    quitado_filter_rec = df_cr['quitado'].astype(str).str.strip().str.upper() == 'S'
-                    recebimentos_mes = df_cr[date_filter_rec & quitado_filter_rec]
-                else:
-                    recebimentos_mes = df_cr[date_filter_rec]
-                metrics['caixa_recebido'] = pd.to_numeric(recebimentos_mes['VlRec'], errors='coerce').sum()
-
-                # Caixa Pago
-                df_cp = self.df_cp_full.copy()
-                df_cp['DtPagamento'] = pd.to_datetime(df_cp['DtPagamento'], errors='coerce')
-                date_filter_pag = (df_cp['DtPagamento'].dt.month == mes_sel) & (df_cp['DtPagamento'].dt.year == ano_sel)
-                if 'quitado' in df_cp.columns:
-                    quitado_filter_pag = df_cp['quitado'].astype(str).str.strip().str.upper() == 'S'
-                    pagamentos_mes = df_cp[date_filter_pag & quitado_filter_pag]
-                else:
-                    pagamentos_mes = df_cp[date_filter_pag]
-                metrics['caixa_pago'] = pd.to_numeric(pagamentos_mes['VlPago'], errors='coerce').sum()
+            if periodos is not None:
+                metrics['caixa_recebido'] = self.livro_recebido.total(*periodos)
+                metrics['caixa_pago'] = self.livro_pago.total(*periodos)
 
             metrics['lucro_caixa'] = metrics['caixa_recebido'] - metrics['caixa_pago']
             metrics['gap_faturamento'] = metrics['receita'] - metrics['caixa_recebido']
@@ -853,7 +869,7 @@ class SocraticQuestioningEngine:
 
         # 6. PERGUNTA SOBRE CONCENTRAÇÃO DE RECEITA (RISCO)
         if metricas['clientes'] > 1 and metricas['receita'] > 0:
-            receita_cliente = df.groupby('Cliente')['Receita'].sum()
+            receita_cliente = df.groupby('Cliente', observed=True)['Receita'].sum()
             if not receita_cliente.empty:
                 top_cliente_receita = receita_cliente.max()
                 top_cliente_nome = receita_cliente.idxmax()
@@ -890,8 +906,52 @@ class SocraticQuestioningEngine:
 # INICIALIZAÇÃO DOS MOTORES (CRQ e Socrático)
 # ═══════════════════════════════════════════════════════════════════════════════
 
-if 'crq' not in st.session_state:
-    st.session_state.crq = CoreQuantumReasoning()
+def _atualizar_universo(universo, mensagens=None):
+    """
+    Sonda a versão das fontes antes de reler qualquer coisa: sem alteração, mantém o mesmo
+    universo; com mudança só na fato, atualiza os meses alterados sobre uma cópia rasa.
+    Retorna (universo, status) para o `AtualizadorUniverso`, com o próprio `universo` (mesma
+    geração) quando nenhum mês mudou; nos demais casos retorna None e a recarga completa relê
+    do banco só as tabelas alteradas (as outras vêm do cache de resultados).
+    """
+    try:
+        versao_nova = sondar_versao_fontes(universo.conn)
+    except Exception:
+        return None
+    alteradas = tabelas_alteradas(universo.versao_fontes, versao_nova)
+    if not alteradas:
+        return universo, f"Fontes sem alteração ({datetime.now():%H:%M})"
+    if alteradas != {'g'}:
+        return None
+    novo = copy.copy(universo)
+    status = novo.atualizar_universo_incremental(versao_nova, mensagens)
+    if not status:
+        return None
+    if novo.dados_universo is universo.dados_universo:
+        # Marca d'água sem mês alterado: as sessões seguem com o mesmo universo e suas análises
+        universo.versao_fontes = novo.versao_fontes
+        return universo, status
+    return novo, status
+
+
+@st.cache_resource
+def obter_atualizador():
+    """Atualizador do universo compartilhado pelo processo (stale-while-revalidate)."""
+    return AtualizadorUniverso(
+        UniversoDados, _atualizar_universo,
+        valido=lambda universo: not universo.dados_universo.empty
+    )
+
+
+atualizador = obter_atualizador()
+atualizador.verificar_agenda(config_motor("intervalo_atualizacao_min", 0))
+universo_base, geracao_universo = atualizador.obter()
+
+# Sessões guardam só o próprio estado; adotam a versão nova do universo na primeira execução após a troca
+if 'crq' not in st.session_state or st.session_state.get('geracao_universo') != geracao_universo:
+    st.session_state.crq = CoreQuantumReasoning(universo_base)
+    st.session_state.geracao_universo = geracao_universo
+    st.session_state.pop('socratic_engine', None)
 
 if 'socratic_engine' not in st.session_state:
     if st.session_state.crq and not st.session_state.crq.dados_universo.empty:
@@ -926,13 +986,8 @@ with st.sidebar:
     st.markdown("### 🔍 Filtros Dimensionais")
 
     try:
-        consultores_opts = ['TODOS'] + sorted(crq.dados_universo['Consultor'].unique().tolist())
-        clientes_opts = ['TODOS'] + sorted(crq.dados_universo['Cliente'].unique().tolist())
-        projetos_opts = ['TODOS'] + sorted(crq.dados_universo['Projeto'].unique().tolist())
-        tipos_opts = ['TODOS'] + sorted(crq.dados_universo['TipoProj'].unique().tolist())
-        
-        meses_opts = sorted(crq.dados_universo['Mes'].astype(int).unique().tolist())
-        anos_opts = sorted(crq.dados_universo['Ano'].astype(int).unique().tolist())
+        meses_opts = crq.indice_periodos.meses()
+        anos_opts = crq.indice_periodos.anos()
         
         hoje = datetime.now()
         ano_atual = hoje.year
@@ -950,7 +1005,7 @@ with st.sidebar:
 
     except Exception as e:
         st.error(f"Erro ao preparar opções de filtro: {e}")
-        consultores_opts, clientes_opts, projetos_opts, tipos_opts, meses_opts, anos_opts = [['TODOS']]*6
+        meses_opts, anos_opts = [['TODOS']]*2
         mes_default_idx, ano_default_idx = 0, 0
 
     col_m, col_a = st.columns(2)
@@ -959,10 +1014,41 @@ with st.sidebar:
     with col_a:
         ano_sel = st.selectbox("Ano", anos_opts, index=ano_default_idx, key="ano")
 
-    cons_sel = st.multiselect("👥 Consultores", consultores_opts, default=["TODOS"])
-    cli_sel = st.multiselect("🏢 Clientes", clientes_opts, default=["TODOS"])
-    proj_sel = st.multiselect("📁 Projetos", projetos_opts, default=["TODOS"])
-    tipo_sel = st.multiselect("🎯 Tipo de Serviço", tipos_opts, default=["TODOS"])
+    # Período analisado: o mês/ano acima fecha o intervalo (trimestre, acumulado, 12 meses ou início livre)
+    modo_periodo = st.selectbox("📅 Período", MODOS_PERIODO, key="modo_periodo")
+    inicio_sel = None
+    if modo_periodo == 'Intervalo':
+        chaves_periodo = [int(p) for p in crq.indice_periodos.periodos]
+        inicio_sel = st.selectbox("Início do Intervalo", chaves_periodo, index=max(len(chaves_periodo) - 1, 0),
+                                  format_func=rotulo_periodo, key="periodo_inicio")
+    try:
+        periodo_ini, periodo_fim = intervalo_periodos(modo_periodo, ano_sel, mes_sel, inicio_sel)
+        rotulo_sel = rotulo_intervalo(periodo_ini, periodo_fim)
+    except (ValueError, TypeError):
+        periodo_ini, periodo_fim = None, None
+        rotulo_sel = f"{mes_sel}/{ano_sel}"
+
+    # Opções em cascata (lidas do cubo): só os valores que existem no período e sob as demais seleções
+    try:
+        selecao_atual = {
+            coluna: st.session_state[chave] for chave, coluna in FILTROS_DIMENSOES.items()
+            if st.session_state.get(chave) and 'TODOS' not in st.session_state[chave]
+        }
+        opcoes = crq.cubo.indice_filtros.opcoes_cascata(
+            selecao_atual, crq.cubo.indice_periodos.limites(periodo_ini, periodo_fim) if periodo_ini is not None else None
+        )
+        consultores_opts = ['TODOS'] + opcoes['Consultor']
+        clientes_opts = ['TODOS'] + opcoes['Cliente']
+        projetos_opts = ['TODOS'] + opcoes['Projeto']
+        tipos_opts = ['TODOS'] + opcoes['TipoProj']
+    except Exception as e:
+        st.error(f"Erro ao preparar opções de filtro: {e}")
+        consultores_opts, clientes_opts, projetos_opts, tipos_opts = [['TODOS']]*4
+
+    cons_sel = st.multiselect("👥 Consultores", consultores_opts, default=["TODOS"], key="consultores")
+    cli_sel = st.multiselect("🏢 Clientes", clientes_opts, default=["TODOS"], key="clientes")
+    proj_sel = st.multiselect("📁 Projetos", projetos_opts, default=["TODOS"], key="projetos")
+    tipo_sel = st.multiselect("🎯 Tipo de Serviço", tipos_opts, default=["TODOS"], key="tipos")
 
     st.markdown("---")
     st.markdown("### 🧠 Configurações do Sistema")
@@ -977,28 +1063,62 @@ with st.sidebar:
         'projetos': proj_sel,
         'tipos': tipo_sel,
         'mes': mes_sel,
-        'ano': ano_sel
+        'ano': ano_sel,
+        'periodo_inicio': periodo_ini,
+        'periodo_fim': periodo_fim,
+        'modo_periodo': modo_periodo,
     }
     
-    df_filtrado = crq.aplicar_colapso_quantico(filtros)
-
-    crq.detectar_entrelacements()
-    metricas = crq.calcular_metricas_consolidadas()
-    prescricoes = crq.gerar_prescricoes_quantum() if ia_ativa else []
+    df_filtrado, metricas, prescricoes = crq.analisar(filtros, ia_ativa, (NOME_SNAPSHOT, geracao_universo))
+    celulas_filtradas = crq.celulas_quantum
 
     st.markdown("### 📊 Status Quantum")
     st.metric("Registros Ativos", len(df_filtrado))
     st.metric("Score Médio", f"{metricas['score']:.1f}")
     st.metric("Padrões Ocultos", len(crq.padroes_ocultos))
 
+    # Atualizações rodam em segundo plano; a versão atual segue disponível até a troca
+    atualizar_meses = st.button("⚡ Atualizar Meses Alterados", use_container_width=True,
+                                help="Sonda as tabelas de origem e relê apenas o que mudou desde a última carga.")
+    if not fonte_dados().detecta_edicoes:
+        st.caption("ℹ️ Nesta fonte, edições de linhas existentes só aparecem com \"Reprocessar Dados\".")
+    if atualizar_meses:
+        atualizador.solicitar(incremental=True)
     if st.button("🔄 Reprocessar Dados", use_container_width=True):
         st.cache_data.clear()
-        st.cache_resource.clear()
-        if 'crq' in st.session_state:
-            del st.session_state['crq']
-        if 'socratic_engine' in st.session_state:
-            del st.session_state['socratic_engine']
-        st.rerun()
+        cache_resultados().limpar()
+        cache_analises().limpar()
+        atualizador.solicitar()
+
+    st.caption(f"🕒 Universo gerado há {formatar_idade(atualizador.idade())}")
+    if atualizador.em_andamento:
+        st.caption("⏳ Atualização em segundo plano; os dados atuais seguem disponíveis.")
+    if atualizador.ultimo_erro:
+        st.warning(f"⚠️ Última atualização falhou: {atualizador.ultimo_erro}")
+    if atualizador.status_atualizacao:
+        st.caption(f"⚡ Última atualização incremental: {atualizador.status_atualizacao}")
+    if crq.conn:
+        pool = crq.conn.metricas()
+        st.caption(f"🔌 Pool: {pool['em_uso']}/{pool['tamanho']} em uso · "
+                   f"{pool['esperas']} espera(s) · {pool['reconexoes']} reconexão(ões)")
+    cache = cache_resultados().metricas()
+    st.caption(f"🗃️ Cache: {cache['acertos']} acerto(s) · {cache['faltas']} falta(s) · "
+               f"{cache['descartes']} descarte(s) · {cache['bytes'] / 2**20:.0f}/{cache['limite_bytes'] / 2**20:.0f} MB")
+    analises = cache_analises().metricas()
+    st.caption(f"🧠 Análises memorizadas: {analises['entradas']}/{analises['limite_entradas']} · "
+               f"{analises['acertos']} acerto(s) · {analises['faltas']} falta(s)")
+    if crq.relatorio_juncoes:
+        with st.expander("🔗 Plano de Junções"):
+            st.dataframe(pd.DataFrame(crq.relatorio_juncoes), hide_index=True, use_container_width=True)
+    with st.expander("🧊 Cubo OLAP"):
+        st.caption(f"{len(crq.cubo):,} células para {len(crq.dados_universo):,} linhas do universo")
+        if st.button("Verificar contra as linhas", use_container_width=True,
+                     help="Recalcula KPIs e rollups da seleção atual linha a linha e compara com o cubo."):
+            divergencias = crq.cubo.verificar(df_filtrado, celulas_filtradas)
+            if divergencias:
+                st.error(f"Cubo diverge das linhas em: {', '.join(divergencias)}")
+            else:
+                st.success("Cubo confere com as linhas na seleção atual.")
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # INTERFACE PRINCIPAL - TABS
@@ -1018,7 +1138,7 @@ tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
 # ═══════════════════════════════════════════════════════════════════════════════
 
 with tab1:
-    st.markdown(f"## 📈 Dashboard Executivo (Visão Contábil) - {mes_sel}/{ano_sel}")
+    st.markdown(f"## 📈 Dashboard Executivo (Visão Contábil) - {rotulo_sel}")
 
     col1, col2, col3, col4, col5 = st.columns(5)
     with col1:
@@ -1044,7 +1164,7 @@ with tab1:
         st.markdown(f"### 🎯 Performance por Projeto (Top 15)")
         if not df_filtrado.empty:
             try:
-                perf_proj = df_filtrado.groupby('Projeto').agg(
+                perf_proj = crq.cubo.agregar(celulas_filtradas, 'Projeto',
                     Receita=('Receita', 'sum'),
                     Margem_Media=('Margem', 'mean'),
                     Horas_Trabalhadas=('Hrs_Real', 'sum'),
@@ -1081,7 +1201,7 @@ with tab1:
         st.markdown(f"### 💰 Receita & Rentabilidade por Cliente (Top 15)")
         if not df_filtrado.empty:
             try:
-                rec_cliente = df_filtrado.groupby('Cliente').agg(
+                rec_cliente = crq.cubo.agregar(celulas_filtradas, 'Cliente',
                     Receita_Total=('Receita', 'sum'),
                     Margem_Media=('Margem', 'mean')
                 ).nlargest(15, 'Receita_Total').sort_values('Receita_Total')
@@ -1116,7 +1236,7 @@ with tab1:
 # ═══════════════════════════════════════════════════════════════════════════════
 
 with tab2:
-    st.markdown(f"## 💰 Painel de Fechamento - {mes_sel}/{ano_sel}")
+    st.markdown(f"## 💰 Painel de Fechamento - {rotulo_sel}")
     st.info("Esta visão compara o Contábil (Faturado/Custo) com o Caixa liquidado ('quitado' = 'S') no período selecionado.")
 
     apagar_df_export = pd.DataFrame()
@@ -1124,10 +1244,7 @@ with tab2:
 
     col_pag, col_rec = st.columns(2)
     
-    try:
-        mes_sel_int = int(mes_sel)
-        ano_sel_int = int(ano_sel)
-    except (ValueError, TypeError):
+    if periodo_ini is None:
         st.error("Mês ou Ano inválido selecionado.")
         st.stop()
 
@@ -1135,32 +1252,20 @@ with tab2:
         st.markdown("### 💸 A Pagar - Consultores")
         try:
             # Visão Contábil (baseada no faturamento do período)
-            custo_contabil_agg = df_filtrado.groupby('Consultor').agg(
+            custo_contabil_agg = crq.cubo.agregar(celulas_filtradas, 'Consultor',
                 Horas_Trabalhadas=('Hrs_Real', 'sum'),
                 Total_Custo_Contabil=('Custo', 'sum')
             )
 
-            # Visão Caixa (baseada na data de pagamento e status 'quitado')
-            df_cp_full = crq.df_cp_full.copy()
-            df_tec_full = crq.df_tec_full.copy()
-            df_cp_full['DtPagamento'] = pd.to_datetime(df_cp_full['DtPagamento'], errors='coerce')
-            
-            date_filter = (df_cp_full['DtPagamento'].dt.month == mes_sel_int) & (df_cp_full['DtPagamento'].dt.year == ano_sel_int)
-
-            if 'quitado' in df_cp_full.columns:
-                quitado_filter = df_cp_full['quitado'].astype(str).str.strip().str.upper() == 'S'
-                pagamentos_mes = df_cp_full[date_filter & quitado_filter].copy()
-            else:
+            # Visão Caixa (baseada na data de pagamento e status 'quitado'), lida do livro por período
+            if not crq.livro_pago.tem_quitado:
                 st.info("Coluna 'quitado' não encontrada em Contas a Pagar. Total Pago reflete todos os registros com data de pagamento no mês.")
-                pagamentos_mes = df_cp_full[date_filter].copy()
+            pagos = crq.livro_pago.por_contraparte(periodo_ini, periodo_fim)
 
-            pagamentos_mes['Prestador'] = pd.to_numeric(pagamentos_mes['Prestador'], errors='coerce')
-            pagamentos_mes['VlPago'] = pd.to_numeric(pagamentos_mes['VlPago'], errors='coerce').fillna(0)
+            # Nome do consultor por busca no vetor indexado por AutNumTec (só as contrapartes do período)
+            nomes_tec = crq.indices_dimensoes['tec'].buscar(pd.Series(pagos.index), 'NomeTec').fillna('N/A')
             
-            pagamentos_mes = pd.merge(pagamentos_mes, df_tec_full, left_on='Prestador', right_on='AutNumTec', how='left')
-            pagamentos_mes['NomeTec'] = pagamentos_mes['NomeTec'].fillna('N/A')
-            
-            custo_caixa_agg = pagamentos_mes.groupby('NomeTec')['VlPago'].sum().rename('Total_Pago')
+            custo_caixa_agg = pagos.groupby(nomes_tec.to_numpy()).sum().rename('Total_Pago')
             custo_caixa_agg.index.name = 'Consultor'
 
             # Combinar as duas visões
@@ -1194,32 +1299,19 @@ with tab2:
         st.markdown("### 💳 A Receber - Clientes")
         try:
             # Visão Contábil (baseada no faturamento do período)
-            receita_contabil_agg = df_filtrado.groupby('Cliente').agg(
+            receita_contabil_agg = crq.cubo.agregar(celulas_filtradas, 'Cliente',
                 Horas_Faturadas=('Hrs_Real', 'sum'),
                 Total_Faturado=('Receita', 'sum')
             )
             
-            # Visão Caixa (baseada na data de recebimento e status 'quitado')
-            df_cr_full = crq.df_cr_full.copy()
-            df_cli_full = crq.df_cli_full.copy()
-            df_cr_full['DtRec'] = pd.to_datetime(df_cr_full['DtRec'], errors='coerce')
-
-            date_filter_rec = (df_cr_full['DtRec'].dt.month == mes_sel_int) & (df_cr_full['DtRec'].dt.year == ano_sel_int)
-
-            if 'quitado' in df_cr_full.columns:
-                quitado_filter_rec = df_cr_full['quitado'].astype(str).str.strip().str.upper() == 'S'
-                recebimentos_mes = df_cr_full[date_filter_rec & quitado_filter_rec].copy()
-            else:
+            # Visão Caixa (baseada na data de recebimento e status 'quitado'), lida do livro por período
+            if not crq.livro_recebido.tem_quitado:
                 st.info("Coluna 'quitado' não encontrada em Contas a Receber. Total Recebido reflete todos os registros com data de recebimento no mês.")
-                recebimentos_mes = df_cr_full[date_filter_rec].copy()
+            recebidos = crq.livro_recebido.por_contraparte(periodo_ini, periodo_fim)
             
-            recebimentos_mes['Cliente'] = pd.to_numeric(recebimentos_mes['Cliente'], errors='coerce')
-            recebimentos_mes['VlRec'] = pd.to_numeric(recebimentos_mes['VlRec'], errors='coerce').fillna(0)
+            nomes_cli = crq.indices_dimensoes['cli'].buscar(pd.Series(recebidos.index), 'DescCli').fillna('N/A')
             
-            recebimentos_mes = pd.merge(recebimentos_mes, df_cli_full, left_on='Cliente', right_on='AutNumCli', how='left')
-            recebimentos_mes['DescCli'] = recebimentos_mes['DescCli'].fillna('N/A')
-            
-            receita_caixa_agg = recebimentos_mes.groupby('DescCli')['VlRec'].sum().rename('Total_Recebido')
+            receita_caixa_agg = recebidos.groupby(nomes_cli.to_numpy()).sum().rename('Total_Recebido')
             receita_caixa_agg.index.name = 'Cliente'
 
             # Combinar as duas visões
@@ -1268,7 +1360,7 @@ with tab2:
 # ═══════════════════════════════════════════════════════════════════════════════
 
 with tab3:
-    st.markdown(f"## 💵 Fluxo de Caixa vs. Contábil - {mes_sel}/{ano_sel}")
+    st.markdown(f"## 💵 Fluxo de Caixa vs. Contábil - {rotulo_sel}")
     st.markdown("### Resumo de Caixa (Período Selecionado)")
 
     col_c1, col_c2, col_c3 = st.columns(3)
@@ -1312,28 +1404,14 @@ with tab3:
 
     with st.spinner("Calculando evolução temporal..."):
         try:
-            # Visão Contábil Histórica
-            contabil_hist = crq.dados_universo.groupby(pd.Grouper(key='Data', freq='MS')).agg(
-                Receita_Contabil=('Receita', 'sum'),
-                Custo_Contabil=('Custo', 'sum')
-            ).reset_index()
-
-            # Visão Caixa Recebido Histórica
-            cr_hist = crq.df_cr_full.copy()
-            cr_hist['DtRec'] = pd.to_datetime(cr_hist['DtRec'], errors='coerce')
-            caixa_rec_hist = cr_hist.groupby(pd.Grouper(key='DtRec', freq='MS'))['VlRec'].sum().reset_index()
-            caixa_rec_hist = caixa_rec_hist.rename(columns={'DtRec': 'Data', 'VlRec': 'Receita_Caixa'})
-            
-            # Visão Caixa Pago Histórica
-            cp_hist = crq.df_cp_full.copy()
-            cp_hist['DtPagamento'] = pd.to_datetime(cp_hist['DtPagamento'], errors='coerce')
-            caixa_pag_hist = cp_hist.groupby(pd.Grouper(key='DtPagamento', freq='MS'))['VlPago'].sum().reset_index()
-            caixa_pag_hist = caixa_pag_hist.rename(columns={'DtPagamento': 'Data', 'VlPago': 'Custo_Caixa'})
-            
-            # Unir as visões
-            fluxo_temporal = pd.merge(contabil_hist, caixa_rec_hist, on='Data', how='outer')
-            fluxo_temporal = pd.merge(fluxo_temporal, caixa_pag_hist, on='Data', how='outer')
-            fluxo_temporal = fluxo_temporal.fillna(0).sort_values('Data')
+            # Séries mensais já montadas na carga (contábil e livros de caixa), contínuas mês a mês
+            fluxo_temporal = pd.concat([
+                continuo_por_periodo(crq.mensal_contabil[['Receita', 'Custo']]).rename(
+                    columns={'Receita': 'Receita_Contabil', 'Custo': 'Custo_Contabil'}),
+                continuo_por_periodo(crq.livro_recebido.mensal()).rename('Receita_Caixa'),
+                continuo_por_periodo(crq.livro_pago.mensal()).rename('Custo_Caixa'),
+            ], axis=1).fillna(0).sort_index()
+            fluxo_temporal['Data'] = data_do_periodo(fluxo_temporal.index).to_numpy()
 
             fluxo_temporal['Lucro_Caixa'] = fluxo_temporal['Receita_Caixa'] - fluxo_temporal['Custo_Caixa']
             fluxo_temporal['Lucro_Contabil'] = fluxo_temporal['Receita_Contabil'] - fluxo_temporal['Custo_Contabil']
@@ -1371,7 +1449,7 @@ with tab3:
 # ═══════════════════════════════════════════════════════════════════════════════
 
 with tab4:
-    st.markdown(f"## 🔬 Análise Profunda - {mes_sel}/{ano_sel}")
+    st.markdown(f"## 🔬 Análise Profunda - {rotulo_sel}")
 
     st.markdown("### 🩸 Detecção de Sangria (Projetos Fechados com Overrun)")
     if not df_filtrado.empty:
@@ -1462,7 +1540,7 @@ with tab5:
     st.markdown("## 🧠 Ressonância Prescritiva Ativa")
 
     if ia_ativa and prescricoes:
-        st.success(f"✅ CRQ Online - {len(prescricoes)} prescrições geradas para {mes_sel}/{ano_sel}")
+        st.success(f"✅ CRQ Online - {len(prescricoes)} prescrições geradas para {rotulo_sel}")
 
         prioridades = ['TODAS'] + sorted(list(set([p['prioridade'] for p in prescricoes])))
         filtro_prior = st.selectbox("Filtrar por Prioridade", prioridades, key="filtro_prior")
@@ -1547,7 +1625,7 @@ with tab6:
     if not df_filtrado.empty and socratic:
         with st.spinner('🧠 Analisando profundamente seus dados e gerando perguntas estratégicas...'):
             try:
-                perguntas = socratic.gerar_perguntas_estrategicas()
+                perguntas = crq.memorizar('perguntas', socratic.gerar_perguntas_estrategicas)
             except Exception as e:
                 st.error(f"Erro ao gerar perguntas socráticas: {e}")
                 perguntas = []
@@ -7,10 +7,26 @@ import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
 from datetime import datetime
+import copy
 from scipy import stats
 import io
 import re
-import pyodbc
+from motor_dados import (
+    init_connection, ler_sql, planejar_queries, buscar_tabelas, extrair_em_paralelo, cache_resultados,
+    cache_analises, assinatura_filtros,
+    preparar_fato, entrelacar_dimensoes, mapear_metricas, criar_dimensoes_quanticas,
+    indexar_dimensoes, IndicePeriodos, IndiceFiltros, FILTROS_DIMENSOES,
+    periodo, MODOS_PERIODO, intervalo_periodos, intervalo_dos_filtros, ano_mes, rotulo_periodo, rotulo_intervalo,
+    SomasAcumuladas, somas_contabeis, metricas_contabeis, CuboOLAP,
+    SeriesHistoricas, mensal_contabil,
+    CHAVE_UNIVERSO, ALIASES_DIMENSOES, LIMITE_MESES_INCREMENTAIS, query_marca_dagua,
+    detectar_meses_alterados, filtrar_query_por_meses, substituir_meses, chave_periodo,
+    config_motor, fonte_dados, query_versao_fontes, sondar_versao_fontes, tabelas_alteradas, chave_snapshot,
+    salvar_snapshot, carregar_snapshot, AtualizadorUniverso, MensagensCarga, formatar_idade, planejar_queries_caixa, agregar_caixa,
+    normalizar_caixa_agregado, buscar_lancamentos_caixa, caixa_somente_quitados, LIVROS_CAIXA,
+)
+
+NOME_SNAPSHOT = "cqrfarolprm"
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # CONFIGURAÇÃO DA PÁGINA - DESIGN PREMIUM
@@ -201,40 +217,6 @@ st.markdown("""
 # MOTOR DE CONEXÃO COM BANCO DE DADOS
 # ═══════════════════════════════════════════════════════════════════════════════
 
-@st.cache_resource
-def init_connection():
-    """Cria e retorna a conexão com o banco de dados."""
-    try:
-        DB_SERVER = st.secrets["db_credentials"]["server"]
-        DB_DATABASE = st.secrets["db_credentials"]["database"]
-        DB_USERNAME = st.secrets["db_credentials"]["username"]
-        DB_PASSWORD = st.secrets["db_credentials"]["password"]
-
-        conn_str = (
-            f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-            f"SERVER={DB_SERVER};"
-            f"DATABASE={DB_DATABASE};"
-            f"UID={DB_USERNAME};"
-            f"PWD={DB_PASSWORD};"
-            f"TrustServerCertificate=yes;"
-        )
-        return pyodbc.connect(conn_str, timeout=30)
-    except Exception as e:
-        st.error(f"❌ Erro de Conexão com Banco de Dados: {e}")
-        return None
-
-@st.cache_data(ttl=600)
-def run_query(query, _conn):
-    """Executa a query e retorna um DataFrame."""
-    if not _conn:
-        st.error("Conexão com banco de dados inválida.")
-        return pd.DataFrame()
-    try:
-        return pd.read_sql(query, _conn)
-    except Exception as e:
-        st.warning(f"⚠️ Falha ao executar query: {e}")
-        return pd.DataFrame()
-
 @st.cache_data
 def to_excel(df_rec, df_pag):
     """Converte DataFrames para Excel em memória."""
@@ -246,144 +228,168 @@ def to_excel(df_rec, df_pag):
             df_pag.to_excel(writer, sheet_name='A_Pagar', index=False)
     return output.getvalue()
 # ═══════════════════════════════════════════════════════════════════════════════
-# MOTOR DE RACIOCÍNIO QUÂNTICO (CRQ) - CORRIGIDO
+# UNIVERSO DE DADOS COMPARTILHADO (SOMENTE LEITURA, UM POR PROCESSO)
 # ═══════════════════════════════════════════════════════════════════════════════
 
-class CoreQuantumReasoning:
-    def __init__(self):
+class UniversoDados:
+    """
+    Dados carregados uma vez por processo e compartilhados por todas as sessões.
+    Nenhuma sessão altera estes DataFrames; com Copy-on-Write (pandas 3) filtros e
+    colunas derivadas geram cópias próprias sem tocar no original. Progresso, avisos e erros
+    da carga vão para `mensagens` (MensagensCarga; silencioso em segundo plano).
+    """
+    def __init__(self, mensagens=None):
+        mensagens = mensagens or MensagensCarga()
         self.conn = init_connection()
+        self.dimensoes = {}
+        self.indices_dimensoes = {}
+        self.relatorio_juncoes = []
+        self.juncoes_no_servidor = False
+        self.marca_dagua = pd.DataFrame()
+        self.versao_fontes = pd.DataFrame()
+        self.cr_agg = pd.DataFrame()
+        self.cp_agg = pd.DataFrame()
+
         if self.conn:
-            with st.spinner('🌌 Carregando Universo de Dados do Banco...'):
-                self.dados_universo = self.load_universo_dados()
+            with mensagens.etapa('🌌 Carregando Universo de Dados do Banco...'):
+                self.dados_universo = self.load_universo_dados(mensagens)
         else:
-            st.error("Falha na inicialização do CRQ: Conexão com banco de dados falhou.")
+            mensagens.erro("Falha na inicialização do CRQ: Conexão com banco de dados falhou.")
             self.dados_universo = pd.DataFrame()
+        self._indexar_universo()
 
-        self.estado_quantum = self.dados_universo.copy() if not self.dados_universo.empty else pd.DataFrame()
-        self.padroes_ocultos = {}
-        self.prescricoes_ativas = []
-        self.assinatura_historica = {}
 
-    def load_universo_dados(self):
+    def load_universo_dados(self, mensagens):
         if not self.conn:
             return pd.DataFrame()
 
-        QUERIES = {
-            "g": "SELECT * FROM Tb_GestorFin2",
-            "cr": "SELECT * FROM [Contas Receber]",
-            "cp": "SELECT * FROM [Contas Pagar]",
-            "p": "SELECT * FROM tb_Proj",
-            "tec": "SELECT * FROM tb_tec",
-            "cli": "SELECT * FROM tb_cli",
-            "tp": "SELECT * FROM tb_tipoproj",
-            "neg": "SELECT * FROM tb_neg",
-            "st": "SELECT * FROM tb_StatusProj",
-        }
+        QUERIES, self.juncoes_no_servidor = planejar_queries(self.conn)
+        QUERIES = planejar_queries_caixa(QUERIES, self.conn)
 
-        dfs = {}
-        all_loaded = True
-        with st.spinner("Conectando e buscando dados mestre..."):
-            for name, query in QUERIES.items():
-                dfs[name] = run_query(query, self.conn)
-                if dfs[name].empty and name == 'g':
-                    all_loaded = False
+        # Snapshot local: se a versão das fontes e o esquema não mudaram, evita o ETL completo
+        usar_snapshot = config_motor("snapshot_ativo", True)
+        versao_fontes = None
+        if usar_snapshot:
+            try:
+                versao_fontes = sondar_versao_fontes(self.conn)
+                chave_atual = chave_snapshot(NOME_SNAPSHOT, QUERIES, versao_fontes)
+                snapshot = carregar_snapshot(NOME_SNAPSHOT, chave_atual)
+            except Exception:
+                snapshot = None
+            if snapshot is not None:
+                self._restaurar_snapshot(snapshot)
+                self.versao_fontes = versao_fontes
+                mensagens.sucesso("Universo de Dados restaurado do snapshot local.")
+                return snapshot['universo']
+
+        queries_base = dict(QUERIES)
+        QUERIES['marca'] = query_marca_dagua()
+        QUERIES['versao'] = query_versao_fontes()
+
+        with mensagens.etapa("Conectando e buscando dados mestre..."):
+            dfs = buscar_tabelas(QUERIES, self.conn, versao=versao_fontes, mensagens=mensagens)
+            all_loaded = not dfs['g'].empty
+
+        if not all_loaded and self.juncoes_no_servidor:
+            # As junções no servidor falharam: refaz a busca com as junções em pandas
+            mensagens.aviso("⚠️ Junções no servidor indisponíveis; usando junções locais.")
+            QUERIES, self.juncoes_no_servidor = planejar_queries(self.conn, pushdown=False)
+            QUERIES = planejar_queries_caixa(QUERIES, self.conn)
+            queries_base = dict(QUERIES)
+            QUERIES['marca'] = query_marca_dagua()
+            QUERIES['versao'] = query_versao_fontes()
+            with mensagens.etapa("Conectando e buscando dados mestre..."):
+                dfs = buscar_tabelas(QUERIES, self.conn, versao=versao_fontes, mensagens=mensagens)
+                all_loaded = not dfs['g'].empty
 
         if not all_loaded or 'g' not in dfs or dfs['g'].empty:
-            st.error("Tabela Fato (Tb_GestorFin2) está vazia.")
+            mensagens.erro("Tabela Fato (Tb_GestorFin2) está vazia.")
             return pd.DataFrame()
 
+        self.dimensoes = {alias: dfs[alias] for alias in ALIASES_DIMENSOES if alias in dfs}
+        self.indices_dimensoes = indexar_dimensoes(self.dimensoes)
+        self.marca_dagua = dfs['marca']
+        self.versao_fontes = dfs['versao']
+
         try:
-            df_fato = dfs['g']
-            df_fato['ConsultGest'] = pd.to_numeric(df_fato['ConsultGest'], errors='coerce')
-            df_fato['ProjGest'] = pd.to_numeric(df_fato['ProjGest'], errors='coerce')
-            df_fato['Ano'] = pd.to_numeric(df_fato['Ano'].astype(str).str.strip(), errors='coerce')
-            df_fato['Mes'] = pd.to_numeric(df_fato['Mes'].astype(str).str.strip(), errors='coerce')
-            df_fato = df_fato.dropna(subset=['Ano', 'Mes', 'ConsultGest', 'ProjGest'])
-            df_fato['Ano'] = df_fato['Ano'].astype(int)
-            df_fato['Mes'] = df_fato['Mes'].astype(int)
-
-            # Preparação do Fluxo de Caixa
-            df_cr = dfs['cr'].copy()
-            df_cr['DtRec'] = pd.to_datetime(df_cr['DtRec'], errors='coerce')
-            df_cr = df_cr.dropna(subset=['DtRec'])
-            df_cr['Caixa_Ano'] = df_cr['DtRec'].dt.year
-            df_cr['Caixa_Mes'] = df_cr['DtRec'].dt.month
-            df_cr['Cliente'] = pd.to_numeric(df_cr['Cliente'], errors='coerce')
-            df_cr['VlRec'] = pd.to_numeric(df_cr['VlRec'], errors='coerce').fillna(0)
-            cr_agg = df_cr.groupby(['Caixa_Ano', 'Caixa_Mes', 'Cliente'])['VlRec'].sum().reset_index()
-
-            df_cp = dfs['cp'].copy()
-            df_cp['DtPagamento'] = pd.to_datetime(df_cp['DtPagamento'], errors='coerce')
-            df_cp = df_cp.dropna(subset=['DtPagamento'])
-            df_cp['Caixa_Ano'] = df_cp['DtPagamento'].dt.year
-            df_cp['Caixa_Mes'] = df_cp['DtPagamento'].dt.month
-            df_cp['Prestador'] = pd.to_numeric(df_cp['Prestador'], errors='coerce')
-            df_cp['VlPago'] = pd.to_numeric(df_cp['VlPago'], errors='coerce').fillna(0)
-            cp_agg = df_cp.groupby(['Caixa_Ano', 'Caixa_Mes', 'Prestador'])['VlPago'].sum().reset_index()
+            df_fato = preparar_fato(dfs['g'])
+
+            # Preparação do Fluxo de Caixa (agregado no servidor ou a partir das linhas);
+            # só o modo de agregação no servidor restringe o caixa aos lançamentos quitados
+            caixa = {}
+            somente_quitados = caixa_somente_quitados()
+            for alias in LIVROS_CAIXA:
+                if f'{alias}_agg' in dfs:
+                    caixa[alias] = normalizar_caixa_agregado(dfs[f'{alias}_agg'], alias)
+                else:
+                    caixa[alias] = agregar_caixa(dfs[alias], alias, somente_quitados)
+            self.cr_agg = caixa['cr']
+            self.cp_agg = caixa['cp']
 
         except Exception as e:
-            st.error(f"Erro na preparação dos dados: {e}")
+            mensagens.erro(f"Erro na preparação dos dados: {e}")
             return pd.DataFrame()
 
-        # Executar Joins
-        with st.spinner("Entrelaçando dimensões..."):
-            df = df_fato
-            
-            def safe_merge(df_left, df_right, **kwargs):
-                if df_right.empty:
-                    return df_left
-                return pd.merge(df_left, df_right, **kwargs)
-
-            df = safe_merge(df, dfs['tec'], left_on='ConsultGest', right_on='AutNumTec', how='left')
-            df = safe_merge(df, dfs['p'], left_on='ProjGest', right_on='AutNumProj', how='left', suffixes=('', '_proj'))
-            df = safe_merge(df, dfs['cli'], left_on='CodCliProj', right_on='AutNumCli', how='left')
-            df = safe_merge(df, dfs['tp'], left_on='TipoProj', right_on='AutNumTipo', how='left')
-            df = safe_merge(df, dfs['neg'], left_on='CodNegProj', right_on='AutNumNeg', how='left')
-            df = safe_merge(df, dfs['st'], left_on='StatusProj', right_on='AutNumStatus', how='left')
+        df = self._montar_universo(df_fato, mensagens, self.relatorio_juncoes)
 
-        # Mapeamento e Métricas
-        with st.spinner("Mapeando colunas e criando métricas..."):
-            if 'TipoProj' in df.columns and 'DescTipo' in df.columns:
-                df = df.rename(columns={'TipoProj': 'TipoProj_ID'})
-
-            mapa_colunas = {
-                'QtHrReal': 'Hrs_Real', 'QtHrOrc': 'Hrs_Prev', 'ReceitaReal': 'Receita',
-                'CustoReal': 'Custo', 'PercMgReal': 'Margem_Fracao', 'VlHrOrc': 'VH_Venda',
-                'VlHrCusto': 'VH_Custo', 'ReceitaOrc': 'Receita_Orc', 'CustoOrc': 'Custo_Orc',
-                'VlTTFat': 'Vl_Faturado_Contrato', 'NomeTec': 'Consultor', 'DescCli': 'Cliente',
-                'DescProj': 'Projeto', 'DescTipo': 'TipoProj',
-            }
+        # A chave gravada usa a versão lida junto com os dados (que podem vir do cache de queries)
+        if usar_snapshot and not dfs['versao'].empty:
+            with mensagens.etapa("Gravando snapshot local do universo..."):
+                salvar_snapshot(
+                    NOME_SNAPSHOT, chave_snapshot(NOME_SNAPSHOT, queries_base, dfs['versao']),
+                    {'universo': df, 'cr_agg': self.cr_agg, 'cp_agg': self.cp_agg,
+                     'marca': self.marca_dagua, **self.dimensoes},
+                    mensagens
+                )
 
-            cols_existentes = {k: v for k, v in mapa_colunas.items() if k in df.columns}
-            df = df.rename(columns=cols_existentes)
-            
-            colunas_numericas_app = ['Hrs_Real', 'Hrs_Prev', 'Receita', 'Custo', 'Margem_Fracao',
-                                   'VH_Venda', 'VH_Custo', 'Receita_Orc', 'Custo_Orc', 'Vl_Faturado_Contrato']
-            
-            for col in colunas_numericas_app:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-                else:
-                    df[col] = 0
-            
-            df['Margem'] = np.where(df['Receita'] > 0, (df['Receita'] - df['Custo']) / df['Receita'], 0)
-            df['Lucro'] = df['Receita'] - df['Custo']
-            df['Desvio_Hrs'] = df['Hrs_Real'] - df['Hrs_Prev']
-            df['Eficiencia'] = np.where(df['Hrs_Prev'] > 0, (df['Hrs_Real'] / df['Hrs_Prev']), 1)
-            df['ROI_Hora'] = np.where(df['Hrs_Real'] > 0, df['Lucro'] / df['Hrs_Real'], 0)
-            df['Produtividade'] = np.where(df['Hrs_Real'] > 0, df['Receita'] / df['Hrs_Real'], 0)
-            
-            df['Data'] = pd.to_datetime(df['Ano'].astype(str) + '-' + df['Mes'].astype(str) + '-01', errors='coerce')
-            df = df.dropna(subset=['Data'])
+        mensagens.sucesso("Universo de Dados Carregado e Sincronizado.")
+        return df
+
+    def _indexar_universo(self):
+        # Índices somente leitura sobre o universo: deslocamentos por período e listas por valor
+        self.indice_periodos = IndicePeriodos(self.dados_universo)
+        self.indice_filtros = IndiceFiltros(self.dados_universo)
+        self.somas_periodo = somas_contabeis(self.dados_universo)
+        self.cubo = CuboOLAP(self.dados_universo)
+        # Caixa repetido em cada linha do mês: uma ocorrência por (período, cliente/projeto) e (período, gestor)
+        df = self.dados_universo
+        if not df.empty:
+            recebido = df.drop_duplicates(subset=['Periodo', 'CodCliProj', 'Caixa_Recebido']).groupby('Periodo')['Caixa_Recebido'].sum()
+            pago = df.drop_duplicates(subset=['Periodo', 'ConsultGest', 'Caixa_Pago']).groupby('Periodo')['Caixa_Pago'].sum()
+        else:
+            recebido = pd.Series(dtype=np.float64, name='Caixa_Recebido')
+            pago = pd.Series(dtype=np.float64, name='Caixa_Pago')
+        self.somas_recebido = SomasAcumuladas(recebido.index, recebido.to_frame('Caixa_Recebido'))
+        self.somas_pago = SomasAcumuladas(pago.index, pago.to_frame('Caixa_Pago'))
+        # Assinatura histórica: médias dos meses com linhas contábeis anteriores ao período
+        self.series_historicas = SeriesHistoricas(mensal_contabil(df), recebido, pago, lacunas='ignorar')
+
+    def _restaurar_snapshot(self, snapshot):
+        self.cr_agg = snapshot['cr_agg']
+        self.cp_agg = snapshot['cp_agg']
+        self.dimensoes = {alias: snapshot[alias] for alias in ALIASES_DIMENSOES if alias in snapshot}
+        self.indices_dimensoes = indexar_dimensoes(self.dimensoes)
+        self.marca_dagua = snapshot['marca']
+
+    def _montar_universo(self, df_fato, mensagens, relatorio=None):
+        # Executar Joins (já feitos no SQL Server quando há pushdown)
+        df = df_fato
+        if not self.juncoes_no_servidor:
+            with mensagens.etapa("Entrelaçando dimensões..."):
+                df = entrelacar_dimensoes(df_fato, self.indices_dimensoes, relatorio)
+
+        # Mapeamento e Métricas
+        with mensagens.etapa("Mapeando colunas e criando métricas..."):
+            df = mapear_metricas(df)
 
         # Entrelaçamento de Caixa
-        with st.spinner("Entrelaçando dados de Fluxo de Caixa..."):
-            df = pd.merge(df, cr_agg, 
+        with mensagens.etapa("Entrelaçando dados de Fluxo de Caixa..."):
+            df = pd.merge(df, self.cr_agg, 
                           left_on=['Ano', 'Mes', 'CodCliProj'], 
                           right_on=['Caixa_Ano', 'Caixa_Mes', 'Cliente'], 
                           how='left', suffixes=('', '_cr'))
             
-            df = pd.merge(df, cp_agg, 
+            df = pd.merge(df, self.cp_agg, 
                           left_on=['Ano', 'Mes', 'ConsultGest'], 
                           right_on=['Caixa_Ano', 'Caixa_Mes', 'Prestador'], 
                           how='left', suffixes=('', '_cp'))
@@ -397,85 +403,164 @@ class CoreQuantumReasoning:
             df['Gap_Custo'] = df['Custo'] - df['Caixa_Pago']
 
         # Dimensões Quânticas
-        with st.spinner("Criando dimensões quânticas..."):
-            df = df.reset_index(drop=True)
-            
-            df['Sangria_Risco_Absoluto'] = np.where(
-                df['Hrs_Real'] > df['Hrs_Prev'],
-                (df['Hrs_Real'] - df['Hrs_Prev']) * df['VH_Custo'], 0
-            )
-            df['Ociosidade_Risco_Absoluto'] = np.where(
-                df['Hrs_Real'] < df['Hrs_Prev'],
-                (df['Hrs_Prev'] - df['Hrs_Real']) * (df['VH_Venda'] - df['VH_Custo']), 0
-            )
-
-            conditions = [
-                (df['Hrs_Real'] > df['Hrs_Prev']) & (df['TipoProj'] == 'PROJETO FECHADO'),
-                (df['Hrs_Real'] > df['Hrs_Prev']) & (df['TipoProj'] == 'FATURADO POR HRS REALIZADAS'),
-                (df['Hrs_Real'] < df['Hrs_Prev']) & (df['Hrs_Prev'] > 0)
-            ]
-            choices = [
-                'SANGRIA',
-                'OVERRUN_FATURAVEL',
-                'OCIOSIDADE'
-            ]
-            df['Status_Horas'] = np.select(conditions, choices, default='OK')
-
-            df['Score_Performance'] = (
-                (df['Margem'] * 0.4) +
-                (np.clip(df['Eficiencia'], 0, 2) / 2 * 0.3) +
-                (np.clip(df['ROI_Hora'] / 100, 0, 1) * 0.3)
-            ) * 100
-
-            df['Status_Performance'] = pd.cut(df['Score_Performance'],
-                                 bins=[-np.inf, 40, 70, np.inf],
-                                 labels=['CRÍTICO', 'ATENÇÃO', 'EXCELENTE'],
-                                 right=False)
-
-            colunas_string_app = ['Consultor', 'Cliente', 'Projeto', 'TipoProj']
-            for col_str in colunas_string_app:
-                if col_str not in df.columns:
-                    df[col_str] = 'N/A'
-                else:
-                    # CORREÇÃO: Preenche valores nulos (NaN) ANTES de converter para string.
-                    # Isso evita que NaN se torne a string 'nan', que causava erros de cálculo e exibição.
-                    df[col_str] = df[col_str].fillna('N/A').astype(str)
+        with mensagens.etapa("Criando dimensões quânticas..."):
+            df = criar_dimensoes_quanticas(df)
             
             # Remover duplicatas finais
-            df = df.drop_duplicates(subset=['Mes', 'Ano', 'ConsultGest', 'ProjGest', 'IdGest2'])
+            df = df.drop_duplicates(subset=CHAVE_UNIVERSO)
 
-        st.success("Universo de Dados Carregado e Sincronizado.")
         return df
 
+    def atualizar_universo_incremental(self, versao_nova, mensagens=None):
+        """
+        Relê apenas os meses da tabela fato cuja contagem/checksum mudou desde a última carga,
+        recalcula as métricas somente dessas linhas e as substitui no universo. Só é chamada
+        quando a sonda `versao_nova` acusa mudança apenas na fato (dimensões reaproveitadas).
+        Retorna o texto de status da atualização, ou None quando é preciso uma recarga completa.
+        """
+        mensagens = mensagens or MensagensCarga()
+        if self.dados_universo.empty or self.marca_dagua.empty:
+            return None
+
+        try:
+            with mensagens.etapa("Sondando meses alterados na tabela fato..."):
+                marca_nova = ler_sql(query_marca_dagua(), self.conn)
+                alterados, removidos = detectar_meses_alterados(self.marca_dagua, marca_nova)
+
+            if not alterados and not removidos:
+                self.versao_fontes = versao_nova
+                return f"Nenhum mês alterado ({datetime.now():%H:%M})"
+            if len(alterados) > LIMITE_MESES_INCREMENTAIS:
+                return None
+
+            queries, self.juncoes_no_servidor = planejar_queries(self.conn)
+            busca = {}
+            if alterados:
+                prefixo = 'g.' if self.juncoes_no_servidor else ''
+                busca['g'] = filtrar_query_por_meses(queries['g'], alterados, prefixo)
+
+            with mensagens.etapa(f"Relendo {len(alterados)} mês(es) alterado(s)..."):
+                dfs, erros = extrair_em_paralelo(busca, self.conn)
+            if erros:
+                mensagens.aviso(f"⚠️ Falha na atualização incremental: {erros}")
+                return None
+
+
+            novas_linhas = pd.DataFrame()
+            if alterados and not dfs['g'].empty:
+                novas_linhas = self._montar_universo(preparar_fato(dfs['g']), mensagens)
+
+            meses = {chave_periodo(ano, mes) for ano, mes in alterados} | set(removidos)
+            self.dados_universo = substituir_meses(self.dados_universo, novas_linhas, meses - {None})
+            self._indexar_universo()
+            self.marca_dagua = marca_nova
+            self.versao_fontes = versao_nova
+            return f"{len(meses)} mês(es) atualizado(s) ({datetime.now():%H:%M})"
+
+        except Exception as e:
+            mensagens.aviso(f"⚠️ Falha na atualização incremental: {e}")
+            return None
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# MOTOR DE RACIOCÍNIO QUÂNTICO (CRQ) - CORRIGIDO
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class CoreQuantumReasoning:
+    """Estado de uma sessão (filtros, seleção e resultados) sobre um UniversoDados compartilhado."""
+    def __init__(self, universo):
+        self.universo = universo
+        self.filtros_ativos = {}
+        self.estado_quantum = universo.dados_universo
+        self.celulas_quantum = universo.cubo.celulas
+        self.padroes_ocultos = {}
+        self.prescricoes_ativas = []
+        self.assinatura_historica = {}
+        self.analise = {}
+        self.chave_analise = None
+
+    def __getattr__(self, nome):
+        # Dados (dados_universo, df_cr_full, conn...) são lidos do universo compartilhado
+        if nome == 'universo':
+            raise AttributeError(nome)
+        return getattr(self.universo, nome)
+
+    def analisar(self, filtros, ia_ativa, versao_dados):
+        """
+        Colapso + análises pós-colapso, memorizados no cache de análises compartilhado pela
+        versão dos dados e por `assinatura_filtros` (dimensões, intervalo completo e modo):
+        voltar a um conjunto de filtros já visto (ou mexer só em widgets locais das abas) não
+        refaz nenhum cálculo.
+        """
+        chave = (versao_dados, assinatura_filtros(filtros), bool(ia_ativa))
+        analise = cache_analises().obter(chave)
+        if analise is None:
+            df = self.aplicar_colapso_quantico(filtros)
+            self.detectar_entrelacements()
+            prescricoes = self.gerar_prescricoes_quantum() if ia_ativa else []
+            metricas = self.calcular_metricas_consolidadas()
+            analise = {
+                'selecao': df, 'celulas': self.celulas_quantum, 'metricas': metricas, 'prescricoes': prescricoes,
+                'padroes_ocultos': self.padroes_ocultos, 'assinatura_historica': self.assinatura_historica,
+            }
+            if self.dados_universo.empty:
+                chave = None
+            else:
+                cache_analises().guardar(chave, analise)
+        else:
+            self.filtros_ativos = filtros
+            self.estado_quantum = analise['selecao']
+            self.celulas_quantum = analise['celulas']
+            self.padroes_ocultos = analise['padroes_ocultos']
+            self.assinatura_historica = analise['assinatura_historica']
+            self.prescricoes_ativas = analise['prescricoes']
+        self.analise = analise
+        self.chave_analise = chave
+        return analise['selecao'], analise['metricas'], analise['prescricoes']
+
+    def memorizar(self, nome, calcular):
+        """
+        Resultado derivado da análise atual (ex.: perguntas socráticas), calculado uma vez por
+        entrada. A entrada compartilhada não é alterada: o resultado volta ao cache de análises
+        em uma cópia dela.
+        """
+        if nome not in self.analise:
+            valor = calcular()
+            self.analise = {**self.analise, nome: valor}
+            if self.chave_analise is not None:
+                cache_analises().complementar(self.chave_analise, nome, valor)
+        return self.analise[nome]
+
     def aplicar_colapso_quantico(self, filtros):
         if self.dados_universo.empty:
             st.warning("Não há dados carregados para aplicar filtros.")
             self.estado_quantum = pd.DataFrame()
+            self.celulas_quantum = self.cubo.celulas
             return self.estado_quantum
 
-        df = self.dados_universo.copy()
+        self.filtros_ativos = filtros
 
         try:
-            if filtros.get('consultores') and 'TODOS' not in filtros['consultores']:
-                df = df[df['Consultor'].isin(filtros['consultores'])]
-            if filtros.get('clientes') and 'TODOS' not in filtros['clientes']:
-                df = df[df['Cliente'].isin(filtros['clientes'])]
-            if filtros.get('projetos') and 'TODOS' not in filtros['projetos']:
-                df = df[df['Projeto'].isin(filtros['projetos'])]
-            if filtros.get('tipos') and 'TODOS' not in filtros['tipos']:
-                df = df[df['TipoProj'].isin(filtros['tipos'])]
-
-            if filtros.get('mes') and filtros.get('ano'):
-                try:
-                    mes_sel = int(filtros['mes'])
-                    ano_sel = int(filtros['ano'])
-                    df = df[(df['Mes'] == mes_sel) & (df['Ano'] == ano_sel)]
-                    
+            # Filtros de dimensão resolvidos no índice invertido, recortados pelas linhas do período
+            selecao = {
+                coluna: filtros[chave] for chave, coluna in FILTROS_DIMENSOES.items()
+                if filtros.get(chave) and 'TODOS' not in filtros[chave]
+            }
+            intervalo, periodos = None, None
+            try:
+                periodos = intervalo_dos_filtros(filtros)
+                if periodos is not None:
+                    intervalo = self.indice_periodos.limites(*periodos)
+                    ano_sel, mes_sel = ano_mes(periodos[0])
+
                     # A assinatura histórica é sempre calculada para o período anterior ao selecionado
                     self.atualizar_assinatura_historica(ano_sel, mes_sel)
-                    
-                except (ValueError, TypeError) as e:
-                    st.error(f"Erro ao converter filtros de data: {e}")
+
+            except (ValueError, TypeError) as e:
+                st.error(f"Erro ao converter filtros de data: {e}")
+
+            df = self.indice_filtros.filtrar(selecao, intervalo)
+            # A mesma seleção no cubo: KPIs e rollups das abas leem as células
+            self.celulas_quantum = self.cubo.fatia(selecao, periodos)
 
             self.estado_quantum = df
             return df
@@ -483,6 +568,7 @@ class CoreQuantumReasoning:
         except Exception as e:
             st.error(f"Erro ao aplicar filtros: {e}")
             self.estado_quantum = pd.DataFrame()
+            self.celulas_quantum = self.cubo.celulas.iloc[:0]
             return self.estado_quantum
 
     def atualizar_assinatura_historica(self, ano_sel, mes_sel):
@@ -491,48 +577,9 @@ class CoreQuantumReasoning:
                 self.assinatura_historica = {}
                 return
 
-            data_filtro = pd.to_datetime(f'{int(ano_sel)}-{int(mes_sel)}-01', errors='coerce')
-            if pd.isna(data_filtro):
-                self.assinatura_historica = {}
-                return
-
-            df_hist = self.dados_universo[self.dados_universo['Data'] < data_filtro]
-
-            if df_hist.empty:
-                self.assinatura_historica = {}
-                return
-
-            hist_contabil = df_hist.groupby(['Ano', 'Mes']).agg(
-                Receita=('Receita', 'sum'),
-                Custo=('Custo', 'sum'),
-                Hrs_Real=('Hrs_Real', 'sum'),
-                Hrs_Prev=('Hrs_Prev', 'sum')
-            ).reset_index()
-            
-            hist_caixa_rec = df_hist.drop_duplicates(subset=['Ano', 'Mes', 'CodCliProj', 'Caixa_Recebido']).groupby(['Ano', 'Mes'])['Caixa_Recebido'].sum()
-            hist_caixa_pag = df_hist.drop_duplicates(subset=['Ano', 'Mes', 'ConsultGest', 'Caixa_Pago']).groupby(['Ano', 'Mes'])['Caixa_Pago'].sum()
+            # Leitura em tempo constante nas séries mensais acumuladas do universo
+            self.assinatura_historica = self.series_historicas.assinatura(periodo(int(ano_sel), int(mes_sel)))
 
-            hist_contabil = hist_contabil.set_index(['Ano', 'Mes'])
-            hist_contabil['Caixa_Recebido'] = hist_caixa_rec
-            hist_contabil['Caixa_Pago'] = hist_caixa_pag
-            hist_contabil = hist_contabil.reset_index().fillna(0)
-            
-            hist_contabil['Lucro'] = hist_contabil['Receita'] - hist_contabil['Custo']
-            hist_contabil['Margem'] = np.where(hist_contabil['Receita'] > 0, hist_contabil['Lucro'] / hist_contabil['Receita'], 0)
-            hist_contabil['Lucro_Caixa'] = hist_contabil['Caixa_Recebido'] - hist_contabil['Caixa_Pago']
-            hist_contabil['ROI_Hora'] = np.where(hist_contabil['Hrs_Real'] > 0, hist_contabil['Lucro'] / hist_contabil['Hrs_Real'], 0)
-            hist_contabil['Eficiencia'] = np.where(hist_contabil['Hrs_Prev'] > 0, hist_contabil['Hrs_Real'] / hist_contabil['Hrs_Prev'], 1)
-
-            self.assinatura_historica = {
-                'receita_avg': hist_contabil['Receita'].mean(),
-                'lucro_avg': hist_contabil['Lucro'].mean(),
-                'margem_avg': hist_contabil['Margem'].mean(),
-                'lucro_caixa_avg': hist_contabil['Lucro_Caixa'].mean(),
-                'roi_hora_avg': hist_contabil['ROI_Hora'].mean(),
-                'eficiencia_avg': hist_contabil['Eficiencia'].mean(),
-                'count_months': len(hist_contabil)
-            }
-            
         except Exception as e:
             st.error(f"Erro ao atualizar assinatura histórica: {e}")
             self.assinatura_historica = {}
@@ -556,7 +603,7 @@ class CoreQuantumReasoning:
                     }
 
             if 'Consultor' in df.columns and 'ROI_Hora' in df.columns:
-                perf_consultor = df.groupby('Consultor')['ROI_Hora'].mean()
+                perf_consultor = df.groupby('Consultor', observed=True)['ROI_Hora'].mean()
                 perf_consultor = perf_consultor[perf_consultor.index != 'N/A'].dropna()
                 if len(perf_consultor) > 1:
                     variancia = perf_consultor.std()
@@ -570,7 +617,7 @@ class CoreQuantumReasoning:
                         }
             
             if 'TipoProj' in df.columns and 'Margem' in df.columns:
-                perf_tipo = df.groupby('TipoProj')['Margem'].mean()
+                perf_tipo = df.groupby('TipoProj', observed=True)['Margem'].mean()
                 # ADIÇÃO: Linha de robustez para remover valores infinitos que podem ocorrer de divisões por zero.
                 perf_tipo = perf_tipo.replace([np.inf, -np.inf], np.nan)
                 perf_tipo = perf_tipo[perf_tipo.index != 'N/A'].dropna()
@@ -736,29 +783,35 @@ class CoreQuantumReasoning:
             }
 
         try:
-            receita_total = df['Receita'].sum()
-            custo_total = df['Custo'].sum()
-            lucro_total = df['Lucro'].sum()
-            
-            df_rec_unicos = df.drop_duplicates(subset=['Ano', 'Mes', 'CodCliProj', 'Caixa_Recebido'])
-            caixa_recebido_total = df_rec_unicos['Caixa_Recebido'].sum()
+            filtros = self.filtros_ativos
+            periodos = intervalo_dos_filtros(filtros)
+            sem_selecao = not any(
+                filtros.get(chave) and 'TODOS' not in filtros[chave] for chave in FILTROS_DIMENSOES
+            )
 
-            df_pag_unicos = df.drop_duplicates(subset=['Ano', 'Mes', 'ConsultGest', 'Caixa_Pago'])
-            caixa_pago_total = df_pag_unicos['Caixa_Pago'].sum()
+            # Sem filtro de dimensão, os totais do período (contábeis e de caixa) saem das somas acumuladas;
+            # com filtro, os contábeis saem das células do cubo e o caixa da deduplicação das linhas
+            celulas = self.celulas_quantum
+            if periodos is not None and sem_selecao:
+                metricas = metricas_contabeis(self.somas_periodo.soma(*periodos))
+                caixa_recebido_total = self.somas_recebido.soma(*periodos)['Caixa_Recebido']
+                caixa_pago_total = self.somas_pago.soma(*periodos)['Caixa_Pago']
+            else:
+                metricas = metricas_contabeis(self.cubo.totais(celulas))
+                df_rec_unicos = df.drop_duplicates(subset=['Ano', 'Mes', 'CodCliProj', 'Caixa_Recebido'])
+                caixa_recebido_total = df_rec_unicos['Caixa_Recebido'].sum()
+
+                df_pag_unicos = df.drop_duplicates(subset=['Ano', 'Mes', 'ConsultGest', 'Caixa_Pago'])
+                caixa_pago_total = df_pag_unicos['Caixa_Pago'].sum()
+
+            receita_total = metricas['receita']
+            custo_total = metricas['custo']
 
             return {
-                'receita': receita_total,
-                'custo': custo_total,
-                'lucro': lucro_total,
-                'margem': (lucro_total / receita_total) if receita_total > 0 else 0,
-                'hrs_real': df['Hrs_Real'].sum(),
-                'hrs_prev': df['Hrs_Prev'].sum(),
-                'eficiencia': df['Eficiencia'].mean() if not df.empty else 0,
-                'roi_hora': df['ROI_Hora'].mean() if not df.empty else 0,
-                'consultores': df['Consultor'].nunique(),
-                'clientes': df['Cliente'].nunique(),
-                'projetos': df['Projeto'].nunique(),
-                'score': df['Score_Performance'].mean() if not df.empty else 0,
+                **metricas,
+                'consultores': self.cubo.distintos(celulas, 'Consultor'),
+                'clientes': self.cubo.distintos(celulas, 'Cliente'),
+                'projetos': self.cubo.distintos(celulas, 'Projeto'),
                 'caixa_recebido': caixa_recebido_total,
                 'caixa_pago': caixa_pago_total,
                 'lucro_caixa': caixa_recebido_total - caixa_pago_total,
@@ -868,7 +921,7 @@ class SocraticQuestioningEngine:
 
         # 6. PERGUNTA SOBRE CONCENTRAÇÃO DE RECEITA (RISCO)
         if metricas['clientes'] > 1 and metricas['receita'] > 0:
-            receita_cliente = df.groupby('Cliente')['Receita'].sum()
+            receita_cliente = df.groupby('Cliente', observed=True)['Receita'].sum()
             top_cliente_receita = receita_cliente.max()
             top_cliente_nome = receita_cliente.idxmax()
             concentracao = top_cliente_receita / metricas['receita']
@@ -904,8 +957,52 @@ class SocraticQuestioningEngine:
 # INICIALIZAÇÃO DOS MOTORES (CRQ e Socrático)
 # ═══════════════════════════════════════════════════════════════════════════════
 
-if 'crq' not in st.session_state:
-    st.session_state.crq = CoreQuantumReasoning()
+def _atualizar_universo(universo, mensagens=None):
+    """
+    Sonda a versão das fontes antes de reler qualquer coisa: sem alteração, mantém o mesmo
+    universo; com mudança só na fato, atualiza os meses alterados sobre uma cópia rasa.
+    Retorna (universo, status) para o `AtualizadorUniverso`, com o próprio `universo` (mesma
+    geração) quando nenhum mês mudou; nos demais casos retorna None e a recarga completa relê
+    do banco só as tabelas alteradas (as outras vêm do cache de resultados).
+    """
+    try:
+        versao_nova = sondar_versao_fontes(universo.conn)
+    except Exception:
+        return None
+    alteradas = tabelas_alteradas(universo.versao_fontes, versao_nova)
+    if not alteradas:
+        return universo, f"Fontes sem alteração ({datetime.now():%H:%M})"
+    if alteradas != {'g'}:
+        return None
+    novo = copy.copy(universo)
+    status = novo.atualizar_universo_incremental(versao_nova, mensagens)
+    if not status:
+        return None
+    if novo.dados_universo is universo.dados_universo:
+        # Marca d'água sem mês alterado: as sessões seguem com o mesmo universo e suas análises
+        universo.versao_fontes = novo.versao_fontes
+        return universo, status
+    return novo, status
+
+
+@st.cache_resource
+def obter_atualizador():
+    """Atualizador do universo compartilhado pelo processo (stale-while-revalidate)."""
+    return AtualizadorUniverso(
+        UniversoDados, _atualizar_universo,
+        valido=lambda universo: not universo.dados_universo.empty
+    )
+
+
+atualizador = obter_atualizador()
+atualizador.verificar_agenda(config_motor("intervalo_atualizacao_min", 0))
+universo_base, geracao_universo = atualizador.obter()
+
+# Sessões guardam só o próprio estado; adotam a versão nova do universo na primeira execução após a troca
+if 'crq' not in st.session_state or st.session_state.get('geracao_universo') != geracao_universo:
+    st.session_state.crq = CoreQuantumReasoning(universo_base)
+    st.session_state.geracao_universo = geracao_universo
+    st.session_state.pop('socratic_engine', None)
 
 if 'socratic_engine' not in st.session_state:
     if st.session_state.crq and not st.session_state.crq.dados_universo.empty:
@@ -940,13 +1037,8 @@ with st.sidebar:
     st.markdown("### 🔍 Filtros Dimensionais")
 
     try:
-        consultores_opts = ['TODOS'] + sorted(crq.dados_universo['Consultor'].unique().tolist())
-        clientes_opts = ['TODOS'] + sorted(crq.dados_universo['Cliente'].unique().tolist())
-        projetos_opts = ['TODOS'] + sorted(crq.dados_universo['Projeto'].unique().tolist())
-        tipos_opts = ['TODOS'] + sorted(crq.dados_universo['TipoProj'].unique().tolist())
-        
-        meses_opts = sorted(crq.dados_universo['Mes'].astype(int).unique().tolist())
-        anos_opts = sorted(crq.dados_universo['Ano'].astype(int).unique().tolist())
+        meses_opts = crq.indice_periodos.meses()
+        anos_opts = crq.indice_periodos.anos()
         
         # AJUSTE: O sistema agora inicia com o mês e ano atuais por padrão.
         hoje = datetime.now()
@@ -967,7 +1059,7 @@ with st.sidebar:
 
     except Exception as e:
         st.error(f"Erro ao preparar opções de filtro: {e}")
-        consultores_opts, clientes_opts, projetos_opts, tipos_opts, meses_opts, anos_opts = [['TODOS']]*6
+        meses_opts, anos_opts = [['TODOS']]*2
         mes_default_idx, ano_default_idx = 0, 0
 
     col_m, col_a = st.columns(2)
@@ -976,10 +1068,41 @@ with st.sidebar:
     with col_a:
         ano_sel = st.selectbox("Ano", anos_opts, index=ano_default_idx, key="ano")
 
-    cons_sel = st.multiselect("👥 Consultores", consultores_opts, default=["TODOS"])
-    cli_sel = st.multiselect("🏢 Clientes", clientes_opts, default=["TODOS"])
-    proj_sel = st.multiselect("📁 Projetos", projetos_opts, default=["TODOS"])
-    tipo_sel = st.multiselect("🎯 Tipo de Serviço", tipos_opts, default=["TODOS"])
+    # Período analisado: o mês/ano acima fecha o intervalo (trimestre, acumulado, 12 meses ou início livre)
+    modo_periodo = st.selectbox("📅 Período", MODOS_PERIODO, key="modo_periodo")
+    inicio_sel = None
+    if modo_periodo == 'Intervalo':
+        chaves_periodo = [int(p) for p in crq.indice_periodos.periodos]
+        inicio_sel = st.selectbox("Início do Intervalo", chaves_periodo, index=max(len(chaves_periodo) - 1, 0),
+                                  format_func=rotulo_periodo, key="periodo_inicio")
+    try:
+        periodo_ini, periodo_fim = intervalo_periodos(modo_periodo, ano_sel, mes_sel, inicio_sel)
+        rotulo_sel = rotulo_intervalo(periodo_ini, periodo_fim)
+    except (ValueError, TypeError):
+        periodo_ini, periodo_fim = None, None
+        rotulo_sel = f"{mes_sel}/{ano_sel}"
+
+    # Opções em cascata (lidas do cubo): só os valores que existem no período e sob as demais seleções
+    try:
+        selecao_atual = {
+            coluna: st.session_state[chave] for chave, coluna in FILTROS_DIMENSOES.items()
+            if st.session_state.get(chave) and 'TODOS' not in st.session_state[chave]
+        }
+        opcoes = crq.cubo.indice_filtros.opcoes_cascata(
+            selecao_atual, crq.cubo.indice_periodos.limites(periodo_ini, periodo_fim) if periodo_ini is not None else None
+        )
+        consultores_opts = ['TODOS'] + opcoes['Consultor']
+        clientes_opts = ['TODOS'] + opcoes['Cliente']
+        projetos_opts = ['TODOS'] + opcoes['Projeto']
+        tipos_opts = ['TODOS'] + opcoes['TipoProj']
+    except Exception as e:
+        st.error(f"Erro ao preparar opções de filtro: {e}")
+        consultores_opts, clientes_opts, projetos_opts, tipos_opts = [['TODOS']]*4
+
+    cons_sel = st.multiselect("👥 Consultores", consultores_opts, default=["TODOS"], key="consultores")
+    cli_sel = st.multiselect("🏢 Clientes", clientes_opts, default=["TODOS"], key="clientes")
+    proj_sel = st.multiselect("📁 Projetos", projetos_opts, default=["TODOS"], key="projetos")
+    tipo_sel = st.multiselect("🎯 Tipo de Serviço", tipos_opts, default=["TODOS"], key="tipos")
 
     st.markdown("---")
     st.markdown("### 🧠 Configurações do Sistema")
@@ -995,16 +1118,15 @@ with st.sidebar:
         'projetos': proj_sel,
         'tipos': tipo_sel,
         'mes': mes_sel,
-        'ano': ano_sel
+        'ano': ano_sel,
+        'periodo_inicio': periodo_ini,
+        'periodo_fim': periodo_fim,
+        'modo_periodo': modo_periodo,
     }
     
-    # Colapso Quântico
-    df_filtrado = crq.aplicar_colapso_quantico(filtros)
-
-    # Análises Pós-Colapso
-    crq.detectar_entrelacements()
-    prescricoes = crq.gerar_prescricoes_quantum() if ia_ativa else []
-    metricas = crq.calcular_metricas_consolidadas()
+    # Colapso Quântico + Análises Pós-Colapso (memorizados por versão dos dados e filtros)
+    df_filtrado, metricas, prescricoes = crq.analisar(filtros, ia_ativa, (NOME_SNAPSHOT, geracao_universo))
+    celulas_filtradas = crq.celulas_quantum
 
     # Stats rápidas
     st.markdown("### 📊 Status Quantum")
@@ -1012,14 +1134,48 @@ with st.sidebar:
     st.metric("Score Médio", f"{metricas['score']:.1f}")
     st.metric("Padrões Ocultos", len(crq.padroes_ocultos))
 
+    # Atualizações rodam em segundo plano; a versão atual segue disponível até a troca
+    atualizar_meses = st.button("⚡ Atualizar Meses Alterados", use_container_width=True,
+                                help="Sonda as tabelas de origem e relê apenas o que mudou desde a última carga.")
+    if not fonte_dados().detecta_edicoes:
+        st.caption("ℹ️ Nesta fonte, edições de linhas existentes só aparecem com \"Reprocessar Dados\".")
+    if atualizar_meses:
+        atualizador.solicitar(incremental=True)
     if st.button("🔄 Reprocessar Dados", use_container_width=True):
         st.cache_data.clear()
-        st.cache_resource.clear()
-        if 'crq' in st.session_state:
-            del st.session_state['crq']
-        if 'socratic_engine' in st.session_state:
-            del st.session_state['socratic_engine']
-        st.rerun()
+        cache_resultados().limpar()
+        cache_analises().limpar()
+        atualizador.solicitar()
+
+    st.caption(f"🕒 Universo gerado há {formatar_idade(atualizador.idade())}")
+    if atualizador.em_andamento:
+        st.caption("⏳ Atualização em segundo plano; os dados atuais seguem disponíveis.")
+    if atualizador.ultimo_erro:
+        st.warning(f"⚠️ Última atualização falhou: {atualizador.ultimo_erro}")
+    if atualizador.status_atualizacao:
+        st.caption(f"⚡ Última atualização incremental: {atualizador.status_atualizacao}")
+    if crq.conn:
+        pool = crq.conn.metricas()
+        st.caption(f"🔌 Pool: {pool['em_uso']}/{pool['tamanho']} em uso · "
+                   f"{pool['esperas']} espera(s) · {pool['reconexoes']} reconexão(ões)")
+    cache = cache_resultados().metricas()
+    st.caption(f"🗃️ Cache: {cache['acertos']} acerto(s) · {cache['faltas']} falta(s) · "
+               f"{cache['descartes']} descarte(s) · {cache['bytes'] / 2**20:.0f}/{cache['limite_bytes'] / 2**20:.0f} MB")
+    analises = cache_analises().metricas()
+    st.caption(f"🧠 Análises memorizadas: {analises['entradas']}/{analises['limite_entradas']} · "
+               f"{analises['acertos']} acerto(s) · {analises['faltas']} falta(s)")
+    if crq.relatorio_juncoes:
+        with st.expander("🔗 Plano de Junções"):
+            st.dataframe(pd.DataFrame(crq.relatorio_juncoes), hide_index=True, use_container_width=True)
+    with st.expander("🧊 Cubo OLAP"):
+        st.caption(f"{len(crq.cubo):,} células para {len(crq.dados_universo):,} linhas do universo")
+        if st.button("Verificar contra as linhas", use_container_width=True,
+                     help="Recalcula KPIs e rollups da seleção atual linha a linha e compara com o cubo."):
+            divergencias = crq.cubo.verificar(df_filtrado, celulas_filtradas)
+            if divergencias:
+                st.error(f"Cubo diverge das linhas em: {', '.join(divergencias)}")
+            else:
+                st.success("Cubo confere com as linhas na seleção atual.")
 # ═══════════════════════════════════════════════════════════════════════════════
 # INTERFACE PRINCIPAL - TABS
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -1038,7 +1194,7 @@ tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
 # ═══════════════════════════════════════════════════════════════════════════════
 
 with tab1:
-    st.markdown(f"## 📈 Dashboard Executivo (Visão Contábil) - {mes_sel}/{ano_sel}")
+    st.markdown(f"## 📈 Dashboard Executivo (Visão Contábil) - {rotulo_sel}")
 
     col1, col2, col3, col4, col5 = st.columns(5)
     with col1:
@@ -1064,7 +1220,7 @@ with tab1:
         st.markdown(f"### 🎯 Performance por Projeto (Top 15)")
         if not df_filtrado.empty:
             try:
-                perf_proj = df_filtrado.groupby('Projeto').agg(
+                perf_proj = crq.cubo.agregar(celulas_filtradas, 'Projeto',
                     Receita=('Receita', 'sum'),
                     Margem_Media=('Margem', 'mean'),
                     Horas_Trabalhadas=('Hrs_Real', 'sum'),
@@ -1101,7 +1257,7 @@ with tab1:
         st.markdown(f"### 💰 Receita & Rentabilidade por Cliente (Top 15)")
         if not df_filtrado.empty:
             try:
-                rec_cliente = df_filtrado.groupby('Cliente').agg(
+                rec_cliente = crq.cubo.agregar(celulas_filtradas, 'Cliente',
                     Receita_Total=('Receita', 'sum'),
                     Margem_Media=('Margem', 'mean')
                 ).nlargest(15, 'Receita_Total').sort_values('Receita_Total')
@@ -1136,8 +1292,12 @@ with tab1:
 # ═══════════════════════════════════════════════════════════════════════════════
 
 with tab2:
-    st.markdown(f"## 💰 Painel de Fechamento - {mes_sel}/{ano_sel}")
-    st.info("Esta visão compara o Contábil (Faturado/Custo) com o Caixa (Recebido/Pago).")
+    st.markdown(f"## 💰 Painel de Fechamento - {rotulo_sel}")
+    caixa_quitado = caixa_somente_quitados()
+    if caixa_quitado:
+        st.info("Esta visão compara o Contábil (Faturado/Custo) com o Caixa liquidado ('quitado' = 'S').")
+    else:
+        st.info("Esta visão compara o Contábil (Faturado/Custo) com o Caixa (Recebido/Pago).")
 
     apagar_df_export = pd.DataFrame()
     areceber_df_export = pd.DataFrame()
@@ -1148,11 +1308,11 @@ with tab2:
         st.markdown("### 💸 A Pagar - Consultores")
         if not df_filtrado.empty:
             try:
-                custo_contabil_agg = df_filtrado.groupby('Consultor').agg(
+                custo_contabil_agg = crq.cubo.agregar(celulas_filtradas, 'Consultor',
                     Horas_Trabalhadas=('Hrs_Real', 'sum'),
                     Total_Custo_Contabil=('Custo', 'sum')
                 )
-                custo_caixa_agg = df_filtrado.drop_duplicates(subset=['Consultor', 'Caixa_Pago']).groupby('Consultor')['Caixa_Pago'].sum().rename('Total_Pago')
+                custo_caixa_agg = df_filtrado.drop_duplicates(subset=['Consultor', 'Caixa_Pago']).groupby('Consultor', observed=True)['Caixa_Pago'].sum().rename('Total_Pago')
 
                 apagar = pd.concat([custo_contabil_agg, custo_caixa_agg], axis=1).fillna(0)
                 apagar = apagar[apagar.index != 'N/A']
@@ -1182,11 +1342,11 @@ with tab2:
         st.markdown("### 💳 A Receber - Clientes")
         if not df_filtrado.empty:
             try:
-                receita_contabil_agg = df_filtrado.groupby('Cliente').agg(
+                receita_contabil_agg = crq.cubo.agregar(celulas_filtradas, 'Cliente',
                     Horas_Faturadas=('Hrs_Real', 'sum'),
                     Total_Faturado=('Receita', 'sum')
                 )
-                receita_caixa_agg = df_filtrado.drop_duplicates(subset=['Cliente', 'Caixa_Recebido']).groupby('Cliente')['Caixa_Recebido'].sum().rename('Total_Recebido')
+                receita_caixa_agg = df_filtrado.drop_duplicates(subset=['Cliente', 'Caixa_Recebido']).groupby('Cliente', observed=True)['Caixa_Recebido'].sum().rename('Total_Recebido')
                 
                 areceber = pd.concat([receita_contabil_agg, receita_caixa_agg], axis=1).fillna(0)
                 areceber = areceber[areceber.index != 'N/A']
@@ -1212,6 +1372,19 @@ with tab2:
         else:
              st.info("💳 Sem dados para fechamento A Receber")
     
+    # Lançamentos linha a linha só são buscados no banco quando solicitados
+    with st.expander("🔎 Lançamentos de Caixa do Mês"):
+        if not str(mes_sel).isdigit() or not str(ano_sel).isdigit():
+            st.info("Selecione um mês e um ano para detalhar os lançamentos.")
+        elif st.checkbox("Carregar lançamentos do período", key="drill_caixa"):
+            col_lanc_pag, col_lanc_rec = st.columns(2)
+            with col_lanc_pag:
+                st.markdown("**Contas a Pagar**")
+                st.dataframe(buscar_lancamentos_caixa('cp', ano_sel, mes_sel, crq.conn, caixa_quitado), use_container_width=True)
+            with col_lanc_rec:
+                st.markdown("**Contas a Receber**")
+                st.dataframe(buscar_lancamentos_caixa('cr', ano_sel, mes_sel, crq.conn, caixa_quitado), use_container_width=True)
+
     st.markdown("---")
     
     try:
@@ -1231,7 +1404,7 @@ with tab2:
 # ═══════════════════════════════════════════════════════════════════════════════
 
 with tab3:
-    st.markdown(f"## 💵 Fluxo de Caixa vs. Contábil - {mes_sel}/{ano_sel}")
+    st.markdown(f"## 💵 Fluxo de Caixa vs. Contábil - {rotulo_sel}")
     st.markdown("### Resumo de Caixa (Período Selecionado)")
 
     col_c1, col_c2, col_c3 = st.columns(3)
@@ -1330,7 +1503,7 @@ with tab3:
 # ═══════════════════════════════════════════════════════════════════════════════
 
 with tab4:
-    st.markdown(f"## 🔬 Análise Profunda - {mes_sel}/{ano_sel}")
+    st.markdown(f"## 🔬 Análise Profunda - {rotulo_sel}")
 
     st.markdown("### 🩸 Detecção de Sangria (Projetos Fechados com Overrun)")
     if not df_filtrado.empty:
@@ -1421,7 +1594,7 @@ with tab5:
     st.markdown("## 🧠 Ressonância Prescritiva Ativa")
 
     if ia_ativa and prescricoes:
-        st.success(f"✅ **CRQ Online** - {len(prescricoes)} prescrições geradas para {mes_sel}/{ano_sel}")
+        st.success(f"✅ **CRQ Online** - {len(prescricoes)} prescrições geradas para {rotulo_sel}")
 
         # Filtro de prioridades
         prioridades = ['TODAS'] + sorted(list(set([p['prioridade'] for p in prescricoes])))
@@ -1513,7 +1686,7 @@ with tab6:
     if not df_filtrado.empty and socratic:
         with st.spinner('🧠 Analisando profundamente seus dados e gerando perguntas estratégicas...'):
             try:
-                perguntas = socratic.gerar_perguntas_estrategicas()
+                perguntas = crq.memorizar('perguntas', socratic.gerar_perguntas_estrategicas)
             except Exception as e:
                 st.error(f"Erro ao gerar perguntas socráticas: {e}")
                 perguntas = []
@@ -6,6 +6,7 @@ import streamlit as st
 import pandas as pd
 import pyodbc
 import io
+from motor_dados import config_motor, extrair_em_paralelo, iterar_sql
 
 # --- Configuração da Página ---
 st.set_page_config(page_title="Extrator de Dados Maestro (Diagnóstico)", layout="wide")
@@ -67,6 +68,17 @@ QUERIES = {
     "ClassifFinanc_DIM": "SELECT * FROM ClassifFinanc"
 }
 
+# --- Modo de Extração ---
+col_modo, col_limite = st.columns(2)
+with col_modo:
+    extracao_paralela = st.toggle("Extração paralela (uma conexão por worker)", value=True)
+with col_limite:
+    max_conexoes = st.number_input(
+        "Máximo de conexões simultâneas", min_value=1, max_value=len(QUERIES),
+        value=min(int(config_motor("max_conexoes_paralelas", 4)), len(QUERIES)),
+        disabled=not extracao_paralela
+    )
+
 # --- Botão de Extração ---
 if st.button("🚀 Extrair DADOS COMPLETOS (Diagnóstico)", type="primary"):
     try:
@@ -78,16 +90,31 @@ if st.button("🚀 Extrair DADOS COMPLETOS (Diagnóstico)", type="primary"):
         st.info("Conexão estabelecida. Iniciando extração de múltiplas tabelas...")
         
         summary = []
+
+        if extracao_paralela:
+            with st.spinner(f"Extraindo {len(QUERIES)} tabelas em paralelo ({max_conexoes} conexões)..."):
+                dfs, erros = extrair_em_paralelo(QUERIES, get_connection, max_conexoes)
         
         # Loop para executar cada query e salvar em uma aba
         for sheet_name, query in QUERIES.items():
             try:
-                with st.spinner(f"Extraindo dados da aba: {sheet_name}..."):
-                    df = pd.read_sql(query, cnxn)
+                if extracao_paralela:
+                    if sheet_name in erros:
+                        raise erros[sheet_name]
+                    df = dfs[sheet_name]
+                    df.to_excel(writer, sheet_name=sheet_name, index=False)
+                    total = len(df)
+                else:
+                    # Sequencial: grava bloco a bloco, sem materializar a tabela inteira
+                    with st.spinner(f"Extraindo dados da aba: {sheet_name}..."):
+                        total = 0
+                        for bloco in iterar_sql(query, cnxn):
+                            bloco.to_excel(writer, sheet_name=sheet_name, index=False,
+                                           startrow=total + 1 if total else 0, header=not total)
+                            total += len(bloco)
                 
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-                st.write(f"✔️ ...Aba `{sheet_name}` extraída com {len(df)} registros.")
-                summary.append(f"| {sheet_name} | {len(df)} registros |")
+                st.write(f"✔️ ...Aba `{sheet_name}` extraída com {total} registros.")
+                summary.append(f"| {sheet_name} | {total} registros |")
             except Exception as e:
                 st.warning(f"⚠️ ...Falha ao extrair aba `{sheet_name}`. Erro: {e}")
                 summary.append(f"| {sheet_name} | FALHA NA EXTRAÇÃO |")
@@ -0,0 +1,2115 @@
+# -*- coding: utf-8 -*-
+# ═══════════════════════════════════════════════════════════════════════════════
+# MOTOR DE DADOS - CAMADA COMPARTILHADA DE ACESSO AO BANCO
+# ═══════════════════════════════════════════════════════════════════════════════
+import streamlit as st
+import pandas as pd
+import numpy as np
+import sqlite3
+import threading
+import time
+import hashlib
+import json
+import os
+import decimal
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CONFIGURAÇÃO DO MOTOR
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def config_motor(chave, padrao=None):
+    """Lê uma opção da seção [motor_cqr] do st.secrets, retornando o padrão se ausente."""
+    try:
+        return st.secrets.get("motor_cqr", {}).get(chave, padrao)
+    except Exception:
+        return padrao
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CONEXÃO E EXECUÇÃO DE QUERIES
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class FonteSqlServer:
+    """Fonte de produção: SQL Server via pyodbc, com as credenciais de [db_credentials]."""
+    nome = "sqlserver"
+    # Recursos de T-SQL usados no pushdown de junções e na agregação de caixa no servidor
+    recursos_servidor = True
+    # CHECKSUM_AGG(BINARY_CHECKSUM(*)) muda com inserções, exclusões e edições de linhas
+    detecta_edicoes = True
+
+    def conectar(self):
+        # Importado aqui para que a fonte local funcione em máquinas sem driver ODBC
+        import pyodbc
+
+        DB_SERVER = st.secrets["db_credentials"]["server"]
+        DB_DATABASE = st.secrets["db_credentials"]["database"]
+        DB_USERNAME = st.secrets["db_credentials"]["username"]
+        DB_PASSWORD = st.secrets["db_credentials"]["password"]
+
+        conn_str = (
+            f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+            f"SERVER={DB_SERVER};"
+            f"DATABASE={DB_DATABASE};"
+            f"UID={DB_USERNAME};"
+            f"PWD={DB_PASSWORD};"
+            f"TrustServerCertificate=yes;"
+        )
+        return pyodbc.connect(conn_str, timeout=30)
+
+    def query_colunas(self, tabelas):
+        marcadores = ", ".join("?" for _ in tabelas)
+        return (
+            "SELECT TABLE_NAME, COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS "
+            f"WHERE TABLE_NAME IN ({marcadores}) ORDER BY TABLE_NAME, ORDINAL_POSITION"
+        )
+
+    def expr_checksum(self):
+        return "CHECKSUM_AGG(BINARY_CHECKSUM(*))"
+
+    def expr_contagem(self):
+        return "COUNT_BIG(*)"
+
+    def filtro_mes(self, coluna):
+        data = f"TRY_CAST([{coluna}] AS DATETIME)"
+        return f"YEAR({data}) = ? AND MONTH({data}) = ?"
+
+
+class FonteSQLite:
+    """
+    Fonte local em arquivo SQLite com as mesmas tabelas do SQL Server, para medir carga e
+    análises sem o banco de produção (preenchida por `carregar_exportacao_extrator`).
+    Sem T-SQL: junções e agregações de caixa ficam sempre em pandas.
+    """
+    nome = "sqlite"
+    recursos_servidor = False
+    # O checksum por rowid não enxerga UPDATE em linhas existentes (ver `expr_checksum`)
+    detecta_edicoes = False
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+
+    def conectar(self):
+        if not os.path.exists(self.caminho):
+            raise FileNotFoundError(f"Base local não encontrada: {self.caminho}")
+        # As conexões circulam entre threads pelo pool, uma de cada vez
+        return sqlite3.connect(self.caminho, check_same_thread=False)
+
+    def query_colunas(self, tabelas):
+        marcadores = ", ".join("?" for _ in tabelas)
+        return (
+            "SELECT m.name AS TABLE_NAME, p.name AS COLUMN_NAME "
+            "FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+            f"WHERE m.type = 'table' AND m.name IN ({marcadores}) ORDER BY m.name, p.cid"
+        )
+
+    def expr_checksum(self):
+        # Sem checksum de linha no SQLite: a soma dos rowids detecta inserções e exclusões,
+        # mas não edições de linhas existentes (essas exigem "Reprocessar Dados")
+        return "TOTAL(rowid)"
+
+    def expr_contagem(self):
+        return "COUNT(*)"
+
+    def filtro_mes(self, coluna):
+        return (f"CAST(strftime('%Y', [{coluna}]) AS INTEGER) = ? "
+                f"AND CAST(strftime('%m', [{coluna}]) AS INTEGER) = ?")
+
+
+@st.cache_resource
+def fonte_dados():
+    """Retorna a fonte configurada em `fonte` ([motor_cqr]): "sqlserver" (padrão) ou "sqlite"."""
+    if config_motor("fonte", "sqlserver") == "sqlite":
+        return FonteSQLite(config_motor("caminho_sqlite", "cqr_local.db"))
+    return FonteSqlServer()
+
+
+def criar_conexao():
+    """Abre uma nova conexão com a fonte de dados configurada (sem cache)."""
+    return fonte_dados().conectar()
+
+class PoolConexoes:
+    """
+    Pool limitado de conexões da fonte de dados compartilhado entre sessões e threads.
+    Cada conexão é validada no empréstimo (SELECT 1); conexões quebradas são descartadas
+    e reabertas com backoff exponencial, sem exigir "Reprocessar Dados".
+    """
+
+    def __init__(self, fabrica, tamanho=8, espera_maxima=60, tentativas=3, backoff=0.5):
+        self.fabrica = fabrica
+        self.tamanho = max(1, int(tamanho))
+        self.espera_maxima = espera_maxima
+        self.tentativas = max(1, int(tentativas))
+        self.backoff = backoff
+        self._livres = []
+        self._vagas = threading.BoundedSemaphore(self.tamanho)
+        self._trava = threading.Lock()
+        self._contadores = {
+            'abertas': 0, 'em_uso': 0, 'emprestimos': 0, 'esperas': 0,
+            'reconexoes': 0, 'falhas_validacao': 0,
+        }
+
+    def _contar(self, chave, delta=1):
+        with self._trava:
+            self._contadores[chave] += delta
+
+    def _abrir(self, reconexao=False):
+        """Abre uma conexão nova, repetindo com backoff exponencial em caso de falha."""
+        for tentativa in range(self.tentativas):
+            try:
+                conn = self.fabrica()
+                self._contar('abertas')
+                if reconexao:
+                    self._contar('reconexoes')
+                return conn
+            except Exception:
+                if tentativa == self.tentativas - 1:
+                    raise
+                time.sleep(self.backoff * (2 ** tentativa))
+
+    def _valida(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _descartar(self, conn):
+        self._contar('abertas', -1)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def emprestar(self):
+        """Empresta uma conexão validada; aguarda até `espera_maxima` segundos por uma vaga."""
+        if not self._vagas.acquire(blocking=False):
+            self._contar('esperas')
+            if not self._vagas.acquire(timeout=self.espera_maxima):
+                raise TimeoutError(f"Nenhuma conexão livre no pool após {self.espera_maxima}s.")
+
+        conn = None
+        try:
+            with self._trava:
+                conn = self._livres.pop() if self._livres else None
+            if conn is not None and not self._valida(conn):
+                self._contar('falhas_validacao')
+                self._descartar(conn)
+                conn = self._abrir(reconexao=True)
+            elif conn is None:
+                conn = self._abrir()
+        except Exception:
+            self._vagas.release()
+            raise
+
+        self._contar('em_uso')
+        self._contar('emprestimos')
+        try:
+            yield conn
+        finally:
+            self._contar('em_uso', -1)
+            with self._trava:
+                self._livres.append(conn)
+            self._vagas.release()
+
+    def metricas(self):
+        """Retorna um retrato dos contadores do pool (em uso, esperas, reconexões...)."""
+        with self._trava:
+            return {'tamanho': self.tamanho, 'livres': len(self._livres), **self._contadores}
+
+    def fechar(self):
+        """Fecha as conexões ociosas do pool."""
+        with self._trava:
+            livres, self._livres = self._livres, []
+        for conn in livres:
+            self._descartar(conn)
+
+
+@st.cache_resource
+def init_connection():
+    """Cria o pool de conexões compartilhado e valida a primeira conexão."""
+    pool = PoolConexoes(
+        criar_conexao,
+        tamanho=config_motor("tamanho_pool", 8),
+        espera_maxima=config_motor("espera_maxima_pool", 60),
+        tentativas=config_motor("tentativas_reconexao", 3),
+    )
+    try:
+        with pool.emprestar():
+            pass
+        return pool
+    except Exception as e:
+        st.error(f"❌ Erro de Conexão com Banco de Dados: {e}")
+        return None
+
+
+def _coluna_tipada(valores, tipo):
+    """Converte os valores de uma coluna do cursor em um array já tipado (tipo do driver)."""
+    if tipo in (float, decimal.Decimal) or (tipo is int and None in valores):
+        return np.array([np.nan if v is None else float(v) for v in valores], dtype='float64')
+    if tipo is int:
+        return np.array(valores, dtype='int64')
+    if tipo is datetime:
+        return pd.to_datetime(list(valores), errors='coerce')
+    # Texto e tipos desconhecidos: deixa o pandas inferir a coluna
+    return pd.Series(valores)
+
+
+def iterar_sql(sql, _conn, params=None, tamanho_bloco=None):
+    """
+    Lê um SELECT em blocos de `tamanho_bloco` linhas (cursor.fetchmany), gerando um
+    DataFrame tipado por bloco; permite agregar antes de o fetch terminar. Com um
+    PoolConexoes a conexão fica emprestada até o fim da iteração. Com
+    `tamanho_bloco_leitura` = 0, gera um único DataFrame lido por pd.read_sql.
+    """
+    if tamanho_bloco is None:
+        tamanho_bloco = config_motor("tamanho_bloco_leitura", 50000)
+    if isinstance(_conn, PoolConexoes):
+        with _conn.emprestar() as conn:
+            yield from iterar_sql(sql, conn, params, tamanho_bloco)
+        return
+    if not tamanho_bloco:
+        yield pd.read_sql(sql, _conn, params=params)
+        return
+
+    cursor = _conn.cursor()
+    try:
+        if params:
+            cursor.execute(sql, params)
+        else:
+            cursor.execute(sql)
+        colunas = [d[0] for d in cursor.description]
+        tipos = [d[1] for d in cursor.description]
+        vazio = True
+        while True:
+            linhas = cursor.fetchmany(max(1, int(tamanho_bloco)))
+            if not linhas:
+                break
+            vazio = False
+            bloco = pd.DataFrame({i: _coluna_tipada(valores, tipo)
+                                  for i, (valores, tipo) in enumerate(zip(zip(*linhas), tipos))})
+            bloco.columns = colunas
+            yield bloco
+        if vazio:
+            yield pd.DataFrame(columns=colunas)
+    finally:
+        cursor.close()
+
+
+def ler_sql(sql, _conn, params=None, tamanho_bloco=None):
+    """
+    Executa um SELECT em uma conexão ou em um PoolConexoes (emprestando uma conexão).
+    Com `tamanho_bloco_leitura` > 0 (padrão) lê em blocos e concatena; com 0 usa pd.read_sql.
+    """
+    if tamanho_bloco is None:
+        tamanho_bloco = config_motor("tamanho_bloco_leitura", 50000)
+    blocos = list(iterar_sql(sql, _conn, params, tamanho_bloco))
+    return blocos[0] if len(blocos) == 1 else pd.concat(blocos, ignore_index=True)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# EXTRAÇÃO PARALELA
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def extrair_em_paralelo(queries, fabrica_conexao, max_workers=None):
+    """
+    Executa as queries (texto ou tupla (sql, params)) em um pool limitado de threads;
+    cada worker abre (uma vez) a sua própria conexão via `fabrica_conexao`, pois
+    conexões pyodbc não devem ser compartilhadas entre threads. Se `fabrica_conexao` for um
+    PoolConexoes, cada query empresta uma conexão do pool.
+    Retorna ({nome: DataFrame}, {nome: erro}) preservando a ordem de `queries`; queries com
+    falha retornam DataFrame vazio.
+    """
+    if max_workers is None:
+        max_workers = config_motor("max_conexoes_paralelas", 4)
+    max_workers = max(1, min(int(max_workers), len(queries) or 1))
+
+    local = threading.local()
+    conexoes = []
+    trava = threading.Lock()
+
+    def conexao_do_worker():
+        if getattr(local, 'conn', None) is None:
+            local.conn = fabrica_conexao()
+            with trava:
+                conexoes.append(local.conn)
+        return local.conn
+
+    def executar(query):
+        sql, params = query if isinstance(query, tuple) else (query, None)
+        if isinstance(fabrica_conexao, PoolConexoes):
+            return ler_sql(sql, fabrica_conexao, params)
+        return ler_sql(sql, conexao_do_worker(), params)
+
+    dfs, erros = {}, {}
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cqr-extracao") as pool:
+            futuros = {pool.submit(executar, query): nome for nome, query in queries.items()}
+            for futuro in as_completed(futuros):
+                nome = futuros[futuro]
+                try:
+                    dfs[nome] = futuro.result()
+                except Exception as e:
+                    dfs[nome] = pd.DataFrame()
+                    erros[nome] = e
+    finally:
+        for conn in conexoes:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    return {nome: dfs[nome] for nome in queries}, erros
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CACHE DE RESULTADOS (LRU POR MEMÓRIA, INVALIDADO PELA VERSÃO DAS FONTES)
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class CacheResultados:
+    """
+    Cache LRU de DataFrames com orçamento de memória em bytes. A chave é
+    (nome, query com as colunas projetadas, versão das tabelas lidas): quando uma tabela muda,
+    a versão muda e a entrada antiga é descartada; não há expiração por relógio.
+    """
+
+    def __init__(self, limite_bytes):
+        self.limite_bytes = int(limite_bytes)
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self._trava = threading.Lock()
+        self._contadores = {'acertos': 0, 'faltas': 0, 'descartes': 0, 'invalidacoes': 0}
+        # Última sonda de versão vista, para consultas avulsas (drill-down) entre recargas
+        self.versao_fontes = None
+
+    def obter(self, chave):
+        with self._trava:
+            item = self._itens.get(chave)
+            if item is None:
+                self._contadores['faltas'] += 1
+                return None
+            self._itens.move_to_end(chave)
+            self._contadores['acertos'] += 1
+        # Cópia rasa: com Copy-on-Write o chamador não altera a entrada guardada
+        return item[0].copy(deep=False)
+
+    def guardar(self, chave, df):
+        tamanho = int(df.memory_usage(deep=True).sum())
+        if tamanho > self.limite_bytes:
+            return
+        with self._trava:
+            # Versões anteriores da mesma query deixam de valer
+            for antiga in [c for c in self._itens if c[:2] == chave[:2] and c != chave]:
+                self._bytes -= self._itens.pop(antiga)[1]
+                self._contadores['invalidacoes'] += 1
+            if chave in self._itens:
+                self._bytes -= self._itens.pop(chave)[1]
+            self._itens[chave] = (df, tamanho)
+            self._bytes += tamanho
+            while self._bytes > self.limite_bytes and self._itens:
+                _, (_, liberado) = self._itens.popitem(last=False)
+                self._bytes -= liberado
+                self._contadores['descartes'] += 1
+
+    def limpar(self):
+        with self._trava:
+            self._itens.clear()
+            self._bytes = 0
+
+    def metricas(self):
+        """Retorna acertos, faltas, descartes, invalidações, entradas e memória ocupada."""
+        with self._trava:
+            return {**self._contadores, 'entradas': len(self._itens),
+                    'bytes': self._bytes, 'limite_bytes': self.limite_bytes}
+
+
+@st.cache_resource
+def cache_resultados():
+    """Cache de resultados compartilhado pelo processo (`cache_resultados_mb` em [motor_cqr])."""
+    return CacheResultados(config_motor("cache_resultados_mb", 1024) * 1024 * 1024)
+
+
+class CacheAnalises:
+    """
+    LRU limitado por número de entradas para os resultados das análises de um conjunto de
+    filtros (seleção, métricas, padrões, prescrições...). A chave começa pela versão dos
+    dados; ao guardar uma versão nova, as entradas de versões anteriores são descartadas.
+    """
+
+    def __init__(self, limite_entradas):
+        self.limite_entradas = max(1, int(limite_entradas))
+        self._itens = OrderedDict()
+        self._trava = threading.Lock()
+        self._contadores = {'acertos': 0, 'faltas': 0}
+
+    def obter(self, chave):
+        with self._trava:
+            analise = self._itens.get(chave)
+            if analise is None:
+                self._contadores['faltas'] += 1
+                return None
+            self._itens.move_to_end(chave)
+            self._contadores['acertos'] += 1
+            return analise
+
+    def guardar(self, chave, analise):
+        with self._trava:
+            for antiga in [c for c in self._itens if c[0] != chave[0]]:
+                del self._itens[antiga]
+            self._itens[chave] = analise
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.limite_entradas:
+                self._itens.popitem(last=False)
+
+    def complementar(self, chave, nome, valor):
+        """
+        Acrescenta um resultado derivado (`nome`) à entrada `chave`, trocando-a por uma cópia;
+        o dicionário já entregue às sessões não é alterado. Entradas já descartadas são ignoradas.
+        """
+        with self._trava:
+            analise = self._itens.get(chave)
+            if analise is None:
+                return
+            self._itens[chave] = {**analise, nome: valor}
+            self._itens.move_to_end(chave)
+
+    def limpar(self):
+        with self._trava:
+            self._itens.clear()
+
+    def metricas(self):
+        with self._trava:
+            return {**self._contadores, 'entradas': len(self._itens), 'limite_entradas': self.limite_entradas}
+
+
+@st.cache_resource
+def cache_analises():
+    """Cache de análises compartilhado pelas sessões (`cache_analises_entradas` em [motor_cqr])."""
+    return CacheAnalises(config_motor("cache_analises_entradas", 32))
+
+
+def normalizar_filtros(filtros):
+    """
+    Forma canônica e hashable de um dicionário de filtros da sidebar: listas viram tuplas
+    ordenadas sem repetição e seleções com 'TODOS' (ou vazias) viram None.
+    """
+    normalizados = []
+    for chave in sorted(filtros):
+        valor = filtros[chave]
+        if isinstance(valor, (list, tuple, set)):
+            valor = None if not valor or 'TODOS' in valor else tuple(sorted({str(v) for v in valor}))
+        elif valor is not None:
+            valor = str(valor)
+        normalizados.append((chave, valor))
+    return tuple(normalizados)
+
+
+def assinatura_filtros(filtros):
+    """
+    Parte da chave do cache de análises que vem dos filtros: seleções de dimensão normalizadas,
+    o intervalo completo (início, fim) de `intervalo_dos_filtros` e o modo de período. Dois
+    intervalos com o mesmo início nunca dividem uma entrada; período inválido entra como
+    os campos brutos normalizados.
+    """
+    dimensoes = {chave: filtros.get(chave) for chave in FILTROS_DIMENSOES}
+    try:
+        intervalo = intervalo_dos_filtros(filtros)
+    except (ValueError, TypeError):
+        intervalo = normalizar_filtros({c: v for c, v in filtros.items() if c not in FILTROS_DIMENSOES})
+    return normalizar_filtros(dimensoes), intervalo, filtros.get('modo_periodo')
+
+
+def chave_resultado(nome, query, versao_fontes):
+    """
+    Monta a chave do cache: (nome, query, versão das tabelas do catálogo citadas na query).
+    Retorna None quando a versão é desconhecida (nesse caso a query não é cacheada).
+    """
+    if versao_fontes is None or versao_fontes.empty:
+        return None
+    texto = query if isinstance(query, str) else f"{query[0]} | {tuple(query[1])}"
+    versoes = {str(r.Alias): (str(r.Linhas), str(r.Checksum)) for r in versao_fontes.itertuples(index=False)}
+    lidas = tuple(
+        (alias, versoes.get(alias)) for alias, spec in CATALOGO_COLUNAS.items()
+        if f"[{spec['tabela']}]" in texto
+    )
+    return (nome, texto, lidas)
+
+
+def buscar_tabelas(queries, _conn, paralelo=None, max_workers=None, versao=None, mensagens=None):
+    """
+    Busca todas as queries do universo e retorna o dicionário `dfs` esperado pelo motor.
+    Antes de ir ao banco, sonda a versão das fontes (ou usa `versao`) e reaproveita do
+    `cache_resultados()` as tabelas que não mudaram; só as demais são lidas. A query
+    `query_versao_fontes()` é respondida pela própria sonda. Cada tabela lida recebe os tipos
+    de `ESQUEMA_COLUNAS` do seu alias antes de ir ao cache. No modo paralelo (padrão,
+    `busca_paralela` em [motor_cqr]) o tempo total tende ao da tabela mais lenta. Falhas de
+    query vão para `mensagens` (MensagensCarga; padrão: st.warning).
+    """
+    mensagens = mensagens or MensagensCarga()
+    if paralelo is None:
+        paralelo = config_motor("busca_paralela", True)
+    if max_workers is None:
+        max_workers = config_motor("max_conexoes_paralelas", 4)
+
+    if versao is None:
+        try:
+            versao = sondar_versao_fontes(_conn)
+        except Exception:
+            versao = pd.DataFrame()
+    cache = cache_resultados()
+    cache.versao_fontes = versao
+
+    dfs, faltantes, chaves = {}, {}, {}
+    for nome, query in queries.items():
+        if query == query_versao_fontes() and not versao.empty:
+            dfs[nome] = versao
+            continue
+        chaves[nome] = chave_resultado(nome, query, versao)
+        df = cache.obter(chaves[nome]) if chaves[nome] else None
+        if df is None:
+            faltantes[nome] = query
+        else:
+            dfs[nome] = df
+
+    if paralelo and len(faltantes) > 1:
+        fabrica = _conn if isinstance(_conn, PoolConexoes) else (init_connection() or criar_conexao)
+        lidos, erros = extrair_em_paralelo(faltantes, fabrica, max_workers)
+    else:
+        lidos, erros = {}, {}
+        for nome, query in faltantes.items():
+            try:
+                lidos[nome] = ler_sql(query, _conn)
+            except Exception as e:
+                lidos[nome], erros[nome] = pd.DataFrame(), e
+
+    for nome, df in lidos.items():
+        if nome in erros:
+            mensagens.aviso(f"⚠️ Falha ao executar query '{nome}': {erros[nome]}")
+        else:
+            df = aplicar_esquema(df, nome)
+            if chaves[nome]:
+                cache.guardar(chaves[nome], df)
+        dfs[nome] = df
+    return {nome: dfs[nome] for nome in queries}
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CATÁLOGO DE COLUNAS (PROJEÇÃO DAS CONSULTAS)
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# Mapeamento das colunas do banco para os nomes usados pelo motor
+MAPA_COLUNAS = {
+    'QtHrReal': 'Hrs_Real', 'QtHrOrc': 'Hrs_Prev', 'ReceitaReal': 'Receita',
+    'CustoReal': 'Custo', 'PercMgReal': 'Margem_Fracao', 'VlHrOrc': 'VH_Venda',
+    'VlHrCusto': 'VH_Custo', 'ReceitaOrc': 'Receita_Orc', 'CustoOrc': 'Custo_Orc',
+    'VlTTFat': 'Vl_Faturado_Contrato', 'NomeTec': 'Consultor', 'DescCli': 'Cliente',
+    'DescProj': 'Projeto', 'DescTipo': 'TipoProj',
+}
+
+# Medidas podem estar na tabela fato ou nas dimensões; cada tabela só projeta as que possui
+COLUNAS_MEDIDAS = ['QtHrReal', 'QtHrOrc', 'ReceitaReal', 'CustoReal', 'PercMgReal',
+                   'VlHrOrc', 'VlHrCusto', 'ReceitaOrc', 'CustoOrc', 'VlTTFat']
+COLUNAS_CHAVES_PROJ = ['CodCliProj', 'CodNegProj', 'TipoProj', 'StatusProj']
+
+# Tipos declarados por alias do catálogo, aplicados uma única vez na ingestão de cada tabela;
+# o código a jusante confia nesses tipos e não repete pd.to_numeric/pd.to_datetime
+_ESQUEMA_MEDIDAS = {coluna: 'numero' for coluna in COLUNAS_MEDIDAS}
+ESQUEMA_COLUNAS = {
+    'g': {'ConsultGest': 'numero', 'ProjGest': 'numero', 'Ano': 'numero', 'Mes': 'numero', **_ESQUEMA_MEDIDAS},
+    'p': _ESQUEMA_MEDIDAS,
+    'tec': _ESQUEMA_MEDIDAS,
+    'cr': {'DtRec': 'data', 'Cliente': 'numero', 'VlRec': 'numero', 'quitado': 'flag'},
+    'cp': {'DtPagamento': 'data', 'Prestador': 'numero', 'VlPago': 'numero', 'quitado': 'flag'},
+}
+
+
+def aplicar_esquema(df, alias):
+    """
+    Converte as colunas presentes para os tipos de `ESQUEMA_COLUNAS[alias]` (colunas já
+    tipadas ficam como estão). Aliases fora do esquema voltam sem alteração.
+    """
+    for coluna, tipo in ESQUEMA_COLUNAS.get(alias, {}).items():
+        if coluna not in df.columns:
+            continue
+        serie = df[coluna]
+        if tipo == 'numero' and not pd.api.types.is_numeric_dtype(serie):
+            df[coluna] = pd.to_numeric(serie.astype(str).str.strip(), errors='coerce')
+        elif tipo == 'data' and not pd.api.types.is_datetime64_any_dtype(serie):
+            df[coluna] = pd.to_datetime(serie, errors='coerce')
+        elif tipo == 'flag':
+            # 'S'/'N' sem espaços e em maiúsculas; nulos viram texto vazio
+            df[coluna] = serie.fillna('').astype(str).str.strip().str.upper()
+    return df
+
+
+# Colunas candidatas por tabela: chaves de junção, campos de `MAPA_COLUNAS` e campos de caixa.
+# A projeção final é a interseção com as colunas que realmente existem no banco.
+CATALOGO_COLUNAS = {
+    "g": {
+        "tabela": "Tb_GestorFin2",
+        "colunas": ['IdGest2', 'ConsultGest', 'ProjGest', 'Ano', 'Mes'] + COLUNAS_CHAVES_PROJ + COLUNAS_MEDIDAS,
+    },
+    "cr": {
+        "tabela": "Contas Receber",
+        "colunas": ['DtRec', 'Cliente', 'VlRec', 'quitado'],
+    },
+    "cp": {
+        "tabela": "Contas Pagar",
+        "colunas": ['DtPagamento', 'Prestador', 'VlPago', 'quitado'],
+    },
+    "p": {
+        "tabela": "tb_Proj",
+        "colunas": ['AutNumProj', 'DescProj'] + COLUNAS_CHAVES_PROJ + COLUNAS_MEDIDAS,
+    },
+    "tec": {
+        "tabela": "tb_tec",
+        "colunas": ['AutNumTec', 'NomeTec'] + COLUNAS_MEDIDAS,
+    },
+    "cli": {
+        "tabela": "tb_cli",
+        "colunas": ['AutNumCli', 'DescCli'],
+    },
+    "tp": {
+        "tabela": "tb_tipoproj",
+        "colunas": ['AutNumTipo', 'DescTipo'],
+    },
+    "neg": {
+        "tabela": "tb_neg",
+        "colunas": ['AutNumNeg'],
+    },
+    "st": {
+        "tabela": "tb_StatusProj",
+        "colunas": ['AutNumStatus'],
+    },
+}
+
+# Junções LEFT do universo, na ordem: (alias, chave na esquerda, chave na dimensão, sufixos do merge)
+JUNCOES_DIMENSOES = [
+    ('tec', 'ConsultGest', 'AutNumTec', ('_x', '_y')),
+    ('p', 'ProjGest', 'AutNumProj', ('', '_proj')),
+    ('cli', 'CodCliProj', 'AutNumCli', ('_x', '_y')),
+    ('tp', 'TipoProj', 'AutNumTipo', ('_x', '_y')),
+    ('neg', 'CodNegProj', 'AutNumNeg', ('_x', '_y')),
+    ('st', 'StatusProj', 'AutNumStatus', ('_x', '_y')),
+]
+
+# Aliases das dimensões usadas nas junções do universo
+ALIASES_DIMENSOES = [alias for alias, *_ in JUNCOES_DIMENSOES]
+
+# Chaves da tabela fato convertidas para número antes das junções
+CHAVES_NUMERICAS_FATO = ['ConsultGest', 'ProjGest']
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def descobrir_colunas(tabelas, _conn):
+    """Consulta o catálogo da fonte e retorna {tabela: [colunas]} para as tabelas informadas."""
+    if not _conn:
+        return {}
+    try:
+        df = ler_sql(fonte_dados().query_colunas(tabelas), _conn, params=list(tabelas))
+    except Exception:
+        return {}
+    return df.groupby('TABLE_NAME')['COLUMN_NAME'].apply(list).to_dict()
+
+
+def montar_query(tabela, colunas=None):
+    """Monta o SELECT de uma tabela; sem lista de colunas, recai no SELECT *."""
+    if not colunas:
+        return f"SELECT * FROM [{tabela}]"
+    lista = ", ".join(f"[{c}]" for c in colunas)
+    return f"SELECT {lista} FROM [{tabela}]"
+
+
+def projetar_colunas(_conn, colunas_extras=None):
+    """
+    Resolve as colunas projetadas de cada alias do catálogo: {alias: [colunas]}, ou
+    {alias: None} quando o esquema é desconhecido ou a tabela inteira foi pedida.
+    `colunas_extras` ({alias: [colunas]} ou {alias: '*'}) habilita colunas adicionais;
+    por padrão é lido de `colunas_extras` na seção [motor_cqr] do st.secrets.
+    """
+    if colunas_extras is None:
+        colunas_extras = config_motor("colunas_extras", {}) or {}
+
+    tabelas = tuple(spec["tabela"] for spec in CATALOGO_COLUNAS.values())
+    esquema = descobrir_colunas(tabelas, _conn)
+
+    projecao = {}
+    for alias, spec in CATALOGO_COLUNAS.items():
+        extras = colunas_extras.get(alias, [])
+        existentes = esquema.get(spec["tabela"])
+        if extras == '*' or not existentes:
+            # Sem esquema conhecido (ou pedido explícito), mantém a leitura completa
+            projecao[alias] = None
+            continue
+        desejadas = list(dict.fromkeys(spec["colunas"] + list(extras)))
+        projecao[alias] = [c for c in existentes if c in desejadas] or None
+    return projecao
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PUSHDOWN DAS JUNÇÕES DE DIMENSÃO PARA O SQL SERVER
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def montar_query_pushdown(projecao):
+    """
+    Gera um único SELECT com os LEFT JOINs de `JUNCOES_DIMENSOES` executados no servidor.
+    As colunas de saída reproduzem as de `entrelacar_dimensoes` (mesmos sufixos, sem as
+    chaves das dimensões), então o resultado segue direto para `mapear_metricas`. Retorna None quando a
+    projeção de alguma tabela é desconhecida (nesse caso vale o caminho em pandas).
+    """
+    if any(projecao.get(alias) is None for alias in ['g'] + ALIASES_DIMENSOES):
+        return None
+
+    saida = {c: f"g.[{c}]" for c in projecao['g']}
+    juncoes = []
+    for alias, chave_esq, chave_dir, sufixos in JUNCOES_DIMENSOES:
+        if chave_esq not in saida or chave_dir not in projecao[alias]:
+            return None
+        colunas_dir = colunas_anexadas(projecao[alias], chave_dir)
+        if not colunas_dir:
+            continue
+
+        expr_esq = saida[chave_esq]
+        if chave_esq in CHAVES_NUMERICAS_FATO:
+            # O caminho em pandas converte essas chaves com pd.to_numeric antes do merge
+            expr_esq = f"TRY_CAST({expr_esq} AS FLOAT)"
+        tabela = CATALOGO_COLUNAS[alias]["tabela"]
+        juncoes.append(f"LEFT JOIN [{tabela}] {alias} ON {alias}.[{chave_dir}] = {expr_esq}")
+
+        sobrepostas = set(saida) & set(colunas_dir)
+        nova_saida = {}
+        for nome, expr in saida.items():
+            nova_saida[nome + sufixos[0] if nome in sobrepostas else nome] = expr
+        for coluna in colunas_dir:
+            nova_saida[coluna + sufixos[1] if coluna in sobrepostas else coluna] = f"{alias}.[{coluna}]"
+        saida = nova_saida
+
+    lista = ", ".join(f"{expr} AS [{nome}]" for nome, expr in saida.items())
+    return f"SELECT {lista} FROM [{CATALOGO_COLUNAS['g']['tabela']}] g " + " ".join(juncoes)
+
+
+def planejar_queries(_conn, pushdown=None):
+    """
+    Retorna (queries, juncoes_no_servidor). Com pushdown (`pushdown_joins` em [motor_cqr])
+    a query 'g' já traz as dimensões juntadas e só tec/cli seguem como tabelas separadas;
+    sem esquema conhecido, recai no plano com junções em pandas.
+    """
+    if pushdown is None:
+        pushdown = config_motor("pushdown_joins", False)
+    pushdown = pushdown and fonte_dados().recursos_servidor
+
+    projecao = projetar_colunas(_conn)
+    queries = {
+        alias: montar_query(spec["tabela"], projecao[alias])
+        for alias, spec in CATALOGO_COLUNAS.items()
+    }
+    sql_pushdown = montar_query_pushdown(projecao) if pushdown else None
+    if not sql_pushdown:
+        return queries, False
+
+    queries = {alias: sql for alias, sql in queries.items() if alias not in ('p', 'tp', 'neg', 'st')}
+    queries['g'] = sql_pushdown
+    return queries, True
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PIPELINE DO UNIVERSO (ETAPAS REUTILIZÁVEIS)
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# Chave natural de uma linha do universo (usada na deduplicação final)
+CHAVE_UNIVERSO = ['Mes', 'Ano', 'ConsultGest', 'ProjGest', 'IdGest2']
+
+COLUNAS_NUMERICAS_APP = ['Hrs_Real', 'Hrs_Prev', 'Receita', 'Custo', 'Margem_Fracao',
+                         'VH_Venda', 'VH_Custo', 'Receita_Orc', 'Custo_Orc', 'Vl_Faturado_Contrato']
+COLUNAS_STRING_APP = ['Consultor', 'Cliente', 'Projeto', 'TipoProj']
+# Colunas de dimensão guardadas como categóricas: dicionário ordenado + códigos inteiros
+COLUNAS_CATEGORICAS = COLUNAS_STRING_APP + ['Status_Horas']
+
+
+def preparar_fato(df_fato):
+    """Descarta linhas da tabela fato sem chave/período e fixa Ano e Mes como inteiros."""
+    df_fato = aplicar_esquema(df_fato, 'g')
+    df_fato = df_fato.dropna(subset=['Ano', 'Mes', 'ConsultGest', 'ProjGest'])
+    df_fato['Ano'] = df_fato['Ano'].astype(int)
+    df_fato['Mes'] = df_fato['Mes'].astype(int)
+    return df_fato
+
+
+# O vetor denso de posições só é usado quando o maior ID não passa deste múltiplo do número de
+# linhas da dimensão; IDs esparsos usam busca binária (searchsorted) nos IDs ordenados
+FATOR_ID_DENSO = 4
+
+
+class DimensaoIndexada:
+    """
+    Dimensão carregada em arrays e indexada pela chave substituta inteira (AutNumTec,
+    AutNumProj, ...): `posicoes[id]` guarda a linha da dimensão, então anexar atributos a
+    uma tabela é um `take` vetorizado em vez de um hash join que copia a tabela inteira.
+    IDs esparsos (maior ID acima de `FATOR_ID_DENSO` x linhas) usam searchsorted nos IDs
+    ordenados; chaves não inteiras, um índice hash. Com IDs repetidos vale a primeira linha (a
+    mesma que sobrevive à deduplicação do merge).
+    """
+
+    def __init__(self, df, chave):
+        self.df = df.reset_index(drop=True)
+        self.chave = chave
+        self._posicoes = None
+        self._ids_ordenados = None
+        self._indice = None
+
+        ids = pd.to_numeric(self.df[chave], errors='coerce').to_numpy(dtype=float)
+        inteiros = np.isfinite(ids) & (ids == np.floor(ids))
+        if inteiros.all():
+            unicos, primeiras = np.unique(ids.astype(np.int64), return_index=True)
+            if len(unicos) == 0 or (unicos[0] >= 0 and unicos[-1] <= FATOR_ID_DENSO * len(ids)):
+                self._posicoes = np.full(int(unicos[-1]) + 1 if len(unicos) else 0, -1, dtype=np.int64)
+                self._posicoes[unicos] = primeiras
+            else:
+                self._ids_ordenados, self._linhas = unicos, primeiras
+        else:
+            self._indice = pd.Index(self.df[chave].drop_duplicates())
+            self._linhas = self.df.index[~self.df[chave].duplicated()].to_numpy()
+
+    @property
+    def empty(self):
+        return self.df.empty
+
+    def posicoes(self, chaves):
+        """Linha da dimensão para cada chave (-1 quando não há correspondência)."""
+        if self._indice is not None:
+            achados = self._indice.get_indexer(pd.Index(chaves))
+            return np.where(achados >= 0, self._linhas[achados], -1)
+        ids = pd.to_numeric(pd.Series(chaves), errors='coerce').to_numpy(dtype=float)
+        posicoes = np.full(len(ids), -1, dtype=np.int64)
+        if self._posicoes is not None:
+            validos = np.isfinite(ids) & (ids >= 0) & (ids < len(self._posicoes)) & (ids == np.floor(ids))
+            posicoes[validos] = self._posicoes[ids[validos].astype(np.int64)]
+            return posicoes
+
+        validos = np.isfinite(ids) & (ids == np.floor(ids))
+        procurados = ids[validos].astype(np.int64)
+        i = np.minimum(np.searchsorted(self._ids_ordenados, procurados), len(self._ids_ordenados) - 1)
+        posicoes[validos] = np.where(self._ids_ordenados[i] == procurados, self._linhas[i], -1)
+        return posicoes
+
+    def buscar(self, chaves, coluna):
+        """Série com `coluna` da dimensão para cada chave (NaN onde não há correspondência)."""
+        posicoes = self.posicoes(chaves)
+        indice = chaves.index if isinstance(chaves, pd.Series) else pd.RangeIndex(len(posicoes))
+        if self.df.empty:
+            return pd.Series(np.nan, index=indice, dtype=object)
+        return self.df[coluna].iloc[np.maximum(posicoes, 0)].where(posicoes >= 0).set_axis(indice)
+
+    def anexar(self, df, chave_esq, sufixos=('_x', '_y'), colunas=None):
+        """
+        Equivale a `pd.merge(df, dimensão[colunas], left_on=chave_esq, right_on=chave, how='left',
+        suffixes=sufixos)` quando os IDs da dimensão são únicos: mesmas colunas e ordem das linhas.
+        """
+        df = df.reset_index(drop=True)
+        if self.df.empty:
+            return df
+        posicoes = self.posicoes(df[chave_esq])
+        achados = posicoes >= 0
+        origem = self.df if colunas is None else self.df[colunas]
+        extra = origem.iloc[np.maximum(posicoes, 0)].reset_index(drop=True)
+        if not achados.all():
+            extra = extra.where(np.broadcast_to(achados[:, None], extra.shape))
+
+        sobrepostas = set(df.columns) & set(extra.columns)
+        df = df.rename(columns={c: c + sufixos[0] for c in sobrepostas})
+        extra = extra.rename(columns={c: c + sufixos[1] for c in sobrepostas})
+        return pd.concat([df, extra], axis=1)
+
+
+def indexar_dimensoes(dimensoes):
+    """Monta {alias: DimensaoIndexada} pela chave de junção de cada dimensão."""
+    return {
+        alias: DimensaoIndexada(dimensoes[alias], chave_dir)
+        for alias, _, chave_dir, _ in JUNCOES_DIMENSOES
+        if alias in dimensoes and chave_dir in dimensoes[alias].columns
+    }
+
+
+def colunas_anexadas(colunas_dimensao, chave_dir):
+    """
+    Colunas que uma dimensão acrescenta ao universo: todas menos a própria chave, que só
+    repetiria a chave da fato. Vale para as junções em pandas e no servidor.
+    """
+    return [c for c in colunas_dimensao if c != chave_dir]
+
+
+def entrelacar_dimensoes(df, dfs, relatorio=None):
+    """
+    Aplica as junções LEFT com tec, proj, cli, tipoproj, neg e StatusProj. `dfs` pode trazer
+    DataFrames ou DimensaoIndexada (montadas uma vez por universo com `indexar_dimensoes`).
+    Antes de juntar, deduplica a fato pela `CHAVE_UNIVERSO`; cada dimensão leva só as colunas
+    de `colunas_anexadas` e é pulada quando não acrescenta nenhuma. A ordem é a declarada em
+    `JUNCOES_DIMENSOES` (as chaves de cli/tp/neg/st podem vir de tb_Proj). Se `relatorio`
+    (lista) for informado, recebe as linhas/colunas após cada etapa.
+    """
+    def registrar(etapa):
+        if relatorio is not None:
+            relatorio.append({'Etapa': etapa, 'Linhas': len(df), 'Colunas': len(df.columns)})
+
+    registrar('fato')
+    if set(CHAVE_UNIVERSO) <= set(df.columns):
+        df = df.drop_duplicates(subset=CHAVE_UNIVERSO)
+        registrar('fato deduplicada')
+
+    for alias, chave_esq, chave_dir, sufixos in JUNCOES_DIMENSOES:
+        dimensao = dfs.get(alias)
+        if dimensao is None or dimensao.empty:
+            continue
+        if not isinstance(dimensao, DimensaoIndexada):
+            dimensao = DimensaoIndexada(dimensao, chave_dir)
+        colunas = colunas_anexadas(dimensao.df.columns, chave_dir)
+        if not colunas:
+            continue
+        df = dimensao.anexar(df, chave_esq, sufixos, colunas)
+        registrar(f"+ {alias}")
+    return df
+
+
+def mapear_metricas(df):
+    """Renomeia as colunas do banco, calcula as métricas contábeis, a Data e o Periodo; ordena por Periodo."""
+    if 'TipoProj' in df.columns and 'DescTipo' in df.columns:
+        df = df.rename(columns={'TipoProj': 'TipoProj_ID'})
+
+    cols_existentes = {k: v for k, v in MAPA_COLUNAS.items() if k in df.columns}
+    df = df.rename(columns=cols_existentes)
+
+    for col in COLUNAS_NUMERICAS_APP:
+        if col in df.columns:
+            df[col] = df[col].fillna(0)
+        else:
+            df[col] = 0
+
+    df['Margem'] = np.where(df['Receita'] > 0, (df['Receita'] - df['Custo']) / df['Receita'], 0)
+    df['Lucro'] = df['Receita'] - df['Custo']
+    df['Desvio_Hrs'] = df['Hrs_Real'] - df['Hrs_Prev']
+    df['Eficiencia'] = np.where(df['Hrs_Prev'] > 0, (df['Hrs_Real'] / df['Hrs_Prev']), 1)
+    df['ROI_Hora'] = np.where(df['Hrs_Real'] > 0, df['Lucro'] / df['Hrs_Real'], 0)
+    df['Produtividade'] = np.where(df['Hrs_Real'] > 0, df['Receita'] / df['Hrs_Real'], 0)
+
+    df['Periodo'] = periodo(df['Ano'], df['Mes'])
+    df['Data'] = pd.to_datetime(pd.DataFrame({'year': df['Ano'], 'month': df['Mes'], 'day': 1}), errors='coerce')
+    df = df.dropna(subset=['Data'])
+    return ordenar_por_periodo(df)
+
+
+def periodo(ano, mes):
+    """Chave inteira do período (Ano*12+Mes): meses consecutivos têm chaves consecutivas."""
+    return ano * 12 + mes
+
+
+def ordenar_por_periodo(df):
+    """Ordena (de forma estável) pela chave `Periodo`, layout exigido por `IndicePeriodos`."""
+    if 'Periodo' not in df.columns:
+        return df
+    return df.sort_values('Periodo', kind='stable', ignore_index=True)
+
+
+class IndicePeriodos:
+    """
+    Deslocamentos das linhas de cada período em um universo ordenado por `Periodo`:
+    mês, intervalo, acumulado do ano e histórico anterior a um mês viram fatias `iloc`,
+    sem varrer a tabela.
+    """
+
+    def __init__(self, df):
+        if 'Periodo' in df.columns and not df['Periodo'].is_monotonic_increasing:
+            raise ValueError("O universo precisa estar ordenado por 'Periodo' (ordenar_por_periodo).")
+        self.df = df
+        valores = df['Periodo'].to_numpy() if 'Periodo' in df.columns else np.array([], dtype=np.int64)
+        self.periodos, inicios = np.unique(valores, return_index=True)
+        self.inicios = np.append(inicios, len(valores))
+        self._posicao = {int(p): i for i, p in enumerate(self.periodos)}
+
+    def _limite(self, chave):
+        """Primeira linha com `Periodo` >= chave."""
+        return int(self.inicios[np.searchsorted(self.periodos, chave)])
+
+    def limites_mes(self, ano, mes):
+        """Intervalo de linhas [início, fim) do mês; vazio quando o mês não existe."""
+        i = self._posicao.get(periodo(int(ano), int(mes)))
+        if i is None:
+            return 0, 0
+        return int(self.inicios[i]), int(self.inicios[i + 1])
+
+    def mes(self, ano, mes):
+        inicio, fim = self.limites_mes(ano, mes)
+        return self.df.iloc[inicio:fim]
+
+    def limites(self, inicio, fim):
+        """Intervalo de linhas [início, fim) dos períodos `inicio`..`fim` (chaves de `periodo`, inclusive)."""
+        return self._limite(inicio), self._limite(fim + 1)
+
+    def intervalo(self, inicio, fim):
+        linha_ini, linha_fim = self.limites(inicio, fim)
+        return self.df.iloc[linha_ini:linha_fim]
+
+    def acumulado_ano(self, ano, mes):
+        return self.intervalo(periodo(int(ano), 1), periodo(int(ano), int(mes)))
+
+    def antes_de(self, ano, mes):
+        """Histórico anterior ao mês informado."""
+        return self.df.iloc[:self._limite(periodo(int(ano), int(mes)))]
+
+    def anos(self):
+        """Anos presentes, lidos das chaves de período (opções da sidebar)."""
+        return sorted({int((p - 1) // 12) for p in self.periodos})
+
+    def meses(self):
+        return sorted({int((p - 1) % 12 + 1) for p in self.periodos})
+
+
+MODOS_PERIODO = ['Mês', 'Trimestre', 'Acumulado do Ano', 'Últimos 12 Meses', 'Intervalo']
+
+
+def ano_mes(chave):
+    """Inverso de `periodo`: (ano, mês) da chave inteira."""
+    chave = int(chave)
+    return (chave - 1) // 12, (chave - 1) % 12 + 1
+
+
+def rotulo_periodo(chave):
+    ano, mes = ano_mes(chave)
+    return f"{mes:02d}/{ano}"
+
+
+def rotulo_intervalo(inicio, fim):
+    """'MM/AAAA' para um mês, 'MM/AAAA a MM/AAAA' para um intervalo."""
+    if inicio == fim:
+        return rotulo_periodo(fim)
+    return f"{rotulo_periodo(inicio)} a {rotulo_periodo(fim)}"
+
+
+def intervalo_periodos(modo, ano, mes, inicio=None):
+    """
+    Chaves (início, fim) inclusivas do período da sidebar, ancorado no mês (ano, mes).
+    Em 'Intervalo', `inicio` é a chave do outro extremo (a ordem dos extremos não importa).
+    """
+    ano, mes = int(ano), int(mes)
+    fim = periodo(ano, mes)
+    if modo == 'Trimestre':
+        primeiro = periodo(ano, (mes - 1) // 3 * 3 + 1)
+        return primeiro, primeiro + 2
+    if modo == 'Acumulado do Ano':
+        return periodo(ano, 1), fim
+    if modo == 'Últimos 12 Meses':
+        return fim - 11, fim
+    if modo == 'Intervalo' and inicio is not None:
+        return min(int(inicio), fim), max(int(inicio), fim)
+    return fim, fim
+
+
+def intervalo_dos_filtros(filtros):
+    """
+    Chaves (início, fim) do período dos filtros: `periodo_inicio`/`periodo_fim` quando
+    presentes, senão o mês (`mes`, `ano`); None sem período. Valores inválidos levantam
+    ValueError/TypeError.
+    """
+    if filtros.get('periodo_inicio') and filtros.get('periodo_fim'):
+        return int(filtros['periodo_inicio']), int(filtros['periodo_fim'])
+    if filtros.get('mes') and filtros.get('ano'):
+        chave = periodo(int(filtros['ano']), int(filtros['mes']))
+        return chave, chave
+    return None
+
+
+class SomasAcumuladas:
+    """
+    Somas acumuladas (prefix sums) de colunas numéricas por chave de período: o total de
+    qualquer intervalo de meses sai de duas linhas, `acumulado[fim] - acumulado[início - 1]`,
+    com o mesmo custo de um único mês.
+    """
+
+    def __init__(self, periodos, valores):
+        self.colunas = list(valores.columns)
+        periodos = np.asarray(periodos, dtype=np.int64)
+        if len(periodos) == 0:
+            self.primeiro = 0
+            self._acumulado = np.zeros((1, len(self.colunas)))
+            return
+        self.primeiro = int(periodos.min())
+        posicoes = periodos - self.primeiro
+        n = int(posicoes.max()) + 1
+        matriz = valores.to_numpy(dtype=np.float64, na_value=0.0)
+        densas = np.column_stack([
+            np.bincount(posicoes, weights=matriz[:, j], minlength=n) for j in range(len(self.colunas))
+        ]) if self.colunas else np.zeros((n, 0))
+        self._acumulado = np.vstack([np.zeros((1, len(self.colunas))), np.cumsum(densas, axis=0)])
+
+    def soma(self, inicio, fim):
+        """{coluna: total} dos períodos `inicio`..`fim` (inclusive); zero fora da faixa com dados."""
+        n = len(self._acumulado) - 1
+        ini = min(max(int(inicio) - self.primeiro, 0), n)
+        fim = min(max(int(fim) - self.primeiro + 1, 0), n)
+        totais = self._acumulado[fim] - self._acumulado[ini] if fim > ini else np.zeros(len(self.colunas))
+        return dict(zip(self.colunas, totais.tolist()))
+
+
+# Métricas contábeis somadas e médias (soma e contagem de valores válidos, como o `mean` do pandas)
+COLUNAS_SOMADAS = ['Receita', 'Custo', 'Lucro', 'Hrs_Real', 'Hrs_Prev']
+COLUNAS_MEDIAS = ['Eficiencia', 'ROI_Hora', 'Score_Performance']
+
+
+def valores_acumulaveis(df, somadas=COLUNAS_SOMADAS, medias=COLUNAS_MEDIAS):
+    """Colunas das métricas na forma somável: as médias viram soma + contagem (`<coluna>_N`)."""
+    valores = df.reindex(columns=list(somadas) + list(medias))
+    for coluna in medias:
+        valores[f'{coluna}_N'] = valores[coluna].notna().astype(np.int64)
+    return valores
+
+
+def somas_contabeis(df):
+    """Somas acumuladas por período das métricas contábeis do universo."""
+    if 'Periodo' not in df.columns:
+        return SomasAcumuladas([], valores_acumulaveis(df))
+    return SomasAcumuladas(df['Periodo'].to_numpy(), valores_acumulaveis(df))
+
+
+def metricas_contabeis(totais):
+    """Receita, custo, margem, horas e médias a partir dos totais de um período ou seleção."""
+    def media(coluna):
+        n = totais.get(f'{coluna}_N', 0)
+        return totais[coluna] / n if n else 0
+
+    receita = totais['Receita']
+    return {
+        'receita': receita,
+        'custo': totais['Custo'],
+        'lucro': totais['Lucro'],
+        'margem': (totais['Lucro'] / receita) if receita > 0 else 0,
+        'hrs_real': totais['Hrs_Real'],
+        'hrs_prev': totais['Hrs_Prev'],
+        'eficiencia': media('Eficiencia'),
+        'roi_hora': media('ROI_Hora'),
+        'score': media('Score_Performance'),
+    }
+
+
+COLUNAS_HISTORICAS = ['Receita', 'Custo', 'Hrs_Real', 'Hrs_Prev']
+
+
+def mensal_contabil(df):
+    """Totais contábeis por chave de período (só os meses com linhas no universo)."""
+    if df.empty or 'Periodo' not in df.columns:
+        return pd.DataFrame(columns=COLUNAS_HISTORICAS)
+    return df.groupby('Periodo')[COLUNAS_HISTORICAS].sum()
+
+
+class SeriesHistoricas:
+    """
+    Séries mensais das medidas da assinatura histórica (receita, lucro, margem, lucro de
+    caixa, ROI/hora e eficiência de cada mês) com somas e contagens acumuladas: a
+    assinatura de qualquer mês — médias mensais de todo o histórico anterior — é lida em
+    tempo constante, sem refiltrar nem reagrupar o universo.
+
+    `lacunas='zero'` reproduz o agrupamento mensal contínuo (`pd.Grouper(freq='MS')`): cada
+    série conta do primeiro mês com dados até o último antes do mês consultado, e os meses
+    sem dados entram com zero. `lacunas='ignorar'` conta só os meses com linhas contábeis.
+    """
+
+    MEDIDAS = ['Receita', 'Lucro', 'Margem', 'Lucro_Caixa', 'ROI_Hora', 'Eficiencia']
+
+    def __init__(self, contabil, recebido, pago, lacunas='zero'):
+        self.lacunas = lacunas
+        chaves = np.concatenate([np.asarray(s.index, dtype=np.int64) for s in (contabil, recebido, pago)])
+        if len(contabil) == 0 or len(chaves) == 0:
+            self.primeiro, self._n = 0, 0
+            return
+        self.primeiro = int(chaves.min())
+        self._n = int(chaves.max()) - self.primeiro + 1
+
+        def densa(serie):
+            valores = np.zeros(self._n)
+            valores[np.asarray(serie.index, dtype=np.int64) - self.primeiro] = serie.to_numpy(dtype=np.float64, na_value=0.0)
+            return valores
+
+        def presenca(serie):
+            marcados = np.zeros(self._n, dtype=bool)
+            marcados[np.asarray(serie.index, dtype=np.int64) - self.primeiro] = True
+            return marcados
+
+        receita, custo = densa(contabil['Receita']), densa(contabil['Custo'])
+        hrs_real, hrs_prev = densa(contabil['Hrs_Real']), densa(contabil['Hrs_Prev'])
+        lucro = receita - custo
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mensal = np.column_stack([
+                receita,
+                lucro,
+                np.where(receita > 0, lucro / receita, 0),
+                densa(recebido) - densa(pago),
+                np.where(hrs_real > 0, lucro / hrs_real, 0),
+                np.where(hrs_prev > 0, hrs_real / hrs_prev, 1),
+            ])
+
+        self._presencas = [presenca(contabil), presenca(recebido), presenca(pago)]
+        if lacunas == 'ignorar':
+            mensal = mensal * self._presencas[0][:, None]
+            self._contagem = np.concatenate([[0], np.cumsum(self._presencas[0])])
+        else:
+            # Para cada série: primeiro mês com dados e último mês com dados antes de cada posição
+            self._primeiros = [int(np.argmax(p)) if p.any() else -1 for p in self._presencas]
+            self._ultimos = [
+                np.concatenate([[-1], np.maximum.accumulate(np.where(p, np.arange(self._n), -1))])
+                for p in self._presencas
+            ]
+        self._acumulado = np.vstack([np.zeros((1, len(self.MEDIDAS))), np.cumsum(mensal, axis=0)])
+
+    def _meses_contados(self, k):
+        """Intervalos [início, fim) de posições que entram na média antes da posição `k` (lacunas='zero')."""
+        intervalos = sorted(
+            (primeiro, int(ultimos[k]) + 1)
+            for primeiro, ultimos in zip(self._primeiros, self._ultimos) if ultimos[k] >= 0
+        )
+        unidos = []
+        for inicio, fim in intervalos:
+            if unidos and inicio <= unidos[-1][1]:
+                unidos[-1] = (unidos[-1][0], max(unidos[-1][1], fim))
+            else:
+                unidos.append((inicio, fim))
+        return unidos
+
+    def assinatura(self, chave):
+        """Médias mensais do histórico anterior ao período `chave`; {} sem histórico contábil."""
+        if self._n == 0:
+            return {}
+        k = min(max(int(chave) - self.primeiro, 0), self._n)
+        if self.lacunas == 'ignorar':
+            if self._contagem[k] == 0:
+                return {}
+            totais, meses = self._acumulado[k], int(self._contagem[k])
+        else:
+            if self._ultimos[0][k] < 0:
+                return {}
+            intervalos = self._meses_contados(k)
+            totais = sum(self._acumulado[fim] - self._acumulado[inicio] for inicio, fim in intervalos)
+            meses = sum(fim - inicio for inicio, fim in intervalos)
+        medias = dict(zip(self.MEDIDAS, (totais / meses).tolist()))
+        return {
+            'receita_avg': medias['Receita'],
+            'lucro_avg': medias['Lucro'],
+            'margem_avg': medias['Margem'],
+            'lucro_caixa_avg': medias['Lucro_Caixa'],
+            'roi_hora_avg': medias['ROI_Hora'],
+            'eficiencia_avg': medias['Eficiencia'],
+            'count_months': meses
+        }
+
+
+def criar_dimensoes_quanticas(df):
+    """Calcula riscos de sangria/ociosidade, Status_Horas, score e normaliza as colunas texto."""
+    df = df.reset_index(drop=True)
+
+    df['Sangria_Risco_Absoluto'] = np.where(
+        df['Hrs_Real'] > df['Hrs_Prev'],
+        (df['Hrs_Real'] - df['Hrs_Prev']) * df['VH_Custo'], 0
+    )
+    df['Ociosidade_Risco_Absoluto'] = np.where(
+        df['Hrs_Real'] < df['Hrs_Prev'],
+        (df['Hrs_Prev'] - df['Hrs_Real']) * (df['VH_Venda'] - df['VH_Custo']), 0
+    )
+
+    conditions = [
+        (df['Hrs_Real'] > df['Hrs_Prev']) & (df['TipoProj'] == 'PROJETO FECHADO'),
+        (df['Hrs_Real'] > df['Hrs_Prev']) & (df['TipoProj'] == 'FATURADO POR HRS REALIZADAS'),
+        (df['Hrs_Real'] < df['Hrs_Prev']) & (df['Hrs_Prev'] > 0)
+    ]
+    choices = [
+        'SANGRIA',
+        'OVERRUN_FATURAVEL',
+        'OCIOSIDADE'
+    ]
+    df['Status_Horas'] = np.select(conditions, choices, default='OK')
+
+    df['Score_Performance'] = (
+        (df['Margem'] * 0.4) +
+        (np.clip(df['Eficiencia'], 0, 2) / 2 * 0.3) +
+        (np.clip(df['ROI_Hora'] / 100, 0, 1) * 0.3)
+    ) * 100
+
+    df['Status_Performance'] = pd.cut(df['Score_Performance'],
+                         bins=[-np.inf, 40, 70, np.inf],
+                         labels=['CRÍTICO', 'ATENÇÃO', 'EXCELENTE'],
+                         right=False)
+
+    for col_str in COLUNAS_STRING_APP:
+        if col_str not in df.columns:
+            df[col_str] = 'N/A'
+    return codificar_categorias(df)
+
+
+def codificar_categorias(df):
+    """
+    Converte as colunas de `COLUNAS_CATEGORICAS` em categóricas. Cada coluna guarda um
+    dicionário ordenado de valores e códigos inteiros por linha; as visões filtradas do
+    universo compartilham o mesmo dicionário.
+    """
+    for col in COLUNAS_CATEGORICAS:
+        if col not in df.columns:
+            continue
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.remove_unused_categories()
+        else:
+            # Preenche valores nulos (NaN) ANTES de converter para string, evitando a string 'nan'.
+            df[col] = df[col].fillna('N/A').astype(str).astype('category')
+    return df
+
+
+def mascara_valores(serie, valores):
+    """Máscara booleana de `serie.isin(valores)`; em categóricas compara só os códigos inteiros."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        codigos = serie.cat.categories.get_indexer(list(valores))
+        return np.isin(serie.cat.codes.to_numpy(), codigos[codigos >= 0])
+    return serie.isin(valores).to_numpy()
+
+
+# Filtros da sidebar -> coluna categórica do universo
+FILTROS_DIMENSOES = {'consultores': 'Consultor', 'clientes': 'Cliente', 'projetos': 'Projeto', 'tipos': 'TipoProj'}
+
+
+class IndiceFiltros:
+    """
+    Índice invertido das colunas de filtro: para cada valor (código da categórica), as linhas
+    do universo em que ele aparece, já ordenadas. Uma combinação de filtros vira a interseção
+    dessas listas, recortada pelo intervalo de linhas do período; só a seleção final é
+    materializada (ou devolvida como fatia, sem cópia, quando não há filtro de dimensão).
+    """
+
+    # Quantas listas de opções em cascata ficam memorizadas por universo
+    LIMITE_OPCOES = 256
+
+    def __init__(self, df, colunas=tuple(FILTROS_DIMENSOES.values())):
+        self.df = df
+        self.colunas = [c for c in colunas if c in df.columns]
+        self._listas = {}
+        self._opcoes = OrderedDict()
+        self._trava = threading.Lock()
+        for col in colunas:
+            if col not in df.columns or not isinstance(df[col].dtype, pd.CategoricalDtype):
+                continue
+            codigos = df[col].cat.codes.to_numpy()
+            ordem = np.argsort(codigos, kind='stable')
+            # Códigos -1 (nulos) ficam no começo da ordem e nunca são selecionados
+            contagem = np.bincount(codigos[codigos >= 0], minlength=len(df[col].cat.categories))
+            inicios = np.concatenate([[0], np.cumsum(contagem)]) + int((codigos < 0).sum())
+            self._listas[col] = (df[col].cat.categories, ordem, inicios)
+
+    def linhas(self, coluna, valores):
+        """Linhas (ordenadas) em que `coluna` assume algum dos `valores`."""
+        if coluna not in self._listas:
+            return np.flatnonzero(mascara_valores(self.df[coluna], valores))
+        categorias, ordem, inicios = self._listas[coluna]
+        codigos = categorias.get_indexer(list(valores))
+        partes = [ordem[inicios[c]:inicios[c + 1]] for c in np.unique(codigos[codigos >= 0])]
+        if not partes:
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate(partes))
+
+    def selecionar(self, selecao, intervalo=None):
+        """
+        Resolve {coluna: valores} dentro de `intervalo` = (início, fim) de linhas.
+        Retorna as linhas selecionadas, ou None quando não há filtro de dimensão.
+        """
+        resultado = None
+        for coluna, valores in selecao.items():
+            ids = self.linhas(coluna, valores)
+            if intervalo is not None:
+                ids = ids[np.searchsorted(ids, intervalo[0]):np.searchsorted(ids, intervalo[1])]
+            resultado = ids if resultado is None else np.intersect1d(resultado, ids, assume_unique=True)
+        return resultado
+
+    def filtrar(self, selecao, intervalo=None):
+        """DataFrame da seleção: fatia do período sem cópia, ou um único `take` das linhas."""
+        ids = self.selecionar(selecao, intervalo)
+        if ids is None:
+            return self.df if intervalo is None else self.df.iloc[intervalo[0]:intervalo[1]]
+        return self.df.iloc[ids]
+
+    def opcoes(self, coluna, selecao, intervalo=None):
+        """
+        Valores de `coluna` que existem sob as seleções das demais colunas e no intervalo do
+        período (filtros em cascata), lidos das listas por valor. Memorizado por seleção.
+        """
+        outras = {c: v for c, v in selecao.items() if c != coluna}
+        chave = (coluna, tuple(sorted((c, tuple(sorted(map(str, v)))) for c, v in outras.items())), intervalo)
+        with self._trava:
+            if chave in self._opcoes:
+                self._opcoes.move_to_end(chave)
+                return self._opcoes[chave]
+
+        ids = self.selecionar(outras, intervalo)
+        if ids is None:
+            ids = slice(*intervalo) if intervalo is not None else slice(None)
+        if coluna in self._listas:
+            codigos = self.df[coluna].cat.codes.to_numpy()[ids]
+            valores = self._listas[coluna][0][np.unique(codigos[codigos >= 0])].tolist()
+        else:
+            valores = opcoes_filtro(self.df[coluna].iloc[ids])
+
+        with self._trava:
+            self._opcoes[chave] = valores
+            while len(self._opcoes) > self.LIMITE_OPCOES:
+                self._opcoes.popitem(last=False)
+        return valores
+
+    def opcoes_cascata(self, selecao, intervalo=None):
+        """
+        {coluna: opções} de todas as colunas de filtro para a seleção atual; os valores já
+        marcados continuam entre as opções mesmo que a cascata os exclua.
+        """
+        return {
+            coluna: sorted(set(self.opcoes(coluna, selecao, intervalo)) | set(selecao.get(coluna, [])))
+            for coluna in self.colunas
+        }
+
+
+def opcoes_filtro(serie):
+    """Valores distintos ordenados para os filtros da sidebar (lidos do dicionário nas categóricas)."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return sorted(serie.cat.categories.tolist())
+    return sorted(serie.unique().tolist())
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CUBO OLAP: MEDIDAS ADITIVAS POR (PERÍODO, CONSULTOR, CLIENTE, PROJETO, TIPO)
+# ═══════════════════════════════════════════════════════════════════════════════
+
+DIMENSOES_CUBO = ['Periodo'] + list(FILTROS_DIMENSOES.values())
+MEDIDAS_SOMADAS_CUBO = COLUNAS_SOMADAS + ['Sangria_Risco_Absoluto', 'Ociosidade_Risco_Absoluto']
+MEDIDAS_MEDIAS_CUBO = ['Margem'] + COLUNAS_MEDIAS
+
+
+class CuboOLAP:
+    """
+    Universo pré-agregado no grão (período, consultor, cliente, projeto, tipo) com medidas
+    aditivas: somas, contagem de linhas e, para as médias, soma + contagem de valores válidos.
+    Fatias usam os mesmos índices de período e de filtros do universo; KPIs e rollups saem
+    das células, sem reagrupar as linhas. `verificar` confere o cubo contra as linhas.
+    """
+
+    def __init__(self, df):
+        dimensoes = [c for c in DIMENSOES_CUBO if c in df.columns]
+        valores = valores_acumulaveis(df, MEDIDAS_SOMADAS_CUBO, MEDIDAS_MEDIAS_CUBO)
+        valores['Linhas'] = 1
+        if dimensoes == DIMENSOES_CUBO and not df.empty:
+            celulas = pd.concat([df[dimensoes], valores], axis=1).groupby(
+                dimensoes, observed=True, sort=False
+            ).sum().reset_index()
+        else:
+            celulas = pd.concat([df.reindex(columns=DIMENSOES_CUBO), valores], axis=1).iloc[:0]
+        self.celulas = ordenar_por_periodo(celulas)
+        self.indice_periodos = IndicePeriodos(self.celulas)
+        self.indice_filtros = IndiceFiltros(self.celulas)
+
+    def __len__(self):
+        return len(self.celulas)
+
+    def fatia(self, selecao, periodos=None):
+        """Células de {coluna: valores} nos períodos (início, fim) inclusivos; None = todo o universo."""
+        intervalo = self.indice_periodos.limites(*periodos) if periodos is not None else None
+        return self.indice_filtros.filtrar(selecao, intervalo)
+
+    @staticmethod
+    def totais(celulas):
+        """Totais de uma fatia, no formato de `SomasAcumuladas.soma` (entrada de `metricas_contabeis`)."""
+        return celulas.drop(columns=DIMENSOES_CUBO).sum().to_dict()
+
+    @staticmethod
+    def distintos(celulas, coluna):
+        return celulas[coluna].nunique()
+
+    @staticmethod
+    def agregar(celulas, por, **saidas):
+        """
+        Rollup de uma fatia por `por`, com a sintaxe de agregação nomeada do pandas:
+        `saida=(medida, 'sum' | 'mean' | 'count')`. Mesmo índice e ordem de
+        `linhas.groupby(por, observed=True).agg(...)`.
+        """
+        grupos = celulas.groupby(por, observed=True).sum(numeric_only=True)
+        resultado = pd.DataFrame(index=grupos.index)
+        for nome, (coluna, funcao) in saidas.items():
+            if funcao == 'sum':
+                resultado[nome] = grupos[coluna]
+            elif funcao == 'mean':
+                resultado[nome] = grupos[coluna] / grupos[f'{coluna}_N'].where(grupos[f'{coluna}_N'] > 0)
+            elif funcao == 'count':
+                resultado[nome] = grupos[f'{coluna}_N'] if f'{coluna}_N' in grupos else grupos['Linhas']
+            else:
+                raise ValueError(f"Agregação não suportada pelo cubo: {funcao}")
+        return resultado
+
+    def verificar(self, linhas, celulas, tolerancia=1e-9):
+        """
+        Compara a fatia do cubo com o caminho linha a linha (`linhas` = mesma seleção do
+        universo): totais, médias, distintos e rollups por dimensão. Devolve as divergências
+        encontradas (lista vazia quando o cubo responde igual às linhas).
+        """
+        divergencias = []
+
+        def comparar(nome, obtido, esperado):
+            obtido = np.asarray(obtido, dtype=np.float64)
+            esperado = np.asarray(esperado, dtype=np.float64)
+            if obtido.shape != esperado.shape or not np.allclose(obtido, esperado, rtol=tolerancia, atol=1e-6, equal_nan=True):
+                divergencias.append(nome)
+
+        totais = self.totais(celulas)
+        comparar('Linhas', totais['Linhas'], len(linhas))
+        for coluna in MEDIDAS_SOMADAS_CUBO:
+            comparar(coluna, totais[coluna], linhas[coluna].sum())
+        for coluna in MEDIDAS_MEDIAS_CUBO:
+            media = totais[coluna] / totais[f'{coluna}_N'] if totais[f'{coluna}_N'] else np.nan
+            comparar(f'média {coluna}', media, linhas[coluna].mean())
+        for coluna in FILTROS_DIMENSOES.values():
+            comparar(f'distintos {coluna}', self.distintos(celulas, coluna), linhas[coluna].nunique())
+            saidas = {'Receita': ('Receita', 'sum'), 'Hrs_Real': ('Hrs_Real', 'sum'), 'Margem': ('Margem', 'mean')}
+            cubo = self.agregar(celulas, coluna, **saidas)
+            esperado = linhas.groupby(coluna, observed=True).agg(**saidas)
+            if not cubo.index.equals(esperado.index):
+                divergencias.append(f'grupos por {coluna}')
+                continue
+            comparar(f'rollup por {coluna}', cubo.to_numpy(), esperado.to_numpy())
+        return divergencias
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# FLUXO DE CAIXA: AGREGAÇÃO MENSAL (LOCAL OU NO SQL SERVER)
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# Livros de caixa: coluna de data, chave (cliente/prestador) e valor liquidado
+LIVROS_CAIXA = {
+    'cr': {'data': 'DtRec', 'chave': 'Cliente', 'valor': 'VlRec'},
+    'cp': {'data': 'DtPagamento', 'chave': 'Prestador', 'valor': 'VlPago'},
+}
+
+
+class LivroCaixa:
+    """
+    Livro de caixa (cr/cp) montado uma vez por carga: flag `quitado` booleana, lançamentos
+    ordenados pela chave de período (fatias por deslocamento, como em `IndicePeriodos`),
+    totais liquidados por (período, contraparte) e somas acumuladas por período. Responde
+    "pago/recebido nos períodos P1..P2, por contraparte" sem copiar nem refiltrar o livro.
+    """
+
+    def __init__(self, df, alias):
+        livro = LIVROS_CAIXA[alias]
+        self.alias = alias
+        self.data, self.chave, self.valor = livro['data'], livro['chave'], livro['valor']
+        self.tem_quitado = 'quitado' in df.columns
+        if df.empty or self.data not in df.columns:
+            df = pd.DataFrame({self.data: pd.Series(dtype='datetime64[ns]'), self.chave: pd.Series(dtype=np.float64),
+                               self.valor: pd.Series(dtype=np.float64)})
+
+        # Lançamentos sem data válida não pertencem a nenhum período
+        datas = df[self.data] if pd.api.types.is_datetime64_any_dtype(df[self.data]) else pd.to_datetime(df[self.data], errors='coerce')
+        validos = datas.notna()
+        lancamentos = df[validos].assign(
+            Periodo=periodo(datas[validos].dt.year, datas[validos].dt.month).astype(np.int64),
+            Quitado=(df.loc[validos, 'quitado'] == 'S') if self.tem_quitado else True,
+        )
+        lancamentos[self.valor] = lancamentos[self.valor].fillna(0)
+        self.lancamentos = ordenar_por_periodo(lancamentos)
+        self.indice = IndicePeriodos(self.lancamentos)
+
+        liquidados = self.lancamentos[self.lancamentos['Quitado']]
+        self.por_periodo = liquidados.groupby(['Periodo', self.chave], dropna=False)[self.valor].sum().reset_index()
+        self._indice_contrapartes = IndicePeriodos(self.por_periodo)
+        self._somas = SomasAcumuladas(self.lancamentos['Periodo'].to_numpy(), pd.DataFrame({
+            'Quitado': self.lancamentos[self.valor].where(self.lancamentos['Quitado'], 0),
+            'Todos': self.lancamentos[self.valor],
+        }))
+
+    def total(self, inicio, fim, quitados=True):
+        """Valor dos períodos `inicio`..`fim` (inclusive): só liquidados, ou todos os lançamentos."""
+        return self._somas.soma(inicio, fim)['Quitado' if quitados else 'Todos']
+
+    def por_contraparte(self, inicio, fim):
+        """Valor liquidado por contraparte (cliente/prestador) nos períodos `inicio`..`fim`."""
+        return self._indice_contrapartes.intervalo(inicio, fim).groupby(self.chave, dropna=False)[self.valor].sum()
+
+    def fatia(self, inicio, fim, quitados=True):
+        """Lançamentos dos períodos `inicio`..`fim`: fatia sem cópia (só liquidados, por padrão)."""
+        fatia = self.indice.intervalo(inicio, fim)
+        return fatia[fatia['Quitado']] if quitados else fatia
+
+    def mensal(self, quitados=False):
+        """Valor por chave de período (só os meses com lançamentos)."""
+        coluna = self.lancamentos[self.valor]
+        if quitados:
+            coluna = coluna.where(self.lancamentos['Quitado'], 0)
+        return coluna.groupby(self.lancamentos['Periodo']).sum()
+
+
+def continuo_por_periodo(dados):
+    """Série/DataFrame por chave de período reindexado do primeiro ao último mês, com zero nos meses vazios."""
+    if dados.empty:
+        return dados
+    return dados.reindex(range(int(dados.index.min()), int(dados.index.max()) + 1), fill_value=0)
+
+
+def data_do_periodo(chaves):
+    """Primeiro dia do mês de cada chave de período."""
+    chaves = np.asarray(chaves, dtype=np.int64)
+    return pd.to_datetime(pd.DataFrame({'year': (chaves - 1) // 12, 'month': (chaves - 1) % 12 + 1, 'day': 1}))
+
+
+def filtrar_quitados(df):
+    """Mantém apenas os lançamentos liquidados ('quitado' = 'S'), quando a coluna existe."""
+    if 'quitado' not in df.columns:
+        return df
+    return df[df['quitado'] == 'S']
+
+
+def caixa_somente_quitados():
+    """Só a agregação no servidor (`agregacao_caixa_sql`) restringe o caixa aos lançamentos quitados."""
+    return bool(config_motor("agregacao_caixa_sql", False)) and fonte_dados().recursos_servidor
+
+
+def agregar_caixa(df, alias, somente_quitados=False):
+    """
+    Agrupa um livro de caixa por (Caixa_Ano, Caixa_Mes, chave) somando o valor. Com
+    `somente_quitados` (modo de agregação no servidor) considera só os lançamentos liquidados.
+    """
+    livro = LIVROS_CAIXA[alias]
+    if somente_quitados:
+        df = filtrar_quitados(df)
+    df = df.dropna(subset=[livro['data']]).copy()
+    df['Caixa_Ano'] = df[livro['data']].dt.year
+    df['Caixa_Mes'] = df[livro['data']].dt.month
+    df[livro['valor']] = df[livro['valor']].fillna(0)
+    return df.groupby(['Caixa_Ano', 'Caixa_Mes', livro['chave']])[livro['valor']].sum().reset_index()
+
+
+def montar_query_caixa_agregada(alias, colunas):
+    """
+    Gera o GROUP BY mensal de um livro de caixa para rodar no SQL Server, com as mesmas
+    regras de `agregar_caixa(..., somente_quitados=True)` (só lançamentos quitados,
+    datas/chaves inválidas descartadas).
+    Retorna None quando a projeção é desconhecida ou faltam colunas.
+    """
+    livro = LIVROS_CAIXA[alias]
+    if not colunas or any(livro[campo] not in colunas for campo in ('data', 'chave', 'valor')):
+        return None
+
+    data = f"TRY_CAST([{livro['data']}] AS DATETIME)"
+    chave = f"TRY_CAST([{livro['chave']}] AS FLOAT)"
+    condicoes = [f"{data} IS NOT NULL", f"{chave} IS NOT NULL"]
+    if 'quitado' in colunas:
+        condicoes.append("UPPER(LTRIM(RTRIM([quitado]))) = 'S'")
+    return (
+        f"SELECT YEAR({data}) AS [Caixa_Ano], MONTH({data}) AS [Caixa_Mes], {chave} AS [{livro['chave']}], "
+        f"SUM(ISNULL(TRY_CAST([{livro['valor']}] AS FLOAT), 0)) AS [{livro['valor']}] "
+        f"FROM [{CATALOGO_COLUNAS[alias]['tabela']}] WHERE {' AND '.join(condicoes)} "
+        f"GROUP BY YEAR({data}), MONTH({data}), {chave}"
+    )
+
+
+def planejar_queries_caixa(queries, _conn, agregar=None):
+    """
+    Troca as queries linha a linha de cr/cp por 'cr_agg'/'cp_agg' já agregadas no servidor
+    (`agregacao_caixa_sql` em [motor_cqr]). Livros sem esquema conhecido seguem linha a linha.
+    """
+    if agregar is None:
+        agregar = caixa_somente_quitados()
+    if not agregar or not fonte_dados().recursos_servidor:
+        return queries
+
+    projecao = projetar_colunas(_conn)
+    queries = dict(queries)
+    for alias in LIVROS_CAIXA:
+        sql = montar_query_caixa_agregada(alias, projecao.get(alias))
+        if sql:
+            queries.pop(alias, None)
+            queries[f'{alias}_agg'] = sql
+    return queries
+
+
+def normalizar_caixa_agregado(df, alias):
+    """Ajusta os tipos de um agregado vindo do servidor ao formato produzido por `agregar_caixa`."""
+    livro = LIVROS_CAIXA[alias]
+    df = df.copy()
+    for coluna in ['Caixa_Ano', 'Caixa_Mes', livro['chave'], livro['valor']]:
+        df[coluna] = pd.to_numeric(df[coluna], errors='coerce')
+    df[livro['valor']] = df[livro['valor']].fillna(0)
+    return df
+
+
+def buscar_lancamentos_caixa(alias, ano, mes, _conn, somente_quitados=False):
+    """
+    Busca sob demanda os lançamentos de um livro de caixa em um mês (drill-down), com o
+    mesmo critério de quitação dos totais, guardando o resultado no cache de resultados sob
+    a versão das fontes da última carga.
+    """
+    livro = LIVROS_CAIXA[alias]
+    tabela = CATALOGO_COLUNAS[alias]['tabela']
+    sql = f"{montar_query(tabela)} WHERE {fonte_dados().filtro_mes(livro['data'])}"
+    query = (sql, [int(ano), int(mes)])
+
+    cache = cache_resultados()
+    chave = chave_resultado(f"lancamentos_{alias}", query, cache.versao_fontes)
+    df = cache.obter(chave) if chave else None
+    if df is None:
+        try:
+            df = aplicar_esquema(ler_sql(sql, _conn, params=query[1]), alias)
+        except Exception as e:
+            st.warning(f"⚠️ Falha ao buscar lançamentos de {tabela}: {e}")
+            return pd.DataFrame()
+        if chave:
+            cache.guardar(chave, df)
+    return filtrar_quitados(df) if somente_quitados else df
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ATUALIZAÇÃO INCREMENTAL (MARCA D'ÁGUA POR MÊS DA TABELA FATO)
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# Acima deste número de meses alterados a recarga completa é mais barata (e o SQL Server limita parâmetros)
+LIMITE_MESES_INCREMENTAIS = 500
+
+def query_marca_dagua():
+    """
+    Contagem e checksum por (Ano, Mes) com o `expr_checksum` da fonte. No SQL Server qualquer
+    inserção, exclusão ou edição altera o par; no SQLite (`detecta_edicoes` = False) só
+    inserções e exclusões, e edições de linhas existentes só entram com a recarga completa.
+    """
+    fonte = fonte_dados()
+    return (
+        f"SELECT Ano, Mes, COUNT(*) AS Linhas, {fonte.expr_checksum()} AS Checksum "
+        f"FROM [{CATALOGO_COLUNAS['g']['tabela']}] GROUP BY Ano, Mes"
+    )
+
+
+def chave_periodo(ano, mes):
+    """Normaliza um par (Ano, Mes) do banco (texto ou número) para inteiros."""
+    try:
+        return int(str(ano).strip()), int(str(mes).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def detectar_meses_alterados(marca_antiga, marca_nova):
+    """
+    Compara duas marcas d'água e retorna (alterados, removidos):
+    `alterados` são os pares (Ano, Mes) brutos do banco que precisam ser relidos
+    (novos ou com contagem/checksum diferente); `removidos` são chaves inteiras
+    de meses que deixaram de existir na tabela fato.
+    """
+    def indexar(marca):
+        return {
+            (str(r.Ano).strip(), str(r.Mes).strip()): (r.Ano, r.Mes, r.Linhas, r.Checksum)
+            for r in marca.itertuples(index=False)
+        }
+
+    antiga, nova = indexar(marca_antiga), indexar(marca_nova)
+    alterados = [
+        (ano, mes) for chave, (ano, mes, linhas, checksum) in nova.items()
+        if chave not in antiga or antiga[chave][2:] != (linhas, checksum)
+    ]
+    removidos = [chave_periodo(*chave) for chave in antiga.keys() - nova.keys()]
+    return alterados, [r for r in removidos if r is not None]
+
+
+def filtrar_query_por_meses(query, meses, prefixo=''):
+    """Restringe um SELECT da tabela fato aos meses informados; retorna (sql, params)."""
+    condicoes = " OR ".join(f"({prefixo}[Ano] = ? AND {prefixo}[Mes] = ?)" for _ in meses)
+    params = [valor for par in meses for valor in par]
+    return f"{query} WHERE {condicoes}", params
+
+
+def substituir_meses(universo, novas_linhas, meses):
+    """
+    Remove do universo as linhas dos meses (chaves inteiras) e anexa as linhas recalculadas,
+    mantendo a ordem por `Periodo`.
+    """
+    manter = ~universo['Periodo'].isin([periodo(ano, mes) for ano, mes in meses])
+    partes = [universo[manter]]
+    if not novas_linhas.empty:
+        partes.append(novas_linhas)
+    # Dicionários diferentes viram object no concat: recodifica para um dicionário único
+    return ordenar_por_periodo(codificar_categorias(pd.concat(partes, ignore_index=True)))
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# SNAPSHOT COLUNAR PERSISTENTE (PARTIDA RÁPIDA)
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# Incrementar sempre que o pipeline do universo mudar de forma que invalide snapshots antigos
+VERSAO_PIPELINE = 8
+
+
+def query_versao_fontes():
+    """Monta a sonda de versão: contagem e checksum de cada tabela de origem em uma única ida ao banco."""
+    fonte = fonte_dados()
+    partes = [
+        f"SELECT '{alias}' AS Alias, {fonte.expr_contagem()} AS Linhas, "
+        f"{fonte.expr_checksum()} AS Checksum FROM [{spec['tabela']}]"
+        for alias, spec in CATALOGO_COLUNAS.items()
+    ]
+    return " UNION ALL ".join(partes)
+
+
+def sondar_versao_fontes(_conn):
+    """
+    Executa a sonda de versão das tabelas de origem (sem cache). A última versão vista passa a
+    valer para as consultas avulsas do cache de resultados.
+    """
+    versao = ler_sql(query_versao_fontes(), _conn)
+    cache_resultados().versao_fontes = versao
+    return versao
+
+
+def tabelas_alteradas(versao_antiga, versao_nova):
+    """Compara duas sondas de versão e retorna os aliases cuja contagem ou checksum mudou."""
+    if versao_antiga is None or versao_antiga.empty:
+        return set(versao_nova['Alias'].astype(str))
+
+    def por_alias(versao):
+        return {str(r.Alias): (str(r.Linhas), str(r.Checksum)) for r in versao.itertuples(index=False)}
+
+    antiga, nova = por_alias(versao_antiga), por_alias(versao_nova)
+    return {alias for alias in antiga.keys() | nova.keys() if antiga.get(alias) != nova.get(alias)}
+
+
+def chave_snapshot(nome, queries, versao_fontes):
+    """
+    Gera a chave do snapshot a partir da versão das fontes e do hash do esquema
+    (queries projetadas + versão do pipeline). Qualquer mudança invalida o snapshot.
+    """
+    versao = versao_fontes.sort_values('Alias').astype(str).values.tolist()
+    conteudo = json.dumps(
+        {'nome': nome, 'pipeline': VERSAO_PIPELINE, 'queries': queries, 'versao': versao},
+        sort_keys=True
+    )
+    return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()[:16]
+
+
+def _diretorio_snapshot(nome):
+    return os.path.join(config_motor("diretorio_snapshot", ".cqr_snapshot"), nome)
+
+
+def salvar_snapshot(nome, chave, tabelas, mensagens=None):
+    """
+    Persiste {alias: DataFrame} em Parquet. O manifesto é gravado por último (troca atômica),
+    então um snapshot interrompido nunca é considerado válido. Falhas vão para `mensagens`.
+    """
+    diretorio = _diretorio_snapshot(nome)
+    try:
+        os.makedirs(diretorio, exist_ok=True)
+        arquivos = {}
+        for alias, df in tabelas.items():
+            arquivo = f"{alias}-{chave}.parquet"
+            df.to_parquet(os.path.join(diretorio, arquivo), index=False)
+            arquivos[alias] = arquivo
+
+        manifesto = {'chave': chave, 'criado_em': datetime.now().isoformat(), 'arquivos': arquivos}
+        caminho_tmp = os.path.join(diretorio, 'manifesto.json.tmp')
+        with open(caminho_tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifesto, f)
+        os.replace(caminho_tmp, os.path.join(diretorio, 'manifesto.json'))
+
+        # Remove arquivos de snapshots anteriores
+        for arquivo in os.listdir(diretorio):
+            if arquivo.endswith('.parquet') and arquivo not in arquivos.values():
+                os.remove(os.path.join(diretorio, arquivo))
+        return True
+    except Exception as e:
+        (mensagens or MensagensCarga()).aviso(f"⚠️ Não foi possível gravar o snapshot local: {e}")
+        return False
+
+
+def carregar_snapshot(nome, chave):
+    """Retorna {alias: DataFrame} se existir um snapshot com a chave informada; senão None."""
+    diretorio = _diretorio_snapshot(nome)
+    try:
+        with open(os.path.join(diretorio, 'manifesto.json'), encoding='utf-8') as f:
+            manifesto = json.load(f)
+        if manifesto.get('chave') != chave:
+            return None
+        return {
+            alias: pd.read_parquet(os.path.join(diretorio, arquivo))
+            for alias, arquivo in manifesto['arquivos'].items()
+        }
+    except Exception:
+        return None
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ATUALIZAÇÃO EM SEGUNDO PLANO (STALE-WHILE-REVALIDATE)
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class MensagensCarga:
+    """
+    Destino das mensagens de uma carga do universo. Na thread do script repassa para
+    st.spinner/st.warning/st.error/st.success; `silencioso` (thread de segundo plano, sem
+    ScriptRunContext) não chama st.* e só acumula avisos e erros em `registradas`.
+    """
+
+    def __init__(self, silencioso=False):
+        self.silencioso = silencioso
+        self.registradas = []
+
+    def etapa(self, texto):
+        return nullcontext() if self.silencioso else st.spinner(texto)
+
+    def aviso(self, texto):
+        if self.silencioso:
+            self.registradas.append(texto)
+        else:
+            st.warning(texto)
+
+    def erro(self, texto):
+        if self.silencioso:
+            self.registradas.append(texto)
+        else:
+            st.error(texto)
+
+    def sucesso(self, texto):
+        if not self.silencioso:
+            st.success(texto)
+
+    def resumo(self):
+        return "; ".join(self.registradas)
+
+
+class AtualizadorUniverso:
+    """
+    Guarda a última versão boa do universo e a reconstrói em uma thread de fundo, sob demanda
+    ou por agenda. As sessões continuam servindo a versão anterior até a troca atômica.
+    `construir(mensagens)` gera um universo novo; `atualizar(atual, mensagens)` tenta uma
+    atualização incremental e retorna (universo, status), com o próprio `atual` quando os dados
+    não mudaram, ou None quando é preciso recarregar tudo; `valido(universo)` rejeita cargas com
+    falha. Em segundo plano ambos recebem um MensagensCarga silencioso: nada de st.* fora da
+    thread do script; avisos e erros vão para `ultimo_erro` e o status para `status_atualizacao`.
+    """
+
+    def __init__(self, construir, atualizar=None, valido=None):
+        self.construir = construir
+        self.atualizar = atualizar
+        self.valido = valido or (lambda universo: universo is not None)
+        self._trava = threading.Lock()
+        self._trava_carga = threading.Lock()
+        self._atual = None
+        self._thread = None
+        self.gerado_em = None
+        self.geracao = 0
+        self.ultimo_erro = None
+        self.status_atualizacao = None
+
+    def _trocar(self, universo, status=None):
+        with self._trava:
+            self.status_atualizacao = status
+            if universo is self._atual:
+                # Fontes sem alteração: só renova o horário, sem nova geração para as sessões
+                self.gerado_em = datetime.now()
+                return
+            self._atual = universo
+            self.gerado_em = datetime.now()
+            self.geracao += 1
+
+    def obter(self):
+        """Retorna (universo, geração); a primeira carga do processo é síncrona."""
+        if self._atual is None:
+            with self._trava_carga:
+                if self._atual is None:
+                    universo = self.construir()
+                    if not self.valido(universo):
+                        return universo, self.geracao
+                    self._trocar(universo)
+        with self._trava:
+            return self._atual, self.geracao
+
+    @property
+    def em_andamento(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def idade(self):
+        """Tempo desde a última troca (None antes da primeira carga)."""
+        return datetime.now() - self.gerado_em if self.gerado_em else None
+
+    def solicitar(self, incremental=False):
+        """Dispara a reconstrução em segundo plano; retorna False se já houver uma em curso."""
+        with self._trava:
+            if self.em_andamento:
+                return False
+            self._thread = threading.Thread(
+                target=self._executar, args=(incremental,), name="cqr-atualizador", daemon=True
+            )
+            self._thread.start()
+        return True
+
+    def verificar_agenda(self, intervalo_min):
+        """
+        Dispara a atualização quando o universo atual passou de `intervalo_min` minutos. Com
+        `atualizar` definido, a atualização começa pela sonda das fontes e só relê o que mudou.
+        """
+        idade = self.idade()
+        if intervalo_min and idade is not None and idade.total_seconds() > intervalo_min * 60:
+            self.solicitar(incremental=self.atualizar is not None)
+
+    def _executar(self, incremental):
+        mensagens = MensagensCarga(silencioso=True)
+        try:
+            with self._trava_carga:
+                with self._trava:
+                    atual = self._atual
+                novo, status = None, None
+                if incremental and self.atualizar is not None and atual is not None:
+                    novo, status = self.atualizar(atual, mensagens) or (None, None)
+                if novo is None:
+                    novo = self.construir(mensagens)
+            if not self.valido(novo):
+                detalhe = f": {mensagens.resumo()}" if mensagens.registradas else ""
+                self.ultimo_erro = f"Carga inválida em {datetime.now():%H:%M}{detalhe}; mantida a versão anterior."
+                return
+            self._trocar(novo, status)
+            self.ultimo_erro = f"{mensagens.resumo()} ({datetime.now():%H:%M})" if mensagens.registradas else None
+        except Exception as e:
+            self.ultimo_erro = f"{e} ({datetime.now():%H:%M}); mantida a versão anterior."
+
+
+def formatar_idade(idade):
+    """Formata um timedelta como '2 min', '1 h 05 min' etc., para a sidebar."""
+    if idade is None:
+        return "—"
+    minutos = int(idade.total_seconds() // 60)
+    if minutos < 1:
+        return "menos de 1 min"
+    if minutos < 60:
+        return f"{minutos} min"
+    return f"{minutos // 60} h {minutos % 60:02d} min"
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CARGA DA FONTE LOCAL A PARTIR DA EXPORTAÇÃO DO EXTRATOR
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# Abas do Excel gerado por extrator_cqr.py -> alias do catálogo
+ABAS_EXTRATOR = {
+    'Tb_GestorFin2_FATOS': 'g', 'ContasReceber_CAIXA': 'cr', 'ContasPagar_CAIXA': 'cp',
+    'Projetos_DIM': 'p', 'Tecnicos_DIM': 'tec', 'Clientes_DIM': 'cli',
+    'TipoProjeto_DIM': 'tp', 'Negocio_DIM': 'neg', 'StatusProjeto_DIM': 'st',
+}
+
+
+def carregar_exportacao_extrator(caminho_excel, caminho_sqlite):
+    """
+    Preenche (recriando) a base SQLite local com as nove tabelas do universo lidas do
+    Excel de diagnóstico do extrator. Retorna {tabela: linhas gravadas}.
+    """
+    abas = pd.read_excel(caminho_excel, sheet_name=list(ABAS_EXTRATOR))
+    gravadas = {}
+    with sqlite3.connect(caminho_sqlite) as conn:
+        for aba, alias in ABAS_EXTRATOR.items():
+            tabela = CATALOGO_COLUNAS[alias]['tabela']
+            abas[aba].to_sql(tabela, conn, if_exists='replace', index=False)
+            gravadas[tabela] = len(abas[aba])
+    return gravadas
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Carrega a exportação do extrator em uma base SQLite local.")
+    parser.add_argument("excel", help="Arquivo .xlsx gerado pelo extrator_cqr.py")
+    parser.add_argument("sqlite", help="Arquivo SQLite de destino (ex.: cqr_local.db)")
+    args = parser.parse_args()
+    for tabela, linhas in carregar_exportacao_extrator(args.excel, args.sqlite).items():
+        print(f"{tabela}: {linhas} registros")
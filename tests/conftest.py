@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# ═══════════════════════════════════════════════════════════════════════════════
+# FIXTURES DOS TESTES DO MOTOR: BASE SQLITE PEQUENA E UNIVERSO MONTADO A PARTIR DELA
+# ═══════════════════════════════════════════════════════════════════════════════
+import os
+import sys
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import motor_dados as md
+
+
+def gerar_tabelas(semente=0, linhas=400):
+    """Tabelas de origem com o layout do banco (Ano/Mes da fato como texto, com espaços)."""
+    r = np.random.default_rng(semente)
+    tec = pd.DataFrame({'AutNumTec': range(1, 7), 'NomeTec': [f'Tec {i}' for i in range(1, 7)]})
+    cli = pd.DataFrame({'AutNumCli': range(1, 5), 'DescCli': [f'Cli {i}' for i in range(1, 5)]})
+    tp = pd.DataFrame({'AutNumTipo': [1, 2, 3],
+                       'DescTipo': ['PROJETO FECHADO', 'FATURADO POR HRS REALIZADAS', 'OUTRO']})
+    neg = pd.DataFrame({'AutNumNeg': [1, 2]})
+    st_ = pd.DataFrame({'AutNumStatus': [1, 2]})
+    p = pd.DataFrame({
+        'AutNumProj': range(1, 11), 'DescProj': [f'Proj {i}' for i in range(1, 11)],
+        'CodCliProj': r.integers(1, 5, 10), 'CodNegProj': r.integers(1, 3, 10),
+        'TipoProj': r.integers(1, 4, 10), 'StatusProj': r.integers(1, 3, 10),
+        'VlTTFat': r.uniform(1e4, 1e5, 10).round(2),
+    })
+    meses = r.integers(1, 13, linhas)
+    g = pd.DataFrame({
+        'IdGest2': range(linhas), 'ConsultGest': r.integers(1, 7, linhas).astype(str),
+        'ProjGest': r.integers(1, 11, linhas), 'Ano': ' 2024 ', 'Mes': meses.astype(str),
+        'QtHrReal': r.uniform(0, 200, linhas).round(1), 'QtHrOrc': r.uniform(1, 200, linhas).round(1),
+        'ReceitaReal': r.uniform(0, 5e4, linhas).round(2), 'CustoReal': r.uniform(0, 4e4, linhas).round(2),
+        'PercMgReal': r.uniform(0, 1, linhas), 'VlHrOrc': r.uniform(100, 300, linhas),
+        'VlHrCusto': r.uniform(50, 150, linhas), 'ReceitaOrc': r.uniform(0, 5e4, linhas),
+        'CustoOrc': r.uniform(0, 4e4, linhas),
+    })
+    datas = pd.Timestamp('2024-01-01') + pd.to_timedelta(r.integers(0, 366, 120), unit='D')
+    cr = pd.DataFrame({'DtRec': datas.strftime('%Y-%m-%d'), 'Cliente': r.integers(1, 5, 120),
+                       'VlRec': r.uniform(0, 2e4, 120).round(2), 'quitado': r.choice(['S', 'N', ' s'], 120)})
+    cp = pd.DataFrame({'DtPagamento': datas.strftime('%Y-%m-%d'), 'Prestador': r.integers(1, 7, 120),
+                       'VlPago': r.uniform(0, 1e4, 120).round(2), 'quitado': r.choice(['S', 'N'], 120)})
+    return {'g': g, 'cr': cr, 'cp': cp, 'p': p, 'tec': tec, 'cli': cli, 'tp': tp, 'neg': neg, 'st': st_}
+
+
+def gravar_base(caminho, tabelas):
+    with sqlite3.connect(caminho) as con:
+        for alias, df in tabelas.items():
+            df.to_sql(md.CATALOGO_COLUNAS[alias]['tabela'], con, index=False, if_exists='replace')
+
+
+def ler_tabelas(conn):
+    """{alias: DataFrame} lidos como em `buscar_tabelas`: SELECT * e esquema do alias."""
+    return {
+        alias: md.aplicar_esquema(md.ler_sql(md.montar_query(md.CATALOGO_COLUNAS[alias]['tabela']), conn), alias)
+        for alias in ['g'] + md.ALIASES_DIMENSOES
+    }
+
+
+def montar_universo(dfs):
+    """Mesmo pipeline de `UniversoDados._montar_universo` (junções em pandas)."""
+    dimensoes = {alias: dfs[alias] for alias in md.ALIASES_DIMENSOES}
+    df = md.entrelacar_dimensoes(md.preparar_fato(dfs['g']), md.indexar_dimensoes(dimensoes))
+    df = md.criar_dimensoes_quanticas(md.mapear_metricas(df))
+    return df.drop_duplicates(subset=md.CHAVE_UNIVERSO)
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    """
+    Arquivo SQLite com as tabelas do catálogo e uma conexão aberta para ele. O motor passa a
+    ler a fonte local (`fonte` = "sqlite") e grava snapshots no diretório temporário.
+    """
+    caminho = str(tmp_path / 'cqr_teste.db')
+    gravar_base(caminho, gerar_tabelas())
+    config = {'fonte': 'sqlite', 'caminho_sqlite': caminho, 'diretorio_snapshot': str(tmp_path / 'snapshot')}
+    monkeypatch.setattr(md, 'config_motor', lambda chave, padrao=None: config.get(chave, padrao))
+    md.fonte_dados.clear()
+    conn = sqlite3.connect(caminho)
+    yield caminho, conn
+    conn.close()
+    md.fonte_dados.clear()
+
+
+@pytest.fixture
+def universo(base):
+    _, conn = base
+    return montar_universo(ler_tabelas(conn))
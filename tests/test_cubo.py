@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Cubo OLAP pré-agregado conferido contra as linhas do universo."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import motor_dados as md
+
+P = md.periodo
+
+
+@pytest.fixture
+def cubo(universo):
+    return md.CuboOLAP(universo)
+
+
+def fatia_e_linhas(universo, cubo, selecao, periodos):
+    intervalo = md.IndicePeriodos(universo).limites(*periodos) if periodos is not None else None
+    return md.IndiceFiltros(universo).filtrar(selecao, intervalo), cubo.fatia(selecao, periodos)
+
+
+@pytest.mark.parametrize('selecao, periodos', [
+    ({}, None),
+    ({}, (P(2024, 6), P(2024, 6))),
+    ({'Consultor': ['Tec 1', 'Tec 3']}, (P(2024, 1), P(2024, 6))),
+    ({'Cliente': ['Cli 2'], 'TipoProj': ['PROJETO FECHADO', 'OUTRO']}, (P(2024, 4), P(2024, 12))),
+    ({'Projeto': ['Proj 5']}, None),
+])
+def test_fatias_do_cubo_respondem_igual_as_linhas(universo, cubo, selecao, periodos):
+    linhas, celulas = fatia_e_linhas(universo, cubo, selecao, periodos)
+    assert len(linhas) > 0
+    assert cubo.verificar(linhas, celulas) == []
+
+
+def test_cubo_agrega_no_grao_das_dimensoes(universo, cubo):
+    grao = universo.groupby(md.DIMENSOES_CUBO, observed=True).ngroups
+    assert len(cubo) == grao
+    assert cubo.celulas['Periodo'].is_monotonic_increasing
+    assert cubo.totais(cubo.celulas)['Linhas'] == len(universo)
+
+
+def test_verificar_acusa_celula_adulterada(universo, cubo):
+    linhas, celulas = fatia_e_linhas(universo, cubo, {'Consultor': ['Tec 2']}, None)
+    adulteradas = celulas.copy()
+    adulteradas.iloc[0, adulteradas.columns.get_loc('Receita')] += 1.0
+    divergencias = cubo.verificar(linhas, adulteradas)
+    assert 'Receita' in divergencias and 'rollup por Consultor' in divergencias
+    assert 'Linhas' not in divergencias
+
+    # Uma célula a menos muda a contagem de linhas
+    assert 'Linhas' in cubo.verificar(linhas, celulas.iloc[1:])
+
+
+def test_agregar_conta_e_rejeita_funcao_desconhecida(universo, cubo):
+    contagem = cubo.agregar(cubo.celulas, 'Cliente', linhas=('Receita', 'count'), margens=('Margem', 'count'))
+    esperado = universo.groupby('Cliente', observed=True).agg(linhas=('Receita', 'size'), margens=('Margem', 'count'))
+    assert np.array_equal(contagem.to_numpy(), esperado.to_numpy())
+    with pytest.raises(ValueError):
+        cubo.agregar(cubo.celulas, 'Cliente', x=('Receita', 'max'))
+
+
+def test_cubo_de_universo_vazio(universo):
+    cubo = md.CuboOLAP(universo.iloc[:0])
+    assert len(cubo) == 0
+    assert cubo.fatia({'Consultor': ['Tec 1']}, (P(2024, 1), P(2024, 12))).empty
+    assert cubo.totais(cubo.celulas)['Linhas'] == 0
+    assert isinstance(cubo.celulas, pd.DataFrame)
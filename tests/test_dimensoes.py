@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Junções das dimensões por arrays indexados pelo ID (DimensaoIndexada)."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import motor_dados as md
+from conftest import ler_tabelas
+
+
+def referencia_merge(fato, dfs):
+    """Caminho antigo: pd.merge LEFT em sequência, sem a chave repetida da dimensão."""
+    df = fato.drop_duplicates(subset=md.CHAVE_UNIVERSO)
+    for alias, chave_esq, chave_dir, sufixos in md.JUNCOES_DIMENSOES:
+        dim = dfs[alias]
+        if not md.colunas_anexadas(dim.columns, chave_dir):
+            continue
+        df = pd.merge(df, dim, left_on=chave_esq, right_on=chave_dir, how='left', suffixes=sufixos)
+        df = df.drop(columns=[chave_dir])
+    return df.reset_index(drop=True)
+
+
+@pytest.mark.parametrize('indexadas', [True, False])
+def test_entrelacar_dimensoes_equivale_ao_merge(base, indexadas):
+    _, conn = base
+    dfs = ler_tabelas(conn)
+    fato = md.preparar_fato(dfs['g'])
+    dimensoes = {alias: dfs[alias] for alias in md.ALIASES_DIMENSOES}
+    if indexadas:
+        dimensoes = md.indexar_dimensoes(dimensoes)
+
+    relatorio = []
+    obtido = md.entrelacar_dimensoes(fato, dimensoes, relatorio)
+
+    pd.testing.assert_frame_equal(obtido.reset_index(drop=True), referencia_merge(fato, dfs), check_dtype=False)
+    # neg e st só têm a chave: não acrescentam colunas e ficam fora do relatório
+    assert [etapa['Etapa'] for etapa in relatorio] == ['fato', 'fato deduplicada', '+ tec', '+ p', '+ cli', '+ tp']
+    assert all(etapa['Linhas'] == len(obtido) for etapa in relatorio[1:])
+
+
+@pytest.mark.parametrize('ids, modo', [
+    ([3, 1, 3, 7], 'denso'),
+    ([5, 10**9, 5, 42, -3], 'esparso'),
+    (['a', 'b', 'a'], 'hash'),
+])
+def test_dimensao_indexada_busca_como_merge(ids, modo):
+    dim = pd.DataFrame({'k': ids, 'v': [f'v{i}' for i in range(len(ids))]})
+    indexada = md.DimensaoIndexada(dim, 'k')
+    assert modo == ('denso' if indexada._posicoes is not None
+                    else 'esparso' if indexada._ids_ordenados is not None else 'hash')
+
+    extras = ['z'] if modo == 'hash' else [99, np.nan, 2.5, 10**9 + 1]
+    chaves = pd.Series(list(ids) + extras, index=range(100, 100 + len(ids) + len(extras)))
+    obtido = indexada.buscar(chaves, 'v')
+    assert obtido.index.equals(chaves.index)
+    # Com IDs repetidos vale a primeira linha, como no merge com a dimensão deduplicada
+    primeira = dim.drop_duplicates('k').set_index('k')['v']
+    assert obtido.iloc[:len(ids)].tolist() == primeira.loc[ids].tolist()
+    assert obtido.iloc[len(ids):].isna().all()
+
+
+def test_ids_esparsos_nao_alocam_vetor_denso():
+    dim = pd.DataFrame({'k': np.arange(1000) * 10**7, 'v': np.arange(1000)})
+    indexada = md.DimensaoIndexada(dim, 'k')
+    assert indexada._posicoes is None
+    fato = pd.DataFrame({'c': [0, 10**7 * 999, 5, 10**7 * 3]})
+    anexado = indexada.anexar(fato, 'c', colunas=['v'])
+    assert anexado['v'].iloc[[0, 1, 3]].tolist() == [0, 999, 3]
+    assert np.isnan(anexado['v'].iloc[2])
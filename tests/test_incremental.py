@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Atualização incremental pela marca d'água por mês da tabela fato."""
+import pandas as pd
+
+import motor_dados as md
+from conftest import ler_tabelas, montar_universo
+
+
+def marca(conn):
+    return md.ler_sql(md.query_marca_dagua(), conn)
+
+
+def test_marca_sem_mudanca_nao_acusa_meses(base):
+    _, conn = base
+    assert md.detectar_meses_alterados(marca(conn), marca(conn)) == ([], [])
+
+
+def test_insercao_e_exclusao_acusam_so_os_meses_tocados(base):
+    _, conn = base
+    antiga = marca(conn)
+    conn.execute("INSERT INTO Tb_GestorFin2 (IdGest2, ConsultGest, ProjGest, Ano, Mes, ReceitaReal) "
+                 "VALUES (9999, '1', 1, ' 2024 ', '3', 10.0)")
+    conn.execute("DELETE FROM Tb_GestorFin2 WHERE Mes = '7'")
+    conn.commit()
+
+    alterados, removidos = md.detectar_meses_alterados(antiga, marca(conn))
+
+    # Os pares voltam com os valores brutos do banco, prontos para `filtrar_query_por_meses`
+    assert [md.chave_periodo(ano, mes) for ano, mes in alterados] == [(2024, 3)]
+    assert alterados[0][0] == ' 2024 '
+    assert removidos == [(2024, 7)]
+
+
+def test_mes_novo_entra_como_alterado(base):
+    _, conn = base
+    antiga = marca(conn)
+    conn.execute("INSERT INTO Tb_GestorFin2 (IdGest2, ConsultGest, ProjGest, Ano, Mes) VALUES (9999, '1', 1, '2025', '1')")
+    conn.commit()
+    alterados, removidos = md.detectar_meses_alterados(antiga, marca(conn))
+    assert alterados == [('2025', '1')] and removidos == []
+
+
+def test_filtrar_query_por_meses_le_so_os_meses_pedidos(base):
+    _, conn = base
+    sql, params = md.filtrar_query_por_meses("SELECT * FROM [Tb_GestorFin2]", [(' 2024 ', '3'), (' 2024 ', '11')])
+    assert params == [' 2024 ', '3', ' 2024 ', '11']
+    lidas = md.ler_sql(sql, conn, params=params)
+    assert set(lidas['Mes']) == {'3', '11'}
+    todas = md.ler_sql("SELECT * FROM [Tb_GestorFin2]", conn)
+    assert len(lidas) == todas['Mes'].isin(['3', '11']).sum()
+
+
+def test_substituir_meses_equivale_a_recarga_completa(base):
+    _, conn = base
+    universo = montar_universo(ler_tabelas(conn))
+    antiga = marca(conn)
+
+    conn.execute("UPDATE Tb_GestorFin2 SET ReceitaReal = ReceitaReal + 1000 WHERE Mes = '4'")
+    conn.execute("INSERT INTO Tb_GestorFin2 (IdGest2, ConsultGest, ProjGest, Ano, Mes, ReceitaReal, QtHrOrc) "
+                 "VALUES (9999, '2', 3, ' 2024 ', '4', 500.0, 10.0)")
+    conn.execute("DELETE FROM Tb_GestorFin2 WHERE Mes = '9'")
+    conn.commit()
+
+    alterados, removidos = md.detectar_meses_alterados(antiga, marca(conn))
+    tabelas = ler_tabelas(conn)
+    sql, params = md.filtrar_query_por_meses(md.montar_query('Tb_GestorFin2'), alterados)
+    tabelas['g'] = md.aplicar_esquema(md.ler_sql(sql, conn, params=params), 'g')
+    novas_linhas = montar_universo(tabelas)
+
+    meses = {md.chave_periodo(ano, mes) for ano, mes in alterados} | set(removidos)
+    incremental = md.substituir_meses(universo, novas_linhas, meses)
+    completo = montar_universo(ler_tabelas(conn))
+
+    assert incremental['Periodo'].is_monotonic_increasing
+    assert set(incremental['Consultor'].cat.categories) == set(completo['Consultor'].cat.categories)
+    chave = ['Periodo', 'IdGest2']
+    pd.testing.assert_frame_equal(
+        incremental.sort_values(chave, ignore_index=True).astype({c: str for c in md.COLUNAS_CATEGORICAS}),
+        completo.sort_values(chave, ignore_index=True).astype({c: str for c in md.COLUNAS_CATEGORICAS}),
+        check_like=True, check_dtype=False,
+    )
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Índice invertido dos filtros da sidebar contra as máscaras booleanas equivalentes."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import motor_dados as md
+
+SELECOES = [
+    {},
+    {'Consultor': ['Tec 2']},
+    {'Consultor': ['Tec 1', 'Tec 4'], 'Cliente': ['Cli 2', 'Cli 3']},
+    {'Projeto': ['Proj 1', 'Proj 10'], 'TipoProj': ['OUTRO', 'PROJETO FECHADO']},
+    {'Consultor': ['Tec 3'], 'Cliente': ['Inexistente']},
+]
+PERIODOS = [None, (md.periodo(2024, 5), md.periodo(2024, 5)), (md.periodo(2024, 3), md.periodo(2024, 8)),
+            (md.periodo(2023, 1), md.periodo(2023, 12))]
+
+
+def mascara(df, selecao, periodos):
+    resultado = np.ones(len(df), dtype=bool)
+    for coluna, valores in selecao.items():
+        resultado &= df[coluna].isin(valores).to_numpy()
+    if periodos is not None:
+        resultado &= df['Periodo'].between(*periodos).to_numpy()
+    return resultado
+
+
+def limites(df, periodos):
+    return md.IndicePeriodos(df).limites(*periodos) if periodos is not None else None
+
+
+@pytest.mark.parametrize('periodos', PERIODOS)
+@pytest.mark.parametrize('selecao', SELECOES)
+def test_filtrar_equivale_a_mascara(universo, selecao, periodos):
+    indice = md.IndiceFiltros(universo)
+    obtido = indice.filtrar(selecao, limites(universo, periodos))
+    pd.testing.assert_frame_equal(obtido, universo[mascara(universo, selecao, periodos)])
+
+    ids = indice.selecionar(selecao, limites(universo, periodos))
+    if selecao:
+        assert np.array_equal(ids, np.flatnonzero(mascara(universo, selecao, periodos)))
+    else:
+        assert ids is None
+
+
+def test_valores_nulos_nunca_sao_selecionados(universo):
+    df = universo.copy()
+    df.loc[df.index[:50], 'Cliente'] = np.nan
+    indice = md.IndiceFiltros(df)
+    ids = indice.selecionar({'Cliente': df['Cliente'].cat.categories.tolist()})
+    assert np.array_equal(ids, np.flatnonzero(df['Cliente'].notna().to_numpy()))
+
+
+def test_coluna_nao_categorica_usa_a_mascara(universo):
+    df = universo.astype({'Consultor': str})
+    indice = md.IndiceFiltros(df)
+    assert 'Consultor' not in indice._listas
+    selecao = {'Consultor': ['Tec 5'], 'Cliente': ['Cli 1']}
+    pd.testing.assert_frame_equal(indice.filtrar(selecao), df[mascara(df, selecao, None)])
+
+
+@pytest.mark.parametrize('periodos', PERIODOS[:3])
+def test_opcoes_em_cascata_sao_os_valores_sob_as_demais_selecoes(universo, periodos):
+    indice = md.IndiceFiltros(universo)
+    selecao = {'Consultor': ['Tec 1', 'Tec 4'], 'Cliente': ['Cli 2']}
+    opcoes = indice.opcoes_cascata(selecao, limites(universo, periodos))
+
+    for coluna in indice.colunas:
+        outras = {c: v for c, v in selecao.items() if c != coluna}
+        esperado = set(universo.loc[mascara(universo, outras, periodos), coluna].dropna())
+        assert set(indice.opcoes(coluna, selecao, limites(universo, periodos))) == esperado
+        # Os valores já marcados continuam disponíveis
+        assert opcoes[coluna] == sorted(esperado | set(selecao.get(coluna, [])))
+
+
+def test_opcoes_memorizadas_por_selecao(universo):
+    indice = md.IndiceFiltros(universo)
+    primeira = indice.opcoes('Cliente', {'Consultor': ['Tec 2', 'Tec 1']})
+    assert indice.opcoes('Cliente', {'Consultor': ['Tec 1', 'Tec 2'], 'Cliente': ['Cli 4']}) is primeira
+    assert indice.opcoes('Cliente', {'Consultor': ['Tec 3']}) is not primeira
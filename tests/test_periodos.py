@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Intervalos de períodos da sidebar, somas acumuladas e chave das análises memorizadas."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import motor_dados as md
+
+P = md.periodo
+
+
+def test_somas_acumuladas_equivalem_a_soma_das_linhas(universo):
+    somas = md.somas_contabeis(universo)
+    valores = md.valores_acumulaveis(universo)
+    for inicio, fim in [(P(2024, 1), P(2024, 12)), (P(2024, 4), P(2024, 4)), (P(2024, 2), P(2024, 7)),
+                        (P(2023, 6), P(2024, 2)), (P(2024, 11), P(2025, 3))]:
+        linhas = universo['Periodo'].between(inicio, fim).to_numpy()
+        esperado = valores[linhas].sum()
+        obtido = somas.soma(inicio, fim)
+        assert obtido.keys() == set(valores.columns)
+        assert np.allclose([obtido[c] for c in valores.columns], esperado.to_numpy())
+
+
+def test_somas_acumuladas_zeradas_fora_dos_dados():
+    somas = md.SomasAcumuladas([P(2024, 3), P(2024, 5), P(2024, 5)], pd.DataFrame({'v': [1.0, 2.0, np.nan]}))
+    assert somas.soma(P(2023, 1), P(2024, 2)) == {'v': 0.0}
+    assert somas.soma(P(2025, 1), P(2025, 12)) == {'v': 0.0}
+    # Intervalo invertido é vazio; mês sem linhas dentro da faixa também soma zero
+    assert somas.soma(P(2024, 5), P(2024, 3)) == {'v': 0.0}
+    assert somas.soma(P(2024, 4), P(2024, 4)) == {'v': 0.0}
+    assert somas.soma(P(2024, 1), P(2024, 12)) == {'v': 3.0}
+    assert md.SomasAcumuladas([], pd.DataFrame({'v': []})).soma(0, P(2030, 1)) == {'v': 0.0}
+
+
+@pytest.mark.parametrize('modo, mes, inicio, esperado', [
+    ('Mês', 5, None, (P(2024, 5), P(2024, 5))),
+    ('Trimestre', 5, None, (P(2024, 4), P(2024, 6))),
+    ('Trimestre', 12, None, (P(2024, 10), P(2024, 12))),
+    ('Acumulado do Ano', 5, None, (P(2024, 1), P(2024, 5))),
+    ('Últimos 12 Meses', 5, None, (P(2023, 6), P(2024, 5))),
+    ('Intervalo', 5, P(2024, 9), (P(2024, 5), P(2024, 9))),
+    ('Intervalo', 5, P(2023, 11), (P(2023, 11), P(2024, 5))),
+    ('Intervalo', 5, None, (P(2024, 5), P(2024, 5))),
+])
+def test_intervalo_periodos(modo, mes, inicio, esperado):
+    assert md.intervalo_periodos(modo, 2024, mes, inicio) == esperado
+
+
+def test_intervalo_dos_filtros():
+    assert md.intervalo_dos_filtros({'ano': '2024', 'mes': 3}) == (P(2024, 3), P(2024, 3))
+    assert md.intervalo_dos_filtros({'ano': 2024, 'mes': 3, 'periodo_inicio': P(2024, 1),
+                                     'periodo_fim': P(2024, 3)}) == (P(2024, 1), P(2024, 3))
+    assert md.intervalo_dos_filtros({'consultores': ['TODOS']}) is None
+    with pytest.raises(ValueError):
+        md.intervalo_dos_filtros({'ano': '2024', 'mes': 'março'})
+
+
+def test_assinatura_distingue_intervalos_com_o_mesmo_inicio():
+    base = {'consultores': ['Tec 2', 'Tec 1'], 'clientes': ['TODOS'], 'ano': 2024, 'mes': 6}
+    trimestre = {**base, 'modo_periodo': 'Trimestre', 'periodo_inicio': P(2024, 4), 'periodo_fim': P(2024, 6)}
+    intervalo = {**base, 'modo_periodo': 'Intervalo', 'periodo_inicio': P(2024, 4), 'periodo_fim': P(2024, 9)}
+    mesmo_intervalo = {**intervalo, 'modo_periodo': 'Trimestre', 'periodo_fim': P(2024, 6)}
+
+    assert md.assinatura_filtros(trimestre) != md.assinatura_filtros(intervalo)
+    # Mesmo intervalo com outro modo também não divide entrada (rótulos e comparativos mudam)
+    assert md.assinatura_filtros(trimestre) != md.assinatura_filtros({**trimestre, 'modo_periodo': 'Intervalo'})
+    assert md.assinatura_filtros(trimestre) == md.assinatura_filtros(mesmo_intervalo)
+    # Ordem dos valores e 'TODOS' não alteram a chave
+    assert md.assinatura_filtros(trimestre) == md.assinatura_filtros(
+        {**trimestre, 'consultores': ['Tec 1', 'Tec 2'], 'clientes': []})
+
+
+def test_assinatura_com_periodo_invalido_usa_os_campos_brutos():
+    invalido = {'ano': '2024', 'mes': 'março'}
+    assert md.assinatura_filtros(invalido) == md.assinatura_filtros(dict(invalido))
+    assert md.assinatura_filtros(invalido) != md.assinatura_filtros({'ano': '2024', 'mes': 'abril'})
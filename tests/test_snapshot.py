@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Snapshot local do universo: chave versionada e gravação/leitura em Parquet."""
+import pandas as pd
+
+import motor_dados as md
+
+QUERIES = {'g': "SELECT [Ano], [Mes] FROM [Tb_GestorFin2]", 'tec': "SELECT * FROM [tb_tec]"}
+
+
+def versao(checksum_g=1.0):
+    return pd.DataFrame({'Alias': ['tec', 'g'], 'Linhas': [6, 400], 'Checksum': [21.0, checksum_g]})
+
+
+def test_chave_snapshot_estavel_e_independente_da_ordem_da_sonda():
+    chave = md.chave_snapshot('universo', QUERIES, versao())
+    assert chave == md.chave_snapshot('universo', dict(reversed(list(QUERIES.items()))), versao().iloc[::-1])
+    assert len(chave) == 16
+
+
+def test_chave_snapshot_muda_com_fontes_queries_e_pipeline(monkeypatch):
+    chave = md.chave_snapshot('universo', QUERIES, versao())
+    assert md.chave_snapshot('universo', QUERIES, versao(checksum_g=2.0)) != chave
+    assert md.chave_snapshot('universo', {**QUERIES, 'g': "SELECT * FROM [Tb_GestorFin2]"}, versao()) != chave
+    assert md.chave_snapshot('outro', QUERIES, versao()) != chave
+    monkeypatch.setattr(md, 'VERSAO_PIPELINE', md.VERSAO_PIPELINE + 1)
+    assert md.chave_snapshot('universo', QUERIES, versao()) != chave
+
+
+def test_snapshot_grava_e_restaura_so_a_chave_atual(base, universo):
+    tabelas = {'universo': universo, 'marca': pd.DataFrame({'Ano': [' 2024 '], 'Mes': ['1']})}
+    assert md.salvar_snapshot('universo', 'chave1', tabelas)
+
+    restaurado = md.carregar_snapshot('universo', 'chave1')
+    pd.testing.assert_frame_equal(restaurado['universo'], universo.reset_index(drop=True))
+    pd.testing.assert_frame_equal(restaurado['marca'], tabelas['marca'])
+    assert md.carregar_snapshot('universo', 'outra') is None
+
+    # Uma gravação nova substitui os arquivos da anterior
+    assert md.salvar_snapshot('universo', 'chave2', tabelas)
+    assert md.carregar_snapshot('universo', 'chave1') is None
+    assert md.carregar_snapshot('universo', 'chave2') is not None
+
+
+def test_falha_ao_gravar_snapshot_vai_para_as_mensagens(base, monkeypatch):
+    caminho, _ = base
+    # O "diretório" do snapshot é o arquivo da base: makedirs falha
+    monkeypatch.setattr(md, '_diretorio_snapshot', lambda nome: caminho)
+    mensagens = md.MensagensCarga(silencioso=True)
+    assert not md.salvar_snapshot('universo', 'chave', {'marca': pd.DataFrame({'a': [1]})}, mensagens)
+    assert len(mensagens.registradas) == 1
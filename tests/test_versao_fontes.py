@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Sonda de versão das tabelas de origem (contagem + checksum por alias)."""
+import pandas as pd
+
+import motor_dados as md
+
+
+def sonda(conn):
+    return md.ler_sql(md.query_versao_fontes(), conn)
+
+
+def test_sonda_traz_uma_linha_por_alias_do_catalogo(base):
+    _, conn = base
+    versao = sonda(conn)
+    assert sorted(versao['Alias']) == sorted(md.CATALOGO_COLUNAS)
+    assert versao.set_index('Alias').loc['g', 'Linhas'] == 400
+
+
+def test_tabelas_alteradas_acusa_so_as_tabelas_tocadas(base):
+    _, conn = base
+    antiga = sonda(conn)
+    assert md.tabelas_alteradas(antiga, sonda(conn)) == set()
+
+    conn.execute("INSERT INTO tb_tec (AutNumTec, NomeTec) VALUES (99, 'Tec 99')")
+    conn.execute("DELETE FROM Tb_GestorFin2 WHERE IdGest2 = 0")
+    conn.commit()
+    assert md.tabelas_alteradas(antiga, sonda(conn)) == {'tec', 'g'}
+
+
+def test_tabelas_alteradas_sem_sonda_anterior_considera_todas(base):
+    _, conn = base
+    nova = sonda(conn)
+    assert md.tabelas_alteradas(None, nova) == set(md.CATALOGO_COLUNAS)
+    assert md.tabelas_alteradas(pd.DataFrame(), nova) == set(md.CATALOGO_COLUNAS)
+
+
+def test_tabelas_alteradas_compara_valores_e_nao_tipos():
+    antiga = pd.DataFrame({'Alias': ['g', 'p'], 'Linhas': [10, 5], 'Checksum': [3.0, 7.0]})
+    nova = pd.DataFrame({'Alias': ['p', 'g', 'cr'], 'Linhas': [5, 10, 1], 'Checksum': [7.0, 4.0, 1.0]})
+    assert md.tabelas_alteradas(antiga, nova) == {'g', 'cr'}
+
+
+def test_sqlite_nao_detecta_edicao_no_lugar(base):
+    # Limite documentado da fonte local: o checksum por rowid não muda com UPDATE
+    _, conn = base
+    assert not md.fonte_dados().detecta_edicoes
+    antiga = sonda(conn)
+    conn.execute("UPDATE Tb_GestorFin2 SET ReceitaReal = ReceitaReal + 1")
+    conn.commit()
+    assert md.tabelas_alteradas(antiga, sonda(conn)) == set()